@@ -16,6 +16,7 @@ from typing import List, Dict, Any
 from sqlmodel import Session
 
 from app.ai.llm_local import call_local_llm
+from app.ai.cancellation import check_cancelled, current_token
 from app.ai.planner import simple_plan, llm_plan
 from app.ai.tools.tool_router import call_tool
 from app.ai.prompt_engine import (
@@ -62,6 +63,9 @@ def execute_step(step: Dict[str, Any], user, conversation, session: Session):
     if action == "call_tool":
         tool = step.get("tool")
         args = step.get("args", {})
+        if tool == "system_control":
+            # commands are queued per user / device (services/command_queue.py)
+            args = dict(args, user_id=user.id)
         try:
             result = call_tool(tool, **args)
         except Exception as e:
@@ -98,6 +102,7 @@ def process_user_message(user, conversation, text: str):
     (4) Execute steps (tool or llm)
     (5) Reflection fix (retry if needed)
     (6) Save memory from final output
+    Raises GenerationCancelled if the turn's CancelToken fires (see cancellation.py).
     """
     # DB session created by caller (routes_chat)
     from sqlmodel import Session
@@ -107,6 +112,7 @@ def process_user_message(user, conversation, text: str):
 
         # ----------------------------
         # LOAD RECENT HISTORY
+        # (write-through cache; only touches the DB on a miss)
         # ----------------------------
         history_db = crud.get_last_messages(session, conversation.id, limit=MAX_HISTORY)
         short_history = format_history(history_db)
@@ -114,7 +120,10 @@ def process_user_message(user, conversation, text: str):
         # ----------------------------
         # GET RELEVANT MEMORY
         # ----------------------------
-        memory_snippets = get_relevant_memory(user.id, text)
+        # history_db already holds the message being answered (stored before the brain runs)
+        memory_snippets = get_relevant_memory(
+            user.id, text, conversation.id, exclude_ids=[m.id for m in history_db]
+        )
 
         # ----------------------------
         # BUILD SYSTEM + FULL PROMPT
@@ -141,6 +150,7 @@ def process_user_message(user, conversation, text: str):
         results = []
         if plan.get("steps"):
             for step in plan["steps"]:
+                check_cancelled()
                 try:
                     out = execute_step(step, user, conversation, session)
                     results.append(out)
@@ -156,8 +166,12 @@ def process_user_message(user, conversation, text: str):
         # ----------------------------
         # REFLECTION IMPROVEMENT
         # ----------------------------
+        check_cancelled()
         improved, new_reply = reflect_and_retry(text, combined_reply, user)
         final_reply = new_reply if improved else combined_reply
+        # the reply is final: a late cancel must not abort (and half-apply)
+        # the memory bookkeeping below, which may call the LLM to summarize
+        current_token.set(None)
 
         # ----------------------------
         # SAVE MEMORY (long-term)
@@ -0,0 +1,80 @@
+# app/ai/cancellation.py
+"""
+Cooperative cancellation for a chat turn.
+
+The brain runs in a worker thread, so cancelling the awaiting asyncio task
+alone would leave the thread (and the LLM subprocess) running to the end.
+A CancelToken is bound to the turn through a ContextVar, which the threadpool
+hop copies, so deep code can reach it without extra arguments:
+- call_local_llm registers its subprocess and gets killed on cancel
+- the brain checks between planner steps and stops early
+"""
+
+import contextvars
+import os
+import signal
+import subprocess
+import threading
+from typing import Optional, Set
+
+
+class GenerationCancelled(BaseException):
+    """
+    Raised inside the brain when the current turn was cancelled. Like
+    asyncio.CancelledError it is a BaseException, so the brain's many
+    `except Exception` fallbacks don't turn it into a reply.
+    """
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._procs: Set[subprocess.Popen] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Mark cancelled and kill any running LLM process (callable from any thread)."""
+        self._event.set()
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            kill_process(proc)
+
+    def register(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.add(proc)
+        if self.cancelled:  # cancelled before the process existed
+            kill_process(proc)
+
+    def unregister(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise GenerationCancelled()
+
+
+def kill_process(proc: subprocess.Popen):
+    """Kill proc and, when it leads its own session (start_new_session=True), its children."""
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except Exception:
+        pass
+
+
+current_token: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("zylos_cancel_token", default=None)
+
+
+def check_cancelled():
+    """Raise GenerationCancelled if the current turn (if any) was cancelled."""
+    token = current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
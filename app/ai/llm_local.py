@@ -10,9 +10,17 @@ import subprocess
 import time
 from typing import Optional
 from ..core.config import settings
+from .cancellation import current_token, kill_process
 
 DEFAULT_TIMEOUT = 30  # seconds
 
+# call_local_llm reports failures in-band instead of raising
+LLM_FAILURE_PREFIXES = ("[LLM error]", "[LLM timeout]")
+
+def is_llm_failure(text: Optional[str]) -> bool:
+    """True for empty output and the error / timeout strings call_local_llm returns."""
+    return not text or not text.strip() or text.startswith(LLM_FAILURE_PREFIXES)
+
 def call_local_llm(prompt: str, max_tokens: int = 512, timeout: int = DEFAULT_TIMEOUT) -> str:
     """
     Basic CLI wrapper that invokes a model runner command.
@@ -33,12 +41,33 @@ def call_local_llm(prompt: str, max_tokens: int = 512, timeout: int = DEFAULT_TI
         # default take generic CLI form
         cmd = f'{shlex.quote(cmd_template)} --model {shlex.quote(model_path)} --prompt {shlex.quote(prompt)} --n_predict {int(max_tokens)}'
 
+    token = current_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
     try:
         start = time.time()
-        out = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT, text=True, timeout=timeout)
+        # Popen rather than check_output so a cancelled turn can kill the runner
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                start_new_session=True)
+    except Exception as e:
+        return f"[LLM error] {str(e)}"
+    if token is not None:
+        token.register(proc)
+    try:
+        out, _ = proc.communicate(timeout=timeout)
         elapsed = time.time() - start
+        if token is not None:
+            token.raise_if_cancelled()
+        if proc.returncode != 0:
+            return f"[LLM error] exit {proc.returncode}: {out.strip()}"
         return out.strip()
     except subprocess.TimeoutExpired:
+        kill_process(proc)
+        proc.communicate()
         return "[LLM timeout]"
     except Exception as e:
-        return f"[LLM error] {str(e)}"
\ No newline at end of file
+        kill_process(proc)
+        return f"[LLM error] {str(e)}"
+    finally:
+        if token is not None:
+            token.unregister(proc)
\ No newline at end of file
@@ -5,21 +5,26 @@ Memory Engine for Zylos
 
 Manages three tiers of memory:
 - Short-term: Conversation-level ephemeral storage (fast, non-persistent).
-- Mid-term: Per-user rolling summaries (persisted).
-- Long-term: Per-user knowledge items (persisted + vectorized for RAG).
+- Mid-term: Per-user hierarchical rolling summaries (persisted).
+- Long-term: Per-user knowledge items in monthly buckets (persisted + vectorized for RAG).
 
 Also includes a simple knowledge graph for storing entity relationships.
 """
 
+import hashlib
 import json
+import re
 import threading
 import time
 import os
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 from .rag_engine import search as rag_search, rank_candidates
 from ..core.config import settings
+from .llm_local import is_llm_failure
 from .summarizer import summarize_text
 
 LOCK = threading.RLock()
@@ -30,10 +35,14 @@ MID_PATH = os.path.join(DATA_DIR, "memory_mid.json")
 KG_PATH = os.path.join(DATA_DIR, "memory_kg.json")
 
 # --- In-memory & persisted data stores ---
-_short_memory: Dict[str, List[Dict[str, Any]]] = {}  # {conv_id: [{text, ts, user_id, role}]}
-_mid_cache: Dict[str, List[Dict[str, Any]]] = {}      # {user_id: [{summary, ts}]}
-_long_cache: Dict[str, List[Dict[str, Any]]] = {}     # {user_id: [{id, type, text, meta, ts}]}
+_short_memory: "OrderedDict[str, _ShortBuffer]" = OrderedDict()  # {conv_id: ring buffer}, LRU order
+_short_item_count = 0                                # items across all short-term buffers
+_mid_cache: Dict[str, Dict[str, Any]] = {}           # {user_id: {levels: [[{summary, ts, turns}]], pending: [text]}}
+_mid_view: Dict[str, List[str]] = {}                 # {user_id: flattened summaries, oldest -> newest} (not persisted)
+_long_cache: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}  # {user_id: {"YYYY-MM": [{id, type, text, meta, ts}]}}
 _kg: Dict[str, Dict[str, Any]] = {}                  # {node: {relations: {rel: [targets]}, meta: {}}}
+_dedup_stats = {"checked": 0, "merged": 0, "embed_checks": 0}
+_summary_backoff: Dict[str, Tuple[float, float]] = {}  # {user_id: (retry at (monotonic), delay)} after failures
 
 # --- Initialization ---
 def _load_json(path: str) -> Dict:
@@ -59,7 +68,19 @@ def _initialize_stores():
     os.makedirs(DATA_DIR, exist_ok=True)
     with LOCK:
         _mid_cache = _load_json(MID_PATH)
+        for user_id, state in list(_mid_cache.items()):
+            if isinstance(state, list):
+                # legacy flat list of summaries -> treat as leaves
+                _mid_cache[user_id] = {"levels": [[dict(s, turns=0) for s in state]], "pending": []}
+        _mid_view.clear()
         _long_cache = _load_json(LONG_PATH)
+        for user_id, items in list(_long_cache.items()):
+            if isinstance(items, list):
+                # legacy flat list -> monthly buckets
+                buckets: Dict[str, List[Dict[str, Any]]] = {}
+                for it in items:
+                    buckets.setdefault(_bucket_key(it.get("ts") or _now_ts()), []).append(it)
+                _long_cache[user_id] = buckets
         _kg = _load_json(KG_PATH)
 
 # --- Persistence Helpers ---
@@ -79,62 +100,339 @@ def _persist_kg():
 def _now_ts() -> str:
     return datetime.utcnow().isoformat() + "Z"
 
+def _bucket_key(ts: str) -> str:
+    """Monthly partition key ("YYYY-MM") of an ISO timestamp."""
+    return ts[:7]
+
+def _iter_recent_long(user_id: str):
+    """Yields a user's long-term items newest -> oldest, bucket by bucket (LOCK held)."""
+    buckets = _long_cache.get(user_id)
+    if not buckets:
+        return
+    for key in sorted(buckets, reverse=True):
+        yield from reversed(buckets[key])
+
 # --------------------------------
 # SHORT-TERM MEMORY (CONVERSATION)
 # --------------------------------
+class _ShortItem:
+    """One conversation turn held in a short-term buffer."""
+    __slots__ = ("text", "role", "user_id", "ts")
+
+    def __init__(self, text: Optional[str], role: str, user_id: Optional[str], ts: str):
+        self.text = text
+        self.role = role
+        self.user_id = user_id
+        self.ts = ts
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"text": self.text, "role": self.role, "user_id": self.user_id, "ts": self.ts}
+
+
+class _ShortBuffer:
+    """Fixed-capacity ring buffer of turns for a single conversation."""
+    __slots__ = ("items", "last_access")
+
+    def __init__(self, capacity: int):
+        self.items: deque = deque(maxlen=capacity)
+        self.last_access = time.monotonic()
+
+
+def _drop_short(conversation_id: str):
+    global _short_item_count
+    buf = _short_memory.pop(conversation_id, None)
+    if buf is not None:
+        _short_item_count -= len(buf.items)
+
+def _evict_short(now: float):
+    """Drops idle conversations (TTL), then least-recently-used ones until under the caps."""
+    idle_before = now - settings.SHORT_TERM_IDLE_TTL_SECONDS
+    # OrderedDict is kept in access order, so idle buffers sit at the front.
+    while _short_memory:
+        conv_id, buf = next(iter(_short_memory.items()))
+        if buf.last_access >= idle_before:
+            break
+        _drop_short(conv_id)
+
+    while _short_memory and (
+        len(_short_memory) > settings.SHORT_TERM_MAX_CONVERSATIONS
+        or _short_item_count > settings.SHORT_TERM_MAX_ITEMS
+    ):
+        _drop_short(next(iter(_short_memory)))
+
 def add_short_memory(conversation_id: str, item: Dict[str, Any]):
     """Adds an item to the ephemeral conversation history."""
+    global _short_item_count
+    now = time.monotonic()
     with LOCK:
-        history = _short_memory.setdefault(conversation_id, [])
-        history.append({
-            "text": item.get("text"),
-            "role": item.get("role", "user"),
-            "user_id": item.get("user_id"),
-            "ts": item.get("ts", _now_ts())
-        })
-        # Keep short-term memory bounded
-        if len(history) > settings.SHORT_TERM_MEMORY_LIMIT:
-            _short_memory[conversation_id] = history[-settings.SHORT_TERM_MEMORY_LIMIT:]
+        buf = _short_memory.get(conversation_id)
+        if buf is None:
+            buf = _short_memory[conversation_id] = _ShortBuffer(settings.SHORT_TERM_MEMORY_LIMIT)
+        else:
+            _short_memory.move_to_end(conversation_id)
+        # deque(maxlen) discards the oldest turn itself; only growth counts toward the cap
+        if len(buf.items) < buf.items.maxlen:
+            _short_item_count += 1
+        buf.items.append(_ShortItem(
+            item.get("text"),
+            item.get("role", "user"),
+            item.get("user_id"),
+            item.get("ts", _now_ts())
+        ))
+        buf.last_access = now
+        _evict_short(now)
 
 def retrieve_short(conversation_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """Retrieves the last N items from a conversation."""
+    """Retrieves the last N items from a conversation (oldest -> newest)."""
+    now = time.monotonic()
+    with LOCK:
+        buf = _short_memory.get(conversation_id)
+        if buf is None:
+            return []
+        if buf.last_access < now - settings.SHORT_TERM_IDLE_TTL_SECONDS:
+            _drop_short(conversation_id)
+            return []
+        buf.last_access = now
+        _short_memory.move_to_end(conversation_id)
+        # walk back from the newest entry so cost is O(limit), not O(buffer)
+        recent = [it.as_dict() for it in islice(reversed(buf.items), max(limit, 0))]
+    recent.reverse()
+    return recent
+
+def clear_short_memory(conversation_id: str):
+    """Forgets a conversation's short-term buffer."""
     with LOCK:
-        return _short_memory.get(conversation_id, [])[-limit:].copy()
+        _drop_short(conversation_id)
 
 # ---------------------------
 # MID-TERM MEMORY (SUMMARIES)
 # ---------------------------
-def add_mid_memory(user_id: str, summary: str, ts: Optional[str] = None):
-    """Adds a new summary to the user's mid-term memory."""
+# Summaries form a per-user hierarchy. New dialog turns collect in `pending`
+# until SUMMARIZE_MEMORY_INTERVAL of them are summarized into one leaf (level 0).
+# When a level holds SUMMARY_FANOUT entries they are merged into a single entry
+# one level up, so the LLM only ever reads each piece of text once and the
+# whole history stays covered by O(log n) summaries.
+def _mid_state(user_id: str) -> Dict[str, Any]:
+    return _mid_cache.setdefault(user_id, {"levels": [], "pending": []})
+
+def _mid_flatten(state: Dict[str, Any]) -> List[str]:
+    # Higher levels cover older spans, so top -> leaves is chronological.
+    return [e["summary"] for level in reversed(state["levels"]) for e in level]
+
+def _mid_full_level(user_id: str) -> Optional[int]:
+    """Returns the lowest level that needs merging, if any (LOCK held)."""
+    levels = _mid_state(user_id)["levels"]
+    for i, level in enumerate(levels[:settings.SUMMARY_MAX_LEVELS - 1]):
+        if len(level) >= settings.SUMMARY_FANOUT:
+            return i
+    return None
+
+def _mid_cascade(user_id: str):
+    """Merges full levels upward. LLM calls run outside the lock."""
+    while True:
+        with LOCK:
+            i = _mid_full_level(user_id)
+            if i is None:
+                return
+            levels = _mid_state(user_id)["levels"]
+            batch = levels[i][:settings.SUMMARY_FANOUT]
+            del levels[i][:settings.SUMMARY_FANOUT]
+        merged = None
+        try:
+            merged = summarize_text("\n\n".join(e["summary"] for e in batch), max_tokens=200)
+        except Exception as e:
+            print(f"Could not merge summaries for user {user_id}: {e}")
+        finally:
+            # put the batch back (also when the turn is cancelled mid-call);
+            # it will be retried on the next cascade
+            if is_llm_failure(merged):
+                with LOCK:
+                    _mid_state(user_id)["levels"][i][:0] = batch
+                    _mid_view.pop(user_id, None)
+        if is_llm_failure(merged):
+            return
+        with LOCK:
+            levels = _mid_state(user_id)["levels"]
+            if len(levels) <= i + 1:
+                levels.append([])
+            levels[i + 1].append({
+                "summary": merged,
+                "ts": batch[-1]["ts"],
+                "turns": sum(e.get("turns", 0) for e in batch)
+            })
+            top = levels[-1]
+            if len(top) > 200:
+                top[:] = top[-200:]
+            _mid_view.pop(user_id, None)
+        _persist_mid()
+
+def add_mid_memory(user_id: str, summary: str, ts: Optional[str] = None, turns: int = 0):
+    """Adds a new leaf summary to the user's mid-term memory, merging full levels upward."""
     with LOCK:
-        summaries = _mid_cache.setdefault(user_id, [])
-        summaries.append({"summary": summary, "ts": ts or _now_ts()})
-        if len(summaries) > 200:
-            summaries[:] = summaries[-200:]
+        levels = _mid_state(user_id)["levels"]
+        if not levels:
+            levels.append([])
+        levels[0].append({"summary": summary, "ts": ts or _now_ts(), "turns": turns})
+        _mid_view.pop(user_id, None)
     _persist_mid()
+    _mid_cascade(user_id)
 
 def get_mid_memory(user_id: str, limit: int = 10) -> List[str]:
-    """Retrieves the last N summaries for a user."""
+    """Retrieves up to N summaries for a user, coarse (oldest) to fine (newest)."""
+    with LOCK:
+        view = _mid_view.get(user_id)
+        if view is None:
+            state = _mid_cache.get(user_id)
+            if not state:
+                return []
+            view = _mid_view[user_id] = _mid_flatten(state)
+        return view[-limit:] if limit > 0 else []
+
+# ---------------------------
+# NEAR-DUPLICATE DETECTION
+# ---------------------------
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+def _simhash(text: str) -> int:
+    """64-bit SimHash over word unigrams + bigrams of the normalized text."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    features = tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]
+    if not features:
+        return 0
+    weights = [0] * 64
+    for f in features:
+        h = int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    sig = 0
+    for bit, w in enumerate(weights):
+        if w > 0:
+            sig |= 1 << bit
+    return sig
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def _scan_recent(user_id: str, sig: int):
+    """
+    Compares `sig` with the user's most recent items (LOCK held).
+    Returns (exact_duplicate, loose_candidates): SimHash matches within
+    MEMORY_DEDUP_MAX_HAMMING are duplicates outright; those within the loose
+    radius are left for the optional embedding check.
+    """
+    loose = []
+    window = settings.MEMORY_DEDUP_WINDOW
+    for existing in islice(_iter_recent_long(user_id), window):
+        other = existing.get("sig")
+        if other is None:
+            if not existing.get("text"):
+                continue
+            other = existing["sig"] = _simhash(existing["text"])
+        dist = _hamming(sig, other)
+        if dist <= settings.MEMORY_DEDUP_MAX_HAMMING:
+            return existing, []
+        if dist <= settings.MEMORY_DEDUP_LOOSE_HAMMING:
+            loose.append(existing)
+    return None, loose
+
+def _embedding_duplicate(text: str, candidates: List[Dict[str, Any]], vector_store) -> Optional[Dict[str, Any]]:
+    """Returns the first candidate whose embedding is within the configured cosine threshold."""
+    threshold = settings.MEMORY_DEDUP_EMBED_THRESHOLD
+    model = getattr(vector_store, "model", None)
+    if threshold is None or model is None or not candidates:
+        return None
+    try:
+        embs = model.encode([text] + [c["text"] for c in candidates], convert_to_numpy=True, normalize_embeddings=True)
+    except Exception as e:
+        print(f"Embedding dedup check failed: {e}")
+        return None
     with LOCK:
-        summaries = _mid_cache.get(user_id, [])[-limit:]
-        return [s["summary"] for s in summaries]
+        _dedup_stats["embed_checks"] += 1
+    scores = (embs[1:] @ embs[0]).tolist()
+    for cand, score in zip(candidates, scores):
+        if score >= threshold:
+            return cand
+    return None
+
+def get_dedup_stats() -> Dict[str, Any]:
+    """Counters for the long-term memory dedup stage (since process start)."""
+    with LOCK:
+        stats = dict(_dedup_stats)
+    stats["dedup_rate"] = (stats["merged"] / stats["checked"]) if stats["checked"] else 0.0
+    return stats
 
 # ---------------------------
 # LONG-TERM MEMORY (KNOWLEDGE)
 # ---------------------------
+def _merge_duplicate(user_id: str, existing: Dict[str, Any], ts: str) -> Dict[str, Any]:
+    """
+    Bumps count / last_seen of `existing` (LOCK held) and moves it to the end
+    of its last_seen month, so retention and the dedup window see it as recent.
+    """
+    buckets = _long_cache.get(user_id) or {}
+    old_key = _bucket_key(existing.get("last_seen") or existing["ts"])
+    new_key = _bucket_key(ts)
+    existing["count"] = existing.get("count", 1) + 1
+    existing["last_seen"] = ts
+    _dedup_stats["merged"] += 1
+    if new_key < old_key:
+        return existing  # back-dated repeat: leave it where it is
+
+    # identity search from the end of its expected bucket, then the rest (older data)
+    keys = sorted(buckets, key=lambda k: (k == old_key, k), reverse=True)
+    for key in keys:
+        bucket = buckets[key]
+        for i in range(len(bucket) - 1, -1, -1):
+            if bucket[i] is existing:
+                del bucket[i]
+                if not bucket:
+                    del buckets[key]
+                buckets.setdefault(new_key, []).append(existing)
+                return existing
+    return existing
+
 def add_long_memory(user_id: str, item: Dict[str, Any]):
-    """Adds a new knowledge item to the user's long-term memory and vector store."""
+    """
+    Adds a new knowledge item to the user's long-term memory and vector store.
+    Near-duplicates of the user's recent items are merged into the existing
+    entry (count / last_seen bumped) instead of being appended.
+    """
     from app.database.vector_store import vector_store  # Lazy import
 
+    text = item.get("text")
+    ts = item.get("ts", _now_ts())
+    sig = _simhash(text) if (text and settings.MEMORY_DEDUP_ENABLED) else None
+    loose: List[Dict[str, Any]] = []
+
+    if sig is not None:
+        with LOCK:
+            _dedup_stats["checked"] += 1
+            dup, loose = _scan_recent(user_id, sig)
+            if dup is not None:
+                entry = _merge_duplicate(user_id, dup, ts)
+        if dup is not None:
+            _persist_long()
+            return entry
+
+        dup = _embedding_duplicate(text, loose, vector_store)
+        if dup is not None:
+            with LOCK:
+                entry = _merge_duplicate(user_id, dup, ts)
+            _persist_long()
+            return entry
+
     with LOCK:
-        knowledge = _long_cache.setdefault(user_id, [])
+        knowledge = _long_cache.setdefault(user_id, {}).setdefault(_bucket_key(ts), [])
         entry = {
             "id": f"mem_{int(time.time() * 1000)}_{len(knowledge)}",
             "type": item.get("type", "note"),
-            "text": item.get("text"),
+            "text": text,
             "meta": item.get("meta", {}),
-            "ts": item.get("ts", _now_ts())
+            "ts": ts,
+            "count": 1
         }
+        if sig is not None:
+            entry["sig"] = sig
         knowledge.append(entry)
     _persist_long()
 
@@ -154,9 +452,11 @@ def add_long_memory(user_id: str, item: Dict[str, Any]):
     return entry
 
 def get_long_memory(user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-    """Retrieves the last N knowledge items for a user (not ranked)."""
+    """Retrieves the last N knowledge items for a user (not ranked, oldest -> newest)."""
     with LOCK:
-        return (_long_cache.get(user_id, [])[-limit:]).copy()
+        items = list(islice(_iter_recent_long(user_id), max(limit, 0)))
+    items.reverse()
+    return items
 
 # ---------------------------
 # KNOWLEDGE GRAPH
@@ -193,18 +493,52 @@ def add_memory_item(user_id: str, user_text: str, assistant_text: str, metadata:
         "meta": metadata or {}
     })
 
-    # Occasionally, update the mid-term summary.
+    # A merged near-duplicate adds nothing new to summarize.
+    if entry.get("count", 1) > 1:
+        return entry
+
+    # Queue the turn for the next leaf summary.
     with LOCK:
-        user_long_mem = _long_cache.get(user_id, [])
-        if len(user_long_mem) % settings.SUMMARIZE_MEMORY_INTERVAL == 0:
-            summarize_user_memory(user_id)
+        pending = _mid_state(user_id)["pending"]
+        pending.append(combined_text)
+        _cap_pending(pending)
+        ready = len(pending) >= settings.SUMMARIZE_MEMORY_INTERVAL
+    if ready:
+        summarize_user_memory(user_id)
+    else:
+        _persist_mid()
 
     return entry
 
-def get_relevant_memory(user_id: str, query: str, conversation_id: str, k: int = 5) -> List[str]:
+def lexical_search(user_id: str, query: str, k: int = 5, exclude_ids: Iterable[str] = ()) -> List[str]:
+    """
+    Cheap keyword retrieval over the user's stored messages (SQLite FTS5).
+    Any query word may match; bm25 puts messages sharing more/rarer words first.
+    Messages in `exclude_ids` (e.g. the history already in the prompt) and
+    messages that are just the query itself are skipped.
+    Returns [] when full-text search is unavailable.
+    """
+    exclude = set(exclude_ids)
+    try:
+        from ..database.base import engine
+        from ..database.crud import search_messages
+        from sqlmodel import Session
+        with Session(engine) as session:
+            rows = search_messages(session, user_id, query, limit=k + len(exclude) + 1, match_any=True)
+    except Exception as e:
+        print(f"Could not perform lexical search for memory: {e}")
+        return []
+    own = query.strip()
+    texts = [r["text"] for r in rows if r["id"] not in exclude and (r["text"] or "").strip() != own]
+    return texts[:k]
+
+def get_relevant_memory(user_id: str, query: str, conversation_id: str, k: int = 5,
+                        exclude_ids: Iterable[str] = ()) -> List[str]:
     """
     The main retrieval function used by the brain.
     Gathers candidates from all memory types and ranks them for relevance.
+    `exclude_ids` are message ids already in the prompt (the recent history,
+    including the message being answered); keyword hits on them are dropped.
     """
     candidates = []
 
@@ -224,50 +558,142 @@ def get_relevant_memory(user_id: str, query: str, conversation_id: str, k: int =
     except Exception as e:
         print(f"Could not perform RAG search for memory: {e}")
 
+    # 4. Keyword matches from older messages (catches names/ids embeddings miss)
+    seen = set(candidates)
+    for text in lexical_search(user_id, query, k=k, exclude_ids=exclude_ids):
+        candidate = f"Past message: {text}"
+        if candidate not in seen:
+            seen.add(candidate)
+            candidates.append(candidate)
+
     if not candidates:
         return []
 
-    # 4. Rank all candidates against the current query
+    # 5. Rank all candidates against the current query
     ranked_results = rank_candidates(query, candidates)
     return [res['text'] for res in ranked_results[:k]]
 
-def summarize_user_memory(user_id: str):
-    """Creates and stores a new summary of the user's recent long-term memories."""
-    with LOCK:
-        last_items = _long_cache.get(user_id, [])[-15:]
+def _cap_pending(pending: List[str]):
+    # while summaries fail the turns pile up; the oldest go (they remain in long-term memory)
+    excess = len(pending) - max(settings.SUMMARY_MAX_PENDING, settings.SUMMARIZE_MEMORY_INTERVAL)
+    if excess > 0:
+        del pending[:excess]
 
-    if not last_items:
-        return
+def _summary_failed(user_id: str):
+    """Back off exponentially (LOCK held): don't call a failing LLM on every turn."""
+    _, delay = _summary_backoff.get(user_id, (0.0, 0.0))
+    delay = min(max(delay * 2, settings.SUMMARY_RETRY_SECONDS), settings.SUMMARY_RETRY_MAX_SECONDS)
+    _summary_backoff[user_id] = (time.monotonic() + delay, delay)
 
-    full_text = "\n\n".join([item["text"] for item in last_items])
+def summarize_user_memory(user_id: str):
+    """
+    Summarizes the user's pending (not yet summarized) turns into a new leaf.
+    After a failed summary, calls return early until the back-off has passed.
+    """
+    with LOCK:
+        backoff = _summary_backoff.get(user_id)
+        if backoff is not None and time.monotonic() < backoff[0]:
+            return
+        state = _mid_cache.get(user_id)
+        pending = state["pending"] if state else []
+        if not pending:
+            return
+        batch = pending[:]
+        pending.clear()
+
+    summary = None
     try:
-        summary = summarize_text(full_text, max_tokens=150)
-        if summary:
-            add_mid_memory(user_id, summary)
-            print(f"Successfully summarized memory for user {user_id}")
+        summary = summarize_text("\n\n".join(batch), max_tokens=150)
     except Exception as e:
         print(f"Could not summarize memory for user {user_id}: {e}")
+    finally:
+        # "[LLM error] ..." / "[LLM timeout]" is not a summary, and a cancelled
+        # turn must not lose them either: keep the turns pending
+        if is_llm_failure(summary):
+            with LOCK:
+                pending = _mid_state(user_id)["pending"]
+                pending[:0] = batch
+                _cap_pending(pending)
+    if is_llm_failure(summary):
+        if summary:
+            print(f"Could not summarize memory for user {user_id}: {summary[:200]}")
+        with LOCK:
+            _summary_failed(user_id)
+        _persist_mid()
+        return
+    with LOCK:
+        _summary_backoff.pop(user_id, None)
+    add_mid_memory(user_id, summary, turns=len(batch))
+    print(f"Successfully summarized memory for user {user_id}")
 
-def cleanup_aged_memory(max_age_days: int = 365):
+def _cleanup_user(user_id: str, cutoff_key: str, cutoff_ts: str, keep_recent: int) -> int:
     """
-    Periodically cleans up old items from mid-term and long-term memory.
+    Expires one user's long-term buckets older than `cutoff_key` (LOCK held).
+    The newest `keep_recent` items survive regardless of age. Returns items removed.
+    """
+    buckets = _long_cache.get(user_id) or {}
+    removed = 0
+    kept = 0
+    for key in sorted(buckets, reverse=True):
+        bucket = buckets[key]
+        if key >= cutoff_key:
+            kept += len(bucket)
+            continue
+        quota = max(keep_recent - kept, 0)
+        if quota >= len(bucket):
+            kept += len(bucket)
+        elif quota:
+            # partially protected bucket: keep its newest `quota` items
+            removed += len(bucket) - quota
+            bucket[:] = bucket[-quota:]
+            kept += quota
+        else:
+            # whole bucket expired: drop it without looking at its items
+            removed += len(bucket)
+            del buckets[key]
+    if not buckets:
+        _long_cache.pop(user_id, None)
+
+    state = _mid_cache.get(user_id)
+    if state:
+        for level in state["levels"]:
+            # ISO-8601 strings sort chronologically; no parsing needed
+            level[:] = [item for item in level if item["ts"] > cutoff_ts]
+        if not state["pending"] and not any(state["levels"]):
+            del _mid_cache[user_id]
+        _mid_view.pop(user_id, None)
+    return removed
+
+def cleanup_memory(max_age_days: int = 365, keep_recent_per_user: int = 0) -> int:
+    """
+    Drops long-term memory older than `max_age_days` (whole monthly buckets) and
+    mid-term summaries older than the cutoff. The newest `keep_recent_per_user`
+    items of each user are always kept. Users are processed one at a time and
+    the lock is released between them, so request threads are not stalled.
     Note: This does not currently remove items from the vector index.
+    Returns the number of long-term items removed.
     """
-    cutoff_date = datetime.utcnow() - timedelta(days=max_age_days)
-    with LOCK:
-        for user_id in list(_long_cache.keys()):
-            _long_cache[user_id] = [item for item in _long_cache[user_id] if datetime.fromisoformat(item['ts'].replace('Z','')) > cutoff_date]
-            if not _long_cache[user_id]:
-                del _long_cache[user_id]
+    cutoff = datetime.utcnow() - timedelta(days=max_age_days)
+    cutoff_ts = cutoff.isoformat() + "Z"
+    cutoff_key = _bucket_key(cutoff_ts)
+    keep_recent = keep_recent_per_user or 0
 
-        for user_id in list(_mid_cache.keys()):
-            _mid_cache[user_id] = [item for item in _mid_cache[user_id] if datetime.fromisoformat(item['ts'].replace('Z','')) > cutoff_date]
-            if not _mid_cache[user_id]:
-                del _mid_cache[user_id]
+    with LOCK:
+        user_ids = set(_long_cache) | set(_mid_cache)
+    removed = 0
+    for user_id in user_ids:
+        with LOCK:
+            removed += _cleanup_user(user_id, cutoff_key, cutoff_ts, keep_recent)
+        time.sleep(0)  # yield to request threads between users
 
     _persist_long()
     _persist_mid()
-    print("Finished cleaning up aged memory.")
+    print(f"Finished cleaning up aged memory (removed={removed}).")
+    return removed
+
+def cleanup_aged_memory(max_age_days: int = 365):
+    """Backwards-compatible alias of cleanup_memory without a per-user floor."""
+    return cleanup_memory(max_age_days=max_age_days)
 
 # --- Load data on module import ---
 _initialize_stores()
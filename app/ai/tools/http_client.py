@@ -0,0 +1,194 @@
+# app/ai/tools/http_client.py
+"""
+Shared, pooled HTTP client for the external tools.
+
+Every tool used to call requests.get directly, paying DNS + TCP + TLS per
+call (twice for weather). This module keeps one connection pool per process
+(plus one per event loop for async callers) built from the same settings:
+- keep-alive pool (TOOLS_HTTP_MAX_CONNECTIONS / _MAX_KEEPALIVE / _KEEPALIVE_SECONDS)
+- at most TOOLS_HTTP_MAX_PER_HOST concurrent requests per host
+- HTTP/2 when TOOLS_HTTP2 is on and the `h2` package is installed
+
+    from app.ai.tools import http_client
+    resp = http_client.get(url, params={...}, timeout=6.0)         # sync (tools run in the threadpool)
+    resp = await http_client.aget(url, params={...}, timeout=6.0)  # async
+
+stats() reports, per host, requests, new connections, reused connections
+and HTTP/2 responses.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+try:
+    import h2  # noqa: F401  (enables httpx HTTP/2)
+    _HTTP2 = True
+except Exception:
+    _HTTP2 = False
+
+logger = logging.getLogger("tools.http")
+logger.setLevel(logging.INFO)
+
+USER_AGENT = "ZylosAI/1.0 (+tools)"
+
+_lock = threading.Lock()
+_client = None
+_async_clients: Dict[int, Any] = {}       # id(loop) -> (loop, AsyncClient, {host: Semaphore})
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def http2_enabled() -> bool:
+    return settings.TOOLS_HTTP2 and _HTTP2
+
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "http2": http2_enabled(),
+        "limits": httpx.Limits(
+            max_connections=settings.TOOLS_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.TOOLS_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.TOOLS_HTTP_KEEPALIVE_SECONDS,
+        ),
+        "timeout": settings.TOOLS_HTTP_TIMEOUT_SECONDS,
+        "headers": {"User-Agent": USER_AGENT},
+        "follow_redirects": True,
+    }
+
+
+# -------------------------
+# Metrics
+# -------------------------
+def _bump(host: str, key: str, n: int = 1):
+    with _lock:
+        entry = _stats.setdefault(host, {"requests": 0, "new_connections": 0, "http2": 0})
+        entry[key] += n
+
+
+def _on_trace(host: str, event: str):
+    # httpcore emits connection.connect_tcp.* only when it has to open a socket
+    if event == "connection.connect_tcp.complete":
+        _bump(host, "new_connections")
+
+
+def _record(host: str, resp):
+    _bump(host, "requests")
+    if resp.http_version == "HTTP/2":
+        _bump(host, "http2")
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        hosts = {
+            host: dict(s, reused=max(0, s["requests"] - s["new_connections"]))
+            for host, s in _stats.items()
+        }
+    requests = sum(s["requests"] for s in hosts.values())
+    reused = sum(s["reused"] for s in hosts.values())
+    return {
+        "http2": http2_enabled(),
+        "requests": requests,
+        "reuse_ratio": round(reused / requests, 3) if requests else 0.0,
+        "hosts": hosts,
+    }
+
+
+# -------------------------
+# Sync face (tools run in worker threads; httpx.Client is thread-safe)
+# -------------------------
+def client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = httpx.Client(**_client_options())
+    return _client
+
+
+def _slot(host: str) -> threading.BoundedSemaphore:
+    sem = _host_slots.get(host)
+    if sem is None:
+        with _lock:
+            sem = _host_slots.setdefault(host, threading.BoundedSemaphore(settings.TOOLS_HTTP_MAX_PER_HOST))
+    return sem
+
+
+def request(method: str, url: str, **kwargs):
+    host = urlsplit(url).hostname or ""
+    kwargs.setdefault("extensions", {})["trace"] = lambda event, info: _on_trace(host, event)
+    with _slot(host):
+        resp = client().request(method, url, **kwargs)
+    _record(host, resp)
+    return resp
+
+
+def get(url: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None, **kwargs):
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return request("GET", url, params=params, **kwargs)
+
+
+# -------------------------
+# Async face (one client per event loop; same settings)
+# -------------------------
+def _async_state():
+    loop = asyncio.get_running_loop()
+    state = _async_clients.get(id(loop))
+    if state is None or state[0] is not loop:
+        state = (loop, httpx.AsyncClient(**_client_options()), {})
+        _async_clients[id(loop)] = state
+    return state
+
+
+async def arequest(method: str, url: str, **kwargs):
+    _, aclient, slots = _async_state()
+    host = urlsplit(url).hostname or ""
+
+    async def trace(event, info):
+        _on_trace(host, event)
+
+    kwargs.setdefault("extensions", {})["trace"] = trace
+    sem = slots.get(host)
+    if sem is None:
+        sem = slots[host] = asyncio.Semaphore(settings.TOOLS_HTTP_MAX_PER_HOST)
+    async with sem:
+        resp = await aclient.request(method, url, **kwargs)
+    _record(host, resp)
+    return resp
+
+
+async def aget(url: str, params: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None, **kwargs):
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    return await arequest("GET", url, params=params, **kwargs)
+
+
+# -------------------------
+# Lifecycle
+# -------------------------
+def close():
+    """Close the sync pool (the next call reopens it)."""
+    global _client
+    with _lock:
+        c, _client = _client, None
+    if c is not None:
+        c.close()
+
+
+async def aclose():
+    """Close this loop's async pool and the sync pool."""
+    loop = asyncio.get_running_loop()
+    state = _async_clients.pop(id(loop), None)
+    if state is not None:
+        await state[1].aclose()
+    close()
@@ -3,7 +3,7 @@
 Detect user's city using IP (ipinfo.io).
 Not 100% accurate when used on server; suitable as a best-effort default.
 """
-import requests
+from app.ai.tools import http_client
 from typing import Optional
 
 IPINFO = "https://ipinfo.io/json"
@@ -11,7 +11,7 @@ REQUEST_TIMEOUT = 4.0
 
 def get_current_city() -> Optional[str]:
     try:
-        resp = requests.get(IPINFO, timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(IPINFO, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         j = resp.json()
         city = j.get("city")
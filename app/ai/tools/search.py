@@ -3,7 +3,7 @@ DuckDuckGo Instant Answer tool (no API key).
 If instant answer is missing, it returns short related topics.
 """
 
-import requests
+from app.ai.tools import http_client
 from typing import Optional
 
 DDG_URL = "https://api.duckduckgo.com/"
@@ -13,7 +13,7 @@ def duckduck_search(query: str) -> str:
     if not query:
         return "No query provided."
     try:
-        resp = requests.get(DDG_URL, params={"q": query, "format":"json", "no_redirect":"1"}, timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(DDG_URL, params={"q": query, "format":"json", "no_redirect":"1"}, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         j = resp.json()
         abstract = j.get("AbstractText")
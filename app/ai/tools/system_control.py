@@ -8,14 +8,12 @@ provided by users. Real device control should be implemented inside device agent
 (Windows/Android) that authenticate and accept signed commands from the backend.
 
 Here we provide:
-- run_command(action, params) -> simulated result or a safe queuing for agent
+- run_command(action, params, user_id, device_id) -> validates the action and
+  queues it for the device agent (services/command_queue.py: durable, pushed
+  over the device's websocket, acked / retried / expired)
 """
 
-import json
-from typing import Dict, Any
-
-# In-memory queue (simple). For production use Redis / persistent queue.
-COMMAND_QUEUE = []
+from typing import Dict, Any, Optional
 
 ALLOWED_ACTIONS = {
     "open_app": ["app_name"],
@@ -26,18 +24,55 @@ ALLOWED_ACTIONS = {
     "restart": []
 }
 
-def run_command(action: str, params: Dict[str, Any] = None) -> str:
-    params = params or {}
+# planner hands over the raw utterance; these actions need no params
+_TEXT_ACTIONS = ("screenshot", "shutdown", "restart")
+
+def validate(action: Optional[str], params: Dict[str, Any]) -> Optional[str]:
+    """Returns an error message, or None if the command is allowed."""
     if action not in ALLOWED_ACTIONS:
         return f"Action '{action}' is not permitted."
-    # Validate params keys
-    required = ALLOWED_ACTIONS[action]
-    for r in required:
+    for r in ALLOWED_ACTIONS[action]:
         if r not in params:
             return f"Missing param '{r}' for action '{action}'."
+    return None
+
+def run_command(action: Optional[str] = None, params: Dict[str, Any] = None, user_id: Optional[str] = None,
+                device_id: Optional[str] = None, text: Optional[str] = None) -> str:
+    params = dict(params or {})
+    if action is None and text:
+        low = text.lower()
+        action = next((a for a in _TEXT_ACTIONS if a in low), None)
+    error = validate(action, params)
+    if error:
+        return error
+    if not user_id:
+        return f"Cannot queue '{action}': no user context."
+
+    from anyio import from_thread
+    from app.services import command_queue
+
+    device_id = device_id or params.pop("device_id", None)
+    if _in_worker_thread():
+        # called from the brain's worker thread: hop onto the event loop so the
+        # command is pushed to a connected device immediately
+        if not device_id:
+            device_id = from_thread.run(command_queue.default_device, user_id)
+        if not device_id:
+            return "No registered device to run this on."
+        cmd = from_thread.run(command_queue.enqueue, user_id, device_id, action, params)
+    else:
+        # scripts / no event loop: persist only; delivered on connect or by the sweeper
+        if not device_id:
+            return "No target device given."
+        cmd = command_queue.enqueue_sync(user_id, device_id, action, params)
+    if cmd.status == "sent":
+        return f"Sent '{action}' to your device (command {cmd.id})."
+    return f"Queued '{action}' (command {cmd.id}); the device will get it when it connects."
 
-    # Enqueue command for devices to pick up (device agent will poll or get via WS)
-    cmd = {"action": action, "params": params}
-    COMMAND_QUEUE.append(cmd)
-    # For now return a safe acknowledgement
-    return f"Enqueued action '{action}'. Device will execute if authorized."
\ No newline at end of file
+def _in_worker_thread() -> bool:
+    from anyio import from_thread
+    try:
+        from_thread.run_sync(lambda: None)
+        return True
+    except RuntimeError:
+        return False
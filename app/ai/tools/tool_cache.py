@@ -0,0 +1,314 @@
+# app/ai/tools/tool_cache.py
+"""
+Result cache for external tools (see CACHE_POLICIES in tool_router.py).
+
+Key: tool name + arguments bound to the tool's signature, with strings
+whitespace-collapsed (and case-folded unless the policy says otherwise), so
+call_tool("weather", city="Mumbai") and call_tool("weather", " mumbai")
+share an entry.
+
+Two tiers:
+- in-memory LRU (TOOL_CACHE_MEMORY_ITEMS entries, per process)
+- SQLite file (TOOL_CACHE_PATH) that survives restarts and is shared by
+  workers on the same host; entries are promoted to memory when read
+
+Per entry, a policy gives `ttl` (fresh) and `stale` (how long after that
+the value may still be served):
+- fresh             -> returned without touching the network
+- stale             -> a refresh starts in the background; if it finishes
+                       within TOOL_CACHE_REVALIDATE_WAIT_SECONDS its result is
+                       returned, otherwise the stale value is (and the refresh
+                       still lands in the cache). Stale values also stand in
+                       when the refresh fails.
+- missing / expired -> the tool is called inline
+
+Failures are never stored: None, "[tool_error] ..." and results starting
+with one of the policy's `errors` prefixes.
+"""
+
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger("tools.cache")
+logger.setLevel(logging.INFO)
+
+_PURGE_EVERY = 256  # disk writes between purges of dead rows
+
+
+class CachePolicy:
+    __slots__ = ("ttl", "stale", "persist", "fold_case", "errors")
+
+    def __init__(self, ttl: float, stale: float = 0.0, persist: bool = True, fold_case: bool = True,
+                 errors: Tuple[str, ...] = ()):
+        self.ttl = ttl
+        self.stale = stale
+        self.persist = persist
+        self.fold_case = fold_case
+        self.errors = errors
+
+    def cacheable(self, result: Any) -> bool:
+        if result is None:
+            return False
+        if isinstance(result, str):
+            return not result.startswith("[tool_error]") and not result.startswith(self.errors)
+        return True
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value: Any, fresh_until: float, stale_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+def _normalize(value: Any, fold_case: bool) -> Any:
+    if isinstance(value, str):
+        value = " ".join(value.split())
+        return value.casefold() if fold_case else value
+    if isinstance(value, dict):
+        return {str(k): _normalize(v, fold_case) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, fold_case) for v in value]
+    return value
+
+
+def cache_key(tool: str, fn: Callable, args: tuple, kwargs: dict, policy: CachePolicy) -> str:
+    try:
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+    except (TypeError, ValueError):
+        arguments = {"args": list(args), "kwargs": kwargs}
+    raw = json.dumps(_normalize(arguments, policy.fold_case), sort_keys=True, default=str)
+    return f"{tool}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+class ToolCache:
+    def __init__(self, path: Optional[str], max_items: int = 1024, revalidate_wait: float = 1.5,
+                 workers: int = 4, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.max_items = max_items
+        self.revalidate_wait = revalidate_wait
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tool-revalidate")
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self.revalidated = 0
+        self.refresh_errors = 0
+
+    # -------------------------
+    # Disk tier
+    # -------------------------
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_cache ("
+                "key TEXT PRIMARY KEY, tool TEXT NOT NULL, value TEXT NOT NULL, "
+                "fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS ix_tool_cache_stale_until ON tool_cache (stale_until)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[_Entry]:
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT value, fresh_until, stale_until FROM tool_cache WHERE key = ?", (key,)
+            ).fetchone()
+        return _Entry(json.loads(row[0]), row[1], row[2]) if row else None
+
+    def _disk_put(self, key: str, tool: str, entry: _Entry):
+        try:
+            value = json.dumps(entry.value)
+        except (TypeError, ValueError):
+            return  # not JSON-serializable; memory tier only
+        with self._db_lock:
+            db = self._conn()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO tool_cache (key, tool, value, fresh_until, stale_until) VALUES (?, ?, ?, ?, ?)",
+                (key, tool, value, entry.fresh_until, entry.stale_until),
+            )
+            self._writes += 1
+            if self._writes % _PURGE_EVERY == 0:
+                db.execute("DELETE FROM tool_cache WHERE stale_until < ?", (self.clock(),))
+            db.commit()
+
+    # -------------------------
+    # Lookup / store
+    # -------------------------
+    def _lookup(self, key: str, policy: CachePolicy, now: float) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry.stale_until <= now:
+                    del self._memory[key]
+                    entry = None
+                else:
+                    self._memory.move_to_end(key)
+        if entry is not None and (entry.fresh_until > now or not policy.persist):
+            return entry
+        if not policy.persist:
+            return None
+        # another worker may have refreshed it already
+        stored = self._disk_get(key)
+        if stored is None or stored.stale_until <= now or (entry is not None and stored.fresh_until <= entry.fresh_until):
+            return entry
+        self.disk_hits += 1
+        self._remember(key, stored)
+        return stored
+
+    def _remember(self, key: str, entry: _Entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def _store(self, key: str, tool: str, policy: CachePolicy, value: Any):
+        now = self.clock()
+        entry = _Entry(value, now + policy.ttl, now + policy.ttl + policy.stale)
+        self._remember(key, entry)
+        if policy.persist:
+            try:
+                self._disk_put(key, tool, entry)
+            except sqlite3.Error:
+                logger.exception("Tool cache write failed (%s)", tool)
+
+    def _call(self, key: str, tool: str, policy: CachePolicy, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        result = fn(*args, **kwargs)
+        if policy.cacheable(result):
+            self._store(key, tool, policy, result)
+        return result
+
+    def _refresh(self, key: str, tool: str, policy: CachePolicy, fn: Callable, args: tuple, kwargs: dict) -> Future:
+        """One background refresh per key; concurrent stale readers share it."""
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            ctx = contextvars.copy_context()
+            future = self._pool.submit(ctx.run, self._call, key, tool, policy, fn, args, kwargs)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._refreshed(key, f))
+        return future
+
+    def _refreshed(self, key: str, future: Future):
+        with self._lock:
+            self._pending.pop(key, None)
+        if future.exception() is not None:
+            self.refresh_errors += 1
+            logger.warning("Tool cache refresh failed (%s): %s", key.split(":", 1)[0], future.exception())
+        else:
+            self.revalidated += 1
+
+    def call(self, tool: str, policy: CachePolicy, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        key = cache_key(tool, fn, args, kwargs, policy)
+        now = self.clock()
+        entry = self._lookup(key, policy, now)
+        if entry is None:
+            self.misses += 1
+            return self._call(key, tool, policy, fn, args, kwargs)
+        if entry.fresh_until > now:
+            self.hits += 1
+            return entry.value
+
+        # stale: revalidate, but don't keep the caller waiting on a slow upstream
+        future = self._refresh(key, tool, policy, fn, args, kwargs)
+        try:
+            result = future.result(timeout=self.revalidate_wait)
+        except (FutureTimeout, Exception):
+            # still running (it lands in the cache when done) or failed
+            self.stale_served += 1
+            return entry.value
+        if not policy.cacheable(result):
+            self.stale_served += 1
+            return entry.value
+        return result
+
+    # -------------------------
+    # Introspection / maintenance
+    # -------------------------
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        with self._db_lock:
+            db = self._conn()
+            if db is not None:
+                db.execute("DELETE FROM tool_cache")
+                db.commit()
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_served + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "stale_served": self.stale_served,
+            "misses": self.misses,
+            "revalidated": self.revalidated,
+            "refresh_errors": self.refresh_errors,
+            "refreshing": len(self._pending),
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+tool_cache = ToolCache(
+    settings.TOOL_CACHE_PATH or None,
+    max_items=settings.TOOL_CACHE_MEMORY_ITEMS,
+    revalidate_wait=settings.TOOL_CACHE_REVALIDATE_WAIT_SECONDS,
+    workers=settings.TOOL_CACHE_REVALIDATE_WORKERS,
+)
+
+
+def cached(tool: str, policy: CachePolicy):
+    """Decorator for helpers outside TOOLS (e.g. weather.geocode_city)."""
+    def wrap(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not settings.TOOL_CACHE_ENABLED:
+                return fn(*args, **kwargs)
+            return tool_cache.call(tool, policy, fn, args, kwargs)
+        return inner
+    return wrap
@@ -4,10 +4,16 @@ Tool router for Zylos.
 Call style:
     from app.ai.tools.tool_router import call_tool
     res = call_tool("weather", city="Mumbai")
+
+Results of tools listed in CACHE_POLICIES are cached (see tool_cache.py):
+fresh for `ttl` seconds, then served stale for up to `stale` more while a
+refresh runs. Tools without a policy always run.
 """
 
 from typing import Any
+from app.core.config import settings
 from . import weather, search, youtube, wikipedia, location, time_date, system_control
+from .tool_cache import CachePolicy, tool_cache
 
 TOOLS = {
     "weather": weather.get_weather,
@@ -19,6 +25,16 @@ TOOLS = {
     "system_control": system_control.run_command,
 }
 
+# time_date and system_control are never cached
+CACHE_POLICIES = {
+    "weather": CachePolicy(ttl=600, stale=1800, errors=("Sorry, I couldn't find", "Weather data unavailable", "Weather fetch failed")),
+    "search": CachePolicy(ttl=6 * 3600, stale=7 * 86400, errors=("Search failed",)),
+    "youtube": CachePolicy(ttl=3600, stale=86400, errors=("YouTube search failed",)),
+    "wikipedia": CachePolicy(ttl=86400, stale=30 * 86400, fold_case=False, errors=("Wikipedia fetch failed",)),
+    # the server's own IP: per process only, so a move shows up after a restart
+    "location": CachePolicy(ttl=3600, stale=86400, persist=False),
+}
+
 class ToolNotFound(Exception):
     pass
 
@@ -26,7 +42,10 @@ def call_tool(tool_name: str, *args, **kwargs) -> Any:
     fn = TOOLS.get(tool_name)
     if not fn:
         raise ToolNotFound(f"Tool '{tool_name}' not found")
+    policy = CACHE_POLICIES.get(tool_name)
     try:
+        if policy is not None and settings.TOOL_CACHE_ENABLED:
+            return tool_cache.call(tool_name, policy, fn, args, kwargs)
         return fn(*args, **kwargs)
     except Exception as e:
         # Bubble up or wrap error message (brain can handle fallback)
@@ -5,18 +5,23 @@ Provides:
 - get_weather(city) -> text summary
 """
 
-import requests
+from app.ai.tools import http_client
+from app.ai.tools.tool_cache import CachePolicy, cached
 from typing import Optional
 
 GEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
 WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
 REQUEST_TIMEOUT = 6.0
 
+# city coordinates don't move; misses (None) are not cached
+GEOCODE_CACHE = CachePolicy(ttl=30 * 86400, stale=335 * 86400)
+
+@cached("geocode", GEOCODE_CACHE)
 def geocode_city(city: str) -> Optional[tuple]:
     if not city:
         return None
     try:
-        resp = requests.get(GEO_URL, params={"name": city, "count":1, "language":"en"}, timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(GEO_URL, params={"name": city, "count":1, "language":"en"}, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         j = resp.json()
         results = j.get("results")
@@ -42,7 +47,7 @@ def get_weather(city: str) -> str:
             "current_weather": True,
             "timezone": "auto"
         }
-        resp = requests.get(WEATHER_URL, params=params, timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(WEATHER_URL, params=params, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         j = resp.json()
         cw = j.get("current_weather")
@@ -1,7 +1,7 @@
 """
 Get a concise Wikipedia summary (English).
 """
-import requests
+from app.ai.tools import http_client
 
 WIKI_SUMMARY = "https://en.wikipedia.org/api/rest_v1/page/summary/{}"
 REQUEST_TIMEOUT = 6.0
@@ -12,7 +12,7 @@ def get_summary(title: str) -> str:
     try:
         # sanitize title for URL
         safe = title.strip().replace(" ", "_")
-        resp = requests.get(WIKI_SUMMARY.format(safe), timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(WIKI_SUMMARY.format(safe), timeout=REQUEST_TIMEOUT)
         if resp.status_code == 404:
             return f"No Wikipedia page found for '{title}'."
         resp.raise_for_status()
@@ -2,7 +2,7 @@
 YouTube search via Piped proxy API (no API key).
 Returns list of title — channel.
 """
-import requests
+from app.ai.tools import http_client
 from typing import List
 
 PIPED_SEARCH = "https://piped.video/api/v1/search"
@@ -12,7 +12,7 @@ def search_youtube(query: str, limit: int = 5) -> str:
     if not query:
         return "No query provided."
     try:
-        resp = requests.get(PIPED_SEARCH, params={"q": query}, timeout=REQUEST_TIMEOUT)
+        resp = http_client.get(PIPED_SEARCH, params={"q": query}, timeout=REQUEST_TIMEOUT)
         resp.raise_for_status()
         j = resp.json()
         items = j.get("items") or j.get("videos") or j.get("results") or []
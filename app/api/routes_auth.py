@@ -1,36 +1,51 @@
 # app/api/routes_auth.py
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session
 
-from app.database.base import get_session
-from app.database.schemas import RegisterIn, LoginIn, TokenOut
+from app.database.base import get_async_session
+from app.database.schemas import RegisterIn, LoginIn, PasswordChangeIn, TokenOut
 from app.database import crud
+from app.core.hashing_pool import HashPoolBusy
 from app.core.security import (
-    get_password_hash,
-    verify_password,
-    create_access_token
+    get_password_hash_async,
+    verify_password_async,
+    create_access_token,
+    get_current_user,
+    oauth2_scheme,
+    revoke_access_token
 )
 
 router = APIRouter(tags=["Auth"], prefix="/auth")
 
 
+def _busy() -> HTTPException:
+    # hashing pool saturated (login storm): shed load instead of queueing
+    return HTTPException(
+        status_code=503,
+        detail="Authentication is busy, please retry shortly",
+        headers={"Retry-After": "1"}
+    )
+
+
 # ---------------------------------------------------------
 # REGISTER USER
 # ---------------------------------------------------------
 @router.post("/register", response_model=TokenOut)
-def register(payload: RegisterIn, session: Session = Depends(get_session)):
+async def register(payload: RegisterIn, session = Depends(get_async_session)):
 
     # check existing
-    user = crud.get_user_by_email(session, payload.email)
+    user = await crud.get_user_by_email_async(session, payload.email)
     if user:
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
 
-    hashed = get_password_hash(payload.password)
-    user = crud.create_user(
+    try:
+        hashed = await get_password_hash_async(payload.password)
+    except HashPoolBusy:
+        raise _busy()
+    user = await crud.create_user_async(
         session,
         email=payload.email,
         password_hash=hashed,
@@ -46,15 +61,51 @@ def register(payload: RegisterIn, session: Session = Depends(get_session)):
 # LOGIN USER
 # ---------------------------------------------------------
 @router.post("/token", response_model=TokenOut)
-def login(payload: LoginIn, session: Session = Depends(get_session)):
+async def login(payload: LoginIn, session = Depends(get_async_session)):
 
-    user = crud.get_user_by_email(session, payload.email)
+    user = await crud.get_user_by_email_async(session, payload.email)
     if not user:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
-    if not verify_password(payload.password, user.password_hash):
+    try:
+        ok = await verify_password_async(payload.password, user.password_hash)
+    except HashPoolBusy:
+        raise _busy()
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
 
     token = create_access_token(user.id)
 
-    return TokenOut(token=token, user_id=user.id)
\ No newline at end of file
+    return TokenOut(token=token, user_id=user.id)
+
+
+# ---------------------------------------------------------
+# LOGOUT
+# ---------------------------------------------------------
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme), current_user = Depends(get_current_user)):
+    revoke_access_token(token)
+    return {"ok": True}
+
+
+# ---------------------------------------------------------
+# CHANGE PASSWORD
+# ---------------------------------------------------------
+@router.post("/password")
+async def change_password(
+    payload: PasswordChangeIn,
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    # current_user may be a cached snapshot; check against the stored hash
+    user = await crud.get_user_by_id_async(session, current_user.id)
+    try:
+        ok = user is not None and await verify_password_async(payload.old_password, user.password_hash)
+        if not ok:
+            raise HTTPException(status_code=401, detail="Invalid password")
+        hashed = await get_password_hash_async(payload.new_password)
+    except HashPoolBusy:
+        raise _busy()
+    # update_user_async also drops the cached User snapshot
+    await crud.update_user_async(session, current_user.id, password_hash=hashed)
+    return {"ok": True}
@@ -1,12 +1,17 @@
 # app/api/routes_devices.py
 
-from fastapi import APIRouter, Depends
-from sqlmodel import Session
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.ai.tools.system_control import validate as validate_command
 from app.core.security import get_current_user
 from app.core.utils import uid
-from app.database.base import get_session
-from app.database.schemas import DeviceRegisterIn, DeviceOut
+from app.database.base import get_async_session
+from app.database.schemas import CommandIn, DeviceRegisterIn, DeviceOut, PushTokenIn
 from app.database import crud
+from app.services import command_queue
+from app.services.device_manager import presence, redis_bridge, ws_manager
+from app.services.push import push_dispatcher
 
 router = APIRouter(tags=["Devices"], prefix="/devices")
 
@@ -15,15 +20,15 @@ router = APIRouter(tags=["Devices"], prefix="/devices")
 # REGISTER DEVICE
 # ---------------------------------------------------------
 @router.post("/register", response_model=DeviceOut)
-def register_device(
+async def register_device(
     payload: DeviceRegisterIn,
-    session: Session = Depends(get_session),
+    session = Depends(get_async_session),
     current_user = Depends(get_current_user)
 ):
 
     device_token = uid()
 
-    device = crud.register_device(
+    device = await crud.register_device_async(
         session,
         user_id=current_user.id,
         name=payload.name,
@@ -38,19 +43,97 @@ def register_device(
 # LIST ALL DEVICES
 # ---------------------------------------------------------
 @router.get("/list")
-def list_devices(
-    session: Session = Depends(get_session),
+async def list_devices(
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    """
+    Lists the user's devices with live presence: online / last_seen come from
+    the in-memory presence table when the device is connected here (or was
+    recently), otherwise from the last flushed DB value.
+    """
+    devices = await crud.get_devices_for_user_async(session, current_user.id)
+    live = presence.snapshot(current_user.id)
+    out = []
+    for d in devices:
+        online, seen = live.get(d.id, (False, d.last_seen))
+        out.append({
+            "id": d.id,
+            "name": d.name,
+            "type": d.type,
+            "online": online,
+            "last_seen": max(seen, d.last_seen).isoformat()
+        })
+    return {"devices": out}
+
+# ---------------------------------------------------------
+# PUSH TOKEN (FCM registration token of this device)
+# ---------------------------------------------------------
+@router.post("/{device_id}/push-token")
+async def set_push_token(
+    device_id: str,
+    payload: PushTokenIn,
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    device = await crud.set_device_push_token_async(session, current_user.id, device_id, payload.push_token)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return {"device_id": device_id, "push_enabled": payload.push_token is not None}
+
+
+# ---------------------------------------------------------
+# DEVICE COMMANDS (system_control queue)
+# ---------------------------------------------------------
+@router.post("/{device_id}/commands")
+async def send_command(
+    device_id: str,
+    payload: CommandIn,
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    """
+    Queue a command for one of the user's devices. It is pushed over the
+    device's socket immediately if connected, otherwise on its next connect.
+    """
+    error = validate_command(payload.action, payload.params)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    devices = await crud.get_devices_for_user_async(session, current_user.id)
+    if not any(d.id == device_id for d in devices):
+        raise HTTPException(status_code=404, detail="Device not found")
+    cmd = await command_queue.enqueue(current_user.id, device_id, payload.action, payload.params, payload.ttl_seconds)
+    return command_queue.command_out(cmd)
+
+
+@router.get("/{device_id}/commands")
+async def list_commands(
+    device_id: str,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
     current_user = Depends(get_current_user)
 ):
-    devices = crud.get_devices_for_user(session, current_user.id)
-    return {
-        "devices": [
-            {
-                "id": d.id,
-                "name": d.name,
-                "type": d.type,
-                "last_seen": d.last_seen.isoformat()
-            }
-            for d in devices
-        ]
-    }
\ No newline at end of file
+    """Newest first; filter by status (queued / sent / acked / done / failed / expired)."""
+    cmds = await command_queue.list_commands(current_user.id, device_id, status, limit)
+    return {"commands": [command_queue.command_out(c) for c in cmds]}
+
+
+@router.get("/commands/{command_id}")
+async def get_command(command_id: str, current_user = Depends(get_current_user)):
+    cmd = await command_queue.get_command(current_user.id, command_id)
+    if cmd is None:
+        raise HTTPException(status_code=404, detail="Command not found")
+    return command_queue.command_out(cmd)
+
+
+# ---------------------------------------------------------
+# CONNECTION STATS (this instance)
+# ---------------------------------------------------------
+@router.get("/stats")
+def get_connection_stats(current_user = Depends(get_current_user)):
+    """
+    WebSocket counters for this process: connections, queues, heartbeat
+    pings and reap rate, plus the push dispatcher. Each instance reports
+    only its own sockets.
+    """
+    return {"instance_id": redis_bridge.instance_id, "ws": ws_manager.stats(), "push": push_dispatcher.stats()}
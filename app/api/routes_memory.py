@@ -1,41 +1,168 @@
 # app/api/routes_memory.py
 
-from fastapi import APIRouter, Depends
-from sqlmodel import Session
+import json
+from typing import Optional
 
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.core.config import settings
 from app.core.security import get_current_user
-from app.database.base import get_session
-from app.database import crud
-from app.database.models import Message
-from sqlmodel import select
+from app.database.base import get_async_session, open_async_session
+from app.database import crud, message_cache
+from app.ai.memory_engine import get_dedup_stats
 
 router = APIRouter(tags=["Memory"], prefix="/memory")
 
 
+def _message_out(m) -> dict:
+    return {
+        "id": m.id,
+        "role": m.role,
+        "text": m.text,
+        "timestamp": m.timestamp.isoformat()
+    }
+
+
+def _page_out(rows, limit: int) -> dict:
+    # A full page means there may be more; the client stops on a short/empty page.
+    return {
+        "history": [_message_out(m) for m in rows],
+        "next_cursor": crud.encode_cursor(rows[-1]) if rows and len(rows) >= limit else None
+    }
+
+
+async def _fetch_page(session, by: str, key: str, limit: int, cursor: Optional[str]):
+    try:
+        return await crud.get_messages_page_async(session, by, key, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def _top_up(session, index, by: str, key: str, limit: int, rows: list) -> list:
+    # the cached first page only holds hot rows; a short one continues into the archive,
+    # unless an earlier top-up found nothing there (the usual last page of a history)
+    if len(rows) < limit and settings.ARCHIVE_ENABLED and not index.is_exhausted(key):
+        cursor = crud.encode_cursor(rows[-1]) if rows else None
+        more = await crud.get_messages_page_async(session, by, key, limit=limit - len(rows), cursor=cursor)
+        if not more:
+            index.mark_exhausted(key)
+        rows += more
+    return rows
+
+
 @router.get("/recent")
-def get_recent_memory(
-    limit: int = 30,
-    session: Session = Depends(get_session),
+async def get_recent_memory(
+    limit: int = Query(30, ge=1, le=200),
+    cursor: Optional[str] = None,
+    session = Depends(get_async_session),
     current_user = Depends(get_current_user)
 ):
     """
-    Returns user's recent messages.
+    Returns user's recent messages (newest first), paginated by keyset cursor.
+    The first page is served from the write-through message cache; pages
+    after a cursor go to the DB and use the (user_id, timestamp, id) index,
+    then fall through to archived segments once past the hot range.
     """
+    if cursor is None:
+        rows = list(reversed(await crud.get_recent_user_messages_async(session, current_user.id, limit=limit)))
+        rows = await _top_up(session, message_cache.by_user, "user_id", current_user.id, limit, rows)
+    else:
+        rows = await _fetch_page(session, "user_id", current_user.id, limit, cursor)
+    return _page_out(rows, limit)
+
 
-    query = select(Message).where(
-        Message.user_id == current_user.id
-    ).order_by(Message.timestamp.desc()).limit(limit)
+@router.get("/history")
+async def get_conversation_history(
+    conversation_id: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    """
+    Returns a conversation's messages (both roles, newest first), paginated by
+    keyset cursor. Defaults to the user's main conversation.
+    """
+    if conversation_id is None:
+        conv = await crud.get_or_create_conv_async(session, current_user.id)
+    else:
+        conv = await crud.get_conversation_async(session, conversation_id)
+        if not conv or conv.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Conversation not found")
 
-    rows = session.exec(query).all()
+    if cursor is None:
+        rows = list(reversed(await crud.get_last_messages_async(session, conv.id, limit=limit)))
+        rows = await _top_up(session, message_cache.by_conversation, "conversation_id", conv.id, limit, rows)
+    else:
+        rows = await _fetch_page(session, "conversation_id", conv.id, limit, cursor)
+    page = _page_out(rows, limit)
+    page["conversation_id"] = conv.id
+    return page
 
+
+@router.get("/search")
+async def search_memory(
+    q: str,
+    limit: int = 20,
+    session = Depends(get_async_session),
+    current_user = Depends(get_current_user)
+):
+    """
+    Full-text search over the user's messages (FTS5, bm25-ranked, best first).
+    Every word must match; the last one also matches as a prefix. Each result
+    carries a snippet with matches wrapped in <b>...</b>.
+    """
+    limit = max(1, min(limit, 100))
+    results = await crud.search_messages_async(session, current_user.id, q, limit=limit, prefix=True)
     return {
-        "history": [
-            {
-                "id": m.id,
-                "role": m.role,
-                "text": m.text,
-                "timestamp": m.timestamp.isoformat()
-            }
-            for m in rows
-        ]
-    }
\ No newline at end of file
+        "query": q,
+        "results": [dict(r, timestamp=r["timestamp"].isoformat()) for r in results]
+    }
+
+
+@router.get("/export")
+async def export_history(current_user = Depends(get_current_user)):
+    """
+    Streams the user's full message history as NDJSON (one message per line,
+    oldest first). Rows are read in keyset batches of EXPORT_BATCH_SIZE, so
+    memory stays constant regardless of history size.
+    """
+    user_id = current_user.id
+    batch_size = settings.EXPORT_BATCH_SIZE
+
+    async def lines():
+        # own session: the request-scoped one may be closed before the body is streamed
+        async with open_async_session() as session:
+            for conv in await crud.get_conversations_for_user_async(session, user_id):
+                cursor = None
+                while True:
+                    rows = await crud.get_messages_page_async(
+                        session, "conversation_id", conv.id, limit=batch_size, cursor=cursor, ascending=True
+                    )
+                    if not rows:
+                        break
+                    chunk = "".join(
+                        json.dumps(dict(_message_out(m), conversation_id=conv.id), ensure_ascii=False) + "\n"
+                        for m in rows
+                    )
+                    yield chunk
+                    if len(rows) < batch_size:
+                        break
+                    cursor = crud.encode_cursor(rows[-1])
+                    # drop ORM identity-map references so the session does not grow per batch
+                    session.expunge_all()
+
+    return StreamingResponse(
+        lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="zylos-history.ndjson"'}
+    )
+
+
+@router.get("/stats")
+def get_memory_stats(current_user = Depends(get_current_user)):
+    """
+    Long-term memory dedup counters for this process.
+    """
+    return {"dedup": get_dedup_stats()}
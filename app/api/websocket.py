@@ -1,26 +1,248 @@
 # app/api/websocket.py
 
+import asyncio
+import hmac
+import logging
+from typing import Dict, Optional, Tuple
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from app.services.device_manager import ws_manager
+from app.ai.cancellation import CancelToken, GenerationCancelled
+from app.core.config import settings
+from app.core.security import resolve_user
+from app.database import crud
+from app.database.base import open_async_session
+from app.services import command_queue, outbox, protocol
+from app.services.chat_service import run_chat_turn
+from app.services.device_manager import presence, ws_manager
+
+logger = logging.getLogger("websocket")
+logger.setLevel(logging.INFO)
 
 router = APIRouter()
 
+# close code for sockets that fail authentication (4000-4999: application-defined)
+WS_UNAUTHORIZED = 4401
+
+
+async def _authenticate(user_id: str, jwt: Optional[str]):
+    """The user for jwt, only if it is the user this socket was opened for."""
+    if not jwt:
+        return None
+    async with open_async_session() as session:
+        found = await resolve_user(jwt, session)
+    return found if found is not None and found.id == user_id else None
+
+
+async def _verify_device(user_id: str, device_id: str, device_token: Optional[str], user) -> bool:
+    """
+    device_id must be one of user_id's registered devices, and the socket must
+    prove it: the device token issued by /devices/register, or the user's JWT.
+    """
+    async with open_async_session() as session:
+        devices = await crud.get_devices_for_user_async(session, user_id)
+    device = next((d for d in devices if d.id == device_id), None)
+    if device is None:
+        return False
+    if user is not None:
+        return True
+    return bool(device_token and device.token) and hmac.compare_digest(device.token, device_token)
+
+
+async def _reject(websocket: WebSocket, subprotocol: Optional[str]):
+    """Refuse a socket before it joins any channel (accept, then close with WS_UNAUTHORIZED)."""
+    if subprotocol:
+        await websocket.accept(subprotocol=subprotocol)
+    else:
+        await websocket.accept()
+    await websocket.close(code=WS_UNAUTHORIZED)
+
+
+class _ChatRequests:
+    """
+    Chat turns in flight on one socket, keyed by the client's request id.
+    Each runs as its own task, so a slow generation doesn't block pings,
+    cancels or further requests on the same socket.
+    """
+
+    def __init__(self, conn_id: str):
+        self.conn_id = conn_id
+        self.inflight: Dict[str, Tuple[asyncio.Task, CancelToken]] = {}
+
+    async def _reply(self, payload: dict):
+        await ws_manager.send_to_connection(self.conn_id, payload)
+
+    async def start(self, user, request_id: str, text: str):
+        if request_id in self.inflight:
+            await self._reply({"type": "error", "id": request_id, "error": "duplicate_id"})
+            return
+        if len(self.inflight) >= settings.WS_MAX_INFLIGHT_PER_SOCKET:
+            await self._reply({"type": "error", "id": request_id, "error": "too_many_requests"})
+            return
+        token = CancelToken()
+        task = asyncio.create_task(self._run(user, request_id, text, token))
+        self.inflight[request_id] = (task, token)
+
+    async def _run(self, user, request_id: str, text: str, token: CancelToken):
+        try:
+            async with open_async_session() as session:
+                result = await run_chat_turn(session, user, text, token=token, request_id=request_id)
+            await self._reply({"type": "chat_result", "id": request_id, **result})
+        except GenerationCancelled:
+            await self._reply({"type": "cancelled", "id": request_id})
+        except asyncio.CancelledError:
+            # task cancelled (socket closed / shutdown): nobody to answer; don't swallow it
+            raise
+        except Exception:
+            logger.exception("WS chat request %s failed", request_id)
+            await self._reply({"type": "error", "id": request_id, "error": "internal_error"})
+        finally:
+            self.inflight.pop(request_id, None)
+
+    def cancel(self, request_id: str) -> bool:
+        entry = self.inflight.get(request_id)
+        if entry is None:
+            return False
+        # the token kills the LLM process so the worker thread returns promptly;
+        # the task itself ends with GenerationCancelled and answers "cancelled"
+        entry[1].cancel()
+        return True
+
+    def cancel_all(self):
+        for task, token in list(self.inflight.values()):
+            token.cancel()
+            task.cancel()
+
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    user_id: str,
+    device_id: Optional[str] = None,
+    last_seq: Optional[int] = None,
+    proto: Optional[str] = None,
+    token: Optional[str] = None,
+    device_token: Optional[str] = None
+):
     """
     Multi-device WebSocket → one user_id can have multiple devices.
 
     All devices under same user_id will receive identical AI replies.
+    Pass ?device_id=... to report presence (online / last seen) for that device.
+    Pass ?last_seq=N (or send {"type": "resume", "last_seq": N}) to receive
+    the outbox entries missed since seq N. Replay needs an authenticated
+    socket (?token=, or an auth message before resume); otherwise the socket
+    is closed with 4401.
+    Offer Sec-WebSocket-Protocol "zylos.msgpack" (or pass ?proto=msgpack) for
+    binary MessagePack frames in both directions; JSON text is the default.
+
+    Chat over the socket (no per-turn HTTP request / token check):
+    - authenticate once: ?token=<jwt> or {"type": "auth", "token": "<jwt>"}
+      (a ?token= that is invalid or belongs to another user closes with 4401)
+    - {"type": "chat", "id": "<request id>", "text": "..."} → {"type": "chat_result", "id", "reply", ...}
+      (up to WS_MAX_INFLIGHT_PER_SOCKET at a time; the reply also fans out to
+      all devices as a "reply" frame carrying request_id)
+    - {"type": "cancel", "id": "<request id>"} → aborts the generation → {"type": "cancelled", "id"}
+    - failures → {"type": "error", "id", "error"}; a frame that doesn't decode
+      gets {"type": "error", "error": "bad_frame"} and the socket stays open
+
+    ?device_id= joins the device channel only for one of the user's devices
+    and only with ?device_token=<token from /devices/register> or ?token=;
+    otherwise the socket is closed with 4401.
+    Device agents receive system_control commands as
+    {"type": "command", "id", "action", "params", ...} and answer
+    {"type": "command_ack", "id"}, then {"type": "command_result", "id", "ok", "result"}.
+    Open commands are re-sent on every connect (see services/command_queue.py).
+
+    The server sends {"type": "ping"} to sockets idle for WS_HEARTBEAT_INTERVAL_SECONDS;
+    answer with {"type": "pong"}. Sockets silent for WS_IDLE_TIMEOUT_SECONDS are closed.
     """
-    await ws_manager.connect(user_id, websocket)
+    offered = websocket.headers.get("sec-websocket-protocol", "").split(",")
+    wire, subprotocol = protocol.negotiate([o for o in offered if o.strip()], proto)
+    user = await _authenticate(user_id, token) if token is not None else None
+    if (token is not None or last_seq is not None) and user is None:
+        await _reject(websocket, subprotocol)
+        return
+    if device_id and not await _verify_device(user_id, device_id, device_token, user):
+        await _reject(websocket, subprotocol)
+        return
+    conn_id = await ws_manager.connect(user_id, websocket, device_id, proto=wire, subprotocol=subprotocol)
+    requests = _ChatRequests(conn_id)
 
     try:
+        if last_seq is not None:
+            await outbox.replay(conn_id, user_id, last_seq)
+        if device_id:
+            await command_queue.deliver_pending(user_id, device_id)
+
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            ws_manager.mark_alive(conn_id)
+            try:
+                data = protocol.decode_incoming(message)
+            except Exception:
+                # malformed JSON / MessagePack: answer it, keep the socket
+                await ws_manager.send_to_connection(conn_id, {"type": "error", "id": None, "error": "bad_frame"})
+                continue
+            if data is None:
+                continue
+            kind = data.get("type")
+
+            if kind == "chat":
+                request_id = str(data.get("id") or "")
+                if not request_id or not isinstance(data.get("text"), str):
+                    await ws_manager.send_to_connection(conn_id, {"type": "error", "id": request_id or None, "error": "bad_request"})
+                elif user is None:
+                    await ws_manager.send_to_connection(conn_id, {"type": "error", "id": request_id, "error": "unauthorized"})
+                else:
+                    await requests.start(user, request_id, data["text"])
+                continue
+
+            if kind == "cancel":
+                request_id = str(data.get("id") or "")
+                if not requests.cancel(request_id):
+                    await ws_manager.send_to_connection(conn_id, {"type": "error", "id": request_id, "error": "unknown_id"})
+                continue
+
+            if kind in ("command_ack", "command_result"):
+                command_id = str(data.get("id") or "")
+                if not device_id or not command_id:
+                    await ws_manager.send_to_connection(conn_id, {"type": "error", "id": command_id or None, "error": "bad_request"})
+                elif kind == "command_ack":
+                    await command_queue.ack(user_id, device_id, command_id)
+                else:
+                    await command_queue.complete(user_id, device_id, command_id, bool(data.get("ok", True)), data.get("result"))
+                continue
+
+            if kind == "auth":
+                user = await _authenticate(user_id, data.get("token"))
+                await ws_manager.send_to_connection(
+                    conn_id, {"type": "auth_ok"} if user is not None else {"type": "error", "error": "unauthorized"}
+                )
+                continue
+
+            if kind == "resume":
+                if user is None:
+                    await ws_manager.close(conn_id, WS_UNAUTHORIZED)
+                    break
+                try:
+                    resume_from = int(data.get("last_seq") or 0)
+                except (TypeError, ValueError):
+                    await ws_manager.send_to_connection(conn_id, {"type": "error", "id": None, "error": "bad_request"})
+                    continue
+                await outbox.replay(conn_id, user_id, resume_from)
+                continue
 
-            # simple ping-pong
-            if data.get("type") == "ping":
-                await ws_manager.send_personal(user_id, {"type": "pong"})
+            # simple ping-pong (client-initiated), or the answer to a server heartbeat
+            if kind == "ping":
+                presence.touch(user_id, device_id)
+                await ws_manager.send_to_connection(conn_id, {"type": "pong"})
+            elif kind == "pong":
+                presence.touch(user_id, device_id)
 
     except WebSocketDisconnect:
-        await ws_manager.disconnect(user_id)
\ No newline at end of file
+        pass
+    finally:
+        requests.cancel_all()
+        await ws_manager.disconnect(conn_id)
@@ -0,0 +1,106 @@
+# app/core/auth_cache.py
+"""
+Per-process caches for request authentication.
+
+get_current_user runs on every authenticated request. With these caches a
+repeat request costs two dictionary lookups instead of an HMAC verify plus
+a DB round-trip:
+- tokens: raw JWT -> user_id, kept until the token's own `exp`
+- users:  user_id -> detached User snapshot, kept AUTH_USER_CACHE_TTL_SECONDS
+
+Anything that modifies or deletes a user must call invalidate_user() (crud's
+update_user* functions do); the TTL bounds staleness for changes made by
+other processes.
+
+Logout revokes its token here until the token's `exp`. Like the caches, the
+revocation list is per-process: other workers keep accepting the token.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import settings
+
+
+class TTLCache:
+    """
+    Bounded LRU map whose entries carry their own expiry (epoch seconds).
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+tokens = TTLCache(settings.AUTH_TOKEN_CACHE_SIZE)
+users = TTLCache(settings.AUTH_USER_CACHE_SIZE)
+
+# not an LRU: evicting an entry would bring a logged-out token back to life
+_revoked: Dict[str, float] = {}
+_revoked_lock = threading.Lock()
+
+
+def invalidate_user(user_id: str) -> None:
+    """Drop a user's cached snapshot (call after the user row changes)."""
+    users.pop(user_id)
+
+
+def forget_token(token: str) -> None:
+    """Drop a decoded token (e.g. on logout) so the next request re-verifies it."""
+    tokens.pop(token)
+
+
+def revoke_token(token: str, expires_at: float) -> None:
+    """Reject `token` until `expires_at` (its own exp); after that it is invalid anyway."""
+    now = time.time()
+    with _revoked_lock:
+        for key in [k for k, exp in _revoked.items() if exp <= now]:
+            del _revoked[key]
+        _revoked[token] = expires_at
+    forget_token(token)
+
+
+def is_revoked(token: str) -> bool:
+    with _revoked_lock:
+        exp = _revoked.get(token)
+    return exp is not None and exp > time.time()
+
+
+def stats() -> dict:
+    return {
+        "tokens": {"size": len(tokens._entries), "hits": tokens.hits, "misses": tokens.misses},
+        "users": {"size": len(users._entries), "hits": users.hits, "misses": users.misses},
+        "revoked": len(_revoked),
+    }
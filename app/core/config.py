@@ -19,6 +19,15 @@ class Settings(BaseSettings):
     DATABASE_MODE: str = "sqlite"
     DATABASE_URL: str = "sqlite:///app/data/memory.db"
 
+    # SQLite production profile (WAL + single batched writer)
+    SQLITE_PRODUCTION_PROFILE: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_BATCH_WRITER: bool = True
+    SQLITE_WRITER_MAX_BATCH: int = 256
+    SQLITE_WRITER_MAX_DELAY_MS: float = 2.0     # group-commit window
+
     # --------------------------------------------
     # SUPABASE (Optional)
     # --------------------------------------------
@@ -31,6 +40,16 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "replace-with-strong-secret"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
 
+    # Auth caches (per process): decoded tokens until exp, users for a short TTL
+    AUTH_CACHE_ENABLED: bool = True
+    AUTH_TOKEN_CACHE_SIZE: int = 10_000
+    AUTH_USER_CACHE_SIZE: int = 10_000
+    AUTH_USER_CACHE_TTL_SECONDS: int = 300
+
+    # bcrypt runs in a dedicated process pool; beyond workers + queue, logins get 503
+    AUTH_HASH_WORKERS: int = 2                 # 0 = use the shared threadpool instead
+    AUTH_HASH_QUEUE: int = 32
+
     # --------------------------------------------
     # AI MODEL CONFIG
     # --------------------------------------------
@@ -48,9 +67,114 @@ class Settings(BaseSettings):
     DEBUG: bool = True
 
     # --------------------------------------------
-    # REDIS (for multi-device sync)
+    # REDIS / PUB-SUB (for multi-instance sync)
     # --------------------------------------------
     REDIS_URL: str | None = None
+    PUBSUB_BACKEND: str = "auto"               # auto / inprocess / unix / redis
+    PUBSUB_UNIX_PATH: str = "/tmp/zylos-pubsub.sock"
+    REDIS_BRIDGE_SHARDS: int = 0               # 0 = one channel per connected user; N = hashed shard channels
+
+    # --------------------------------------------
+    # DEVICE PRESENCE (in memory, flushed in batches)
+    # --------------------------------------------
+    PRESENCE_FLUSH_SECONDS: float = 5.0        # how often dirty last_seen values hit the DB
+
+    # per-socket outbound queue; policy when it is full: drop / coalesce / disconnect
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SLOW_CONSUMER_POLICY: str = "coalesce"
+    # server heartbeats: one timer wheel pings sockets idle for an interval and
+    # reaps those silent for WS_IDLE_TIMEOUT_SECONDS (0 = 2.5 x interval); interval 0 disables
+    WS_HEARTBEAT_INTERVAL_SECONDS: float = 30.0
+    WS_HEARTBEAT_TICK_SECONDS: float = 1.0
+    WS_IDLE_TIMEOUT_SECONDS: float = 75.0
+    # chat turns a single socket may have in flight at once (see api/websocket.py)
+    WS_MAX_INFLIGHT_PER_SOCKET: int = 4
+    # negotiate permessage-deflate with clients that offer it (uvicorn websockets impl)
+    WS_PER_MESSAGE_DEFLATE: bool = True
+
+    # durable per-user outbox: clients resume with ?last_seq= and get only the gap
+    OUTBOX_ENABLED: bool = True
+    OUTBOX_MAX_PER_USER: int = 1000            # newest entries kept per user
+    OUTBOX_RETENTION_HOURS: int = 72
+    OUTBOX_REPLAY_BATCH: int = 100             # entries per replay frame
+
+    # --------------------------------------------
+    # DEVICE COMMANDS (system_control queue, see services/command_queue.py)
+    # --------------------------------------------
+    COMMAND_TTL_SECONDS: int = 300             # unfinished commands expire after this
+    COMMAND_ACK_TIMEOUT_SECONDS: float = 10.0  # resend when a sent command isn't acked in time
+    COMMAND_MAX_ATTEMPTS: int = 3              # deliveries before a never-acked command fails
+    COMMAND_SWEEP_SECONDS: float = 2.0         # ack-timeout / TTL sweep interval
+    COMMAND_RETENTION_DAYS: int = 7            # finished commands kept for the status API
+
+    # --------------------------------------------
+    # PUSH NOTIFICATIONS (FCM, batched + retried)
+    # --------------------------------------------
+    FCM_SERVER_KEY: str | None = None          # unset = push disabled
+    FCM_ENDPOINT: str = "https://fcm.googleapis.com/fcm/send"  # point at app.services.fcm_standin offline
+    PUSH_BATCH_SIZE: int = 500                 # tokens per multicast request (FCM max 1000)
+    PUSH_BATCH_WINDOW_MS: float = 20.0         # how long to gather tokens for the same message
+    PUSH_CONCURRENCY: int = 4                  # multicast requests in flight
+    PUSH_QUEUE_SIZE: int = 50_000              # queued tokens; beyond this sends are dropped
+    PUSH_MAX_RETRIES: int = 5
+    PUSH_BACKOFF_BASE_SECONDS: float = 0.5     # exponential backoff with full jitter
+    PUSH_BACKOFF_MAX_SECONDS: float = 60.0
+    PUSH_TIMEOUT_SECONDS: float = 10.0
+
+    # --------------------------------------------
+    # TOOLS HTTP CLIENT (shared pool for weather/search/wiki/youtube/location)
+    # --------------------------------------------
+    TOOLS_HTTP_MAX_CONNECTIONS: int = 50       # open connections across all hosts
+    TOOLS_HTTP_MAX_KEEPALIVE: int = 20         # idle connections kept for reuse
+    TOOLS_HTTP_KEEPALIVE_SECONDS: float = 60.0 # idle connections are closed after this
+    TOOLS_HTTP_MAX_PER_HOST: int = 8           # concurrent requests per upstream host
+    TOOLS_HTTP_TIMEOUT_SECONDS: float = 10.0   # default; tools pass their own
+    TOOLS_HTTP2: bool = True                   # used only when the `h2` package is installed
+
+    # --------------------------------------------
+    # TOOL RESULT CACHE (policies per tool in ai/tools/tool_router.py)
+    # --------------------------------------------
+    TOOL_CACHE_ENABLED: bool = True
+    TOOL_CACHE_PATH: str = "app/data/tool_cache.db"   # persistent tier; "" = memory only
+    TOOL_CACHE_MEMORY_ITEMS: int = 1024               # in-process LRU entries
+    TOOL_CACHE_REVALIDATE_WAIT_SECONDS: float = 1.5   # stale entry: wait this long for a fresh result
+    TOOL_CACHE_REVALIDATE_WORKERS: int = 4            # background refresh threads
+
+    # --------------------------------------------
+    # MEMORY ENGINE
+    # --------------------------------------------
+    SHORT_TERM_MEMORY_LIMIT: int = 50          # items kept per conversation
+    SHORT_TERM_IDLE_TTL_SECONDS: int = 60 * 60  # evict conversations idle this long
+    SHORT_TERM_MAX_CONVERSATIONS: int = 5000   # LRU cap on buffered conversations
+    SHORT_TERM_MAX_ITEMS: int = 100_000        # global cap on buffered items
+    SUMMARIZE_MEMORY_INTERVAL: int = 10        # dialog turns per leaf summary
+    SUMMARY_FANOUT: int = 4                    # summaries merged into one at the next level
+    SUMMARY_MAX_LEVELS: int = 4                # top level only grows (capped at 200)
+    SUMMARY_MAX_PENDING: int = 40              # unsummarized turns kept while the LLM fails (oldest dropped)
+    SUMMARY_RETRY_SECONDS: float = 60.0        # wait after a failed summary, doubled per failure...
+    SUMMARY_RETRY_MAX_SECONDS: float = 1800.0  # ...up to this
+    MEMORY_DEDUP_ENABLED: bool = True
+    MEMORY_DEDUP_WINDOW: int = 50              # recent long-term items compared per insert
+    MEMORY_DEDUP_MAX_HAMMING: int = 3          # SimHash distance treated as a duplicate
+    MEMORY_DEDUP_LOOSE_HAMMING: int = 12       # candidates for the embedding check
+    MEMORY_DEDUP_EMBED_THRESHOLD: float | None = None  # e.g. 0.95 cosine; None disables
+
+    # --------------------------------------------
+    # RECENT MESSAGE CACHE (write-through, per process)
+    # --------------------------------------------
+    MESSAGE_CACHE_ENABLED: bool = True
+    MESSAGE_CACHE_PER_KEY: int = 100           # newest messages kept per conversation / user
+    MESSAGE_CACHE_MAX_KEYS: int = 10_000       # LRU cap on cached conversations / users
+    MESSAGE_CACHE_TTL_SECONDS: int = 300       # refill windows after this (archival happens in the scheduler); 0 = never
+    EXPORT_BATCH_SIZE: int = 500               # rows per keyset batch in /memory/export
+
+    # --------------------------------------------
+    # MESSAGE ARCHIVE (cold rows -> compressed segments)
+    # --------------------------------------------
+    ARCHIVE_ENABLED: bool = True
+    ARCHIVE_AFTER_DAYS: int = 90               # messages older than this leave the hot table
+    ARCHIVE_SEGMENT_ROWS: int = 1000           # max rows per compressed segment
+    ARCHIVE_ZSTD_LEVEL: int = 10
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,174 @@
+# app/core/hashing_pool.py
+"""
+Bounded worker pool for bcrypt.
+
+bcrypt costs ~100-300 ms of CPU per hash/verify. Run inline (or in the
+shared threadpool) a burst of logins holds the GIL/threads that chat
+requests need. Here hashing runs in a small dedicated process pool:
+- at most AUTH_HASH_WORKERS hashes run at once (one per process),
+- at most AUTH_HASH_QUEUE more wait behind them,
+- anything beyond that is rejected immediately with HashPoolBusy, which
+  the auth routes turn into 503 + Retry-After instead of queueing forever.
+
+AUTH_HASH_WORKERS=0 keeps the same admission limit but runs hashes in the
+shared threadpool (useful where subprocesses are unavailable). If the
+process pool breaks twice in a row for one call, that call falls back to
+the threadpool too.
+
+A slot is held until its hash actually finishes: a client that disconnects
+mid-login cancels the await, not the worker, so the slot is released by
+the worker future's completion rather than by the cancelled request.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from anyio import to_thread
+from passlib.context import CryptContext
+
+from .config import settings
+
+logger = logging.getLogger("core.hashing_pool")
+
+# also built in each worker process on import
+_pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hash queue is full; callers should ask the client to retry."""
+
+
+# -------------------------
+# Worker functions (run in the child processes)
+# -------------------------
+def _hash(password: str) -> str:
+    return _pwd_context.hash(password)
+
+def _verify(plain: str, hashed: str) -> bool:
+    try:
+        return _pwd_context.verify(plain, hashed)
+    except Exception:
+        return False
+
+
+class HashingPool:
+    def __init__(self, workers: int, queue: int):
+        self.workers = workers
+        self.capacity = max(1, workers) + max(0, queue)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: never fork the server process with its DB/writer threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _admit(self):
+        with self._lock:
+            if self._inflight >= self.capacity:
+                self.rejected += 1
+                raise HashPoolBusy()
+            self._inflight += 1
+
+    def _release(self):
+        with self._lock:
+            self._inflight -= 1
+            self.completed += 1
+
+    def _release_once(self):
+        """A release callback that frees the admitted slot exactly once."""
+        state = {"done": False}
+
+        def release(*_):
+            with self._lock:
+                if state["done"]:
+                    return
+                state["done"] = True
+            self._release()
+        return release
+
+    async def run(self, fn, *args):
+        self._admit()
+        release = self._release_once()
+        if self.workers > 0:
+            for _ in range(2):
+                try:
+                    future = self._get_executor().submit(fn, *args)
+                except BrokenProcessPool:
+                    self._reset_executor()
+                    continue
+                except BaseException:
+                    release()
+                    raise
+                try:
+                    result = await asyncio.wrap_future(future)
+                except BrokenProcessPool:
+                    logger.warning("Hashing pool broke (worker died); restarting it")
+                    self._reset_executor()
+                    continue
+                except BaseException:
+                    # cancelled by the client (the worker keeps hashing) or fn failed:
+                    # the slot frees when the worker future completes
+                    future.add_done_callback(release)
+                    raise
+                release()
+                return result
+            logger.error("Hashing pool unavailable; hashing in the threadpool")
+        try:
+            # to_thread.run_sync defers cancellation until the thread returns
+            return await to_thread.run_sync(fn, *args)
+        finally:
+            release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(_hash, password)
+
+    async def verify(self, plain: str, hashed: str) -> bool:
+        return await self.run(_verify, plain, hashed)
+
+    def warm_up(self):
+        """Start the worker processes now instead of on the first login (blocking)."""
+        if self.workers <= 0:
+            return
+        try:
+            executor = self._get_executor()
+            for f in [executor.submit(abs, 0) for _ in range(self.workers)]:
+                f.result()
+        except Exception:
+            # not fatal: run() restarts the pool or falls back to the threadpool
+            logger.exception("Hashing pool warm-up failed")
+            self._reset_executor()
+
+    def shutdown(self):
+        self._reset_executor()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers, "capacity": self.capacity, "inflight": self._inflight,
+            "completed": self.completed, "rejected": self.rejected,
+        }
+
+
+hashing_pool = HashingPool(settings.AUTH_HASH_WORKERS, settings.AUTH_HASH_QUEUE)
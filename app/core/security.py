@@ -1,15 +1,18 @@
 # app/core/security.py
 
+import time
 from datetime import datetime, timedelta
 from jose import jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from .config import settings
-from typing import Optional
-from sqlmodel import Session
-from app.database.base import get_session
+from typing import Optional, Tuple
+from app.database.base import get_async_session
+from app.database import crud
 from app.database.models import User
+from . import auth_cache
+from .hashing_pool import hashing_pool
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -29,6 +32,14 @@ def verify_password(plain: str, hashed: str) -> bool:
     except:
         return False
 
+# Request handlers use these: bcrypt runs in the bounded hashing pool and
+# raises HashPoolBusy when it is saturated.
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_pool.hash(password)
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await hashing_pool.verify(plain, hashed)
+
 # ------------------------------------------------------------
 # JWT TOKEN CREATION
 # ------------------------------------------------------------
@@ -48,25 +59,74 @@ def create_access_token(subject: str, expires_delta: int | None = None):
 # ------------------------------------------------------------
 # JWT DECODING
 # ------------------------------------------------------------
-def decode_token(token: str) -> Optional[str]:
+def _decode_claims(token: str) -> Optional[Tuple[str, float]]:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        return payload.get("sub")
     except:
         return None
+    sub = payload.get("sub")
+    if not sub:
+        return None
+    return sub, float(payload.get("exp") or time.time())
+
+def revoke_access_token(token: str) -> None:
+    """Logout: the token stops authenticating (in this process) before its exp."""
+    claims = _decode_claims(token)
+    if claims:
+        auth_cache.revoke_token(token, claims[1])
+    else:
+        auth_cache.forget_token(token)
+
+def decode_token(token: str) -> Optional[str]:
+    claims = _decode_claims(token)
+    return claims[0] if claims else None
+
+def _cached_user_id(token: str) -> Optional[str]:
+    # a verified token stays valid until its exp; skip the HMAC check until then
+    user_id = auth_cache.tokens.get(token)
+    if user_id is not None:
+        return user_id
+    claims = _decode_claims(token)
+    if not claims:
+        return None
+    auth_cache.tokens.set(token, claims[0], claims[1])
+    return claims[0]
 
 # ------------------------------------------------------------
 # CURRENT USER RETRIEVER
 # ------------------------------------------------------------
-def get_current_user(token: str = Depends(oauth2_scheme)):
+async def resolve_user(token: str, session) -> Optional[User]:
+    """
+    Token -> User, or None if the token is invalid, revoked or the user is gone.
+    Shared by get_current_user and the WebSocket "auth" message.
+    """
+    if auth_cache.is_revoked(token):
+        return None
+    if not settings.AUTH_CACHE_ENABLED:
+        user_id = decode_token(token)
+        if not user_id:
+            return None
+        return await crud.get_user_by_id_async(session, user_id)
 
-    user_id = decode_token(token)
+    user_id = _cached_user_id(token)
     if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        return None
 
-    with next(get_session()) as session:
-        user = session.get(User, user_id)
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
+    user = auth_cache.users.get(user_id)
+    if user is not None:
+        return user
 
-        return user
\ No newline at end of file
+    row = await crud.get_user_by_id_async(session, user_id)
+    if not row:
+        return None
+
+    # detached copy: safe to share across requests after this session closes
+    user = User(**row.model_dump())
+    auth_cache.users.set(user_id, user, time.time() + settings.AUTH_USER_CACHE_TTL_SECONDS)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session = Depends(get_async_session)):
+    user = await resolve_user(token, session)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return user
@@ -0,0 +1,226 @@
+# app/database/archive.py
+"""
+Cold-message archival.
+
+Messages older than ARCHIVE_AFTER_DAYS are moved out of the hot `messages`
+table into `message_archive` segments: compressed blobs per conversation
+and month holding up to ARCHIVE_SEGMENT_ROWS rows. Each run tops up the
+month's last segment before starting a new one, so a month ends up with
+ceil(rows / ARCHIVE_SEGMENT_ROWS) segments however often the job runs. The
+hot table (and its indexes and FTS index) then only grows with recent traffic.
+
+Archival moves the oldest rows first and every later message is newer, so a
+conversation's archived rows are always older than its hot rows. Keyset
+readers (crud.get_messages_page_*) use that: they only fall through to the
+archive once a page runs past the oldest hot row.
+
+Segments are zstd-compressed JSON row lists; zlib is used when the
+zstandard package is not installed (the codec is stored per segment).
+"""
+
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlmodel import Session, delete, select
+
+from ..core.config import settings
+from . import message_cache
+from .base import engine
+from .models import Conversation, Message, MessageArchive
+from .writer import db_writer
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+logger = logging.getLogger("db.archive")
+
+CODEC = "zstd" if zstandard is not None else "zlib"
+
+Position = Tuple[datetime, str]  # (timestamp, id) keyset position
+
+
+# -------------------------
+# Codec
+# -------------------------
+def _compress(raw: bytes) -> bytes:
+    if CODEC == "zstd":
+        return zstandard.ZstdCompressor(level=settings.ARCHIVE_ZSTD_LEVEL).compress(raw)
+    return zlib.compress(raw, 6)
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd archive segments")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+def encode_segment(rows: List[Message]) -> bytes:
+    packed = [[m.id, m.user_id, m.role, m.text, m.meta, m.timestamp.isoformat()] for m in rows]
+    return _compress(json.dumps(packed, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decode_segment(seg: MessageArchive) -> List[Message]:
+    """Segment rows as detached Message objects, oldest -> newest."""
+    packed = json.loads(_decompress(seg.codec, seg.data))
+    return [
+        Message(id=i, conversation_id=seg.conversation_id, user_id=u, role=r, text=t, meta=meta,
+                timestamp=datetime.fromisoformat(ts))
+        for i, u, r, t, meta, ts in packed
+    ]
+
+
+# -------------------------
+# Archival job
+# -------------------------
+def _write(op: Callable[[Session], int]) -> int:
+    # go through the single writer when it owns the DB, like every other write
+    if db_writer.enabled:
+        return db_writer.submit(op).result()
+    with Session(engine, expire_on_commit=False) as session:
+        res = op(session)
+        session.commit()
+        return res
+
+def _pack_month(session: Session, conversation_id: str, owner: str, month: str, chunk: List[Message]):
+    """
+    Stores one month's newly archived rows. They are newer than anything already
+    archived, so they top up the month's last segment first and only overflow
+    into new segments past ARCHIVE_SEGMENT_ROWS: daily runs don't leave a trail
+    of tiny segments.
+    """
+    cap = max(1, settings.ARCHIVE_SEGMENT_ROWS)
+    tail = session.exec(
+        select(MessageArchive)
+        .where(MessageArchive.conversation_id == conversation_id, MessageArchive.month == month)
+        .order_by(MessageArchive.last_ts.desc())
+        .limit(1)
+    ).first()
+    if tail is not None and tail.count < cap:
+        room = cap - tail.count
+        rows = decode_segment(tail) + chunk[:room]
+        tail.data, tail.codec = encode_segment(rows), CODEC
+        tail.count, tail.last_ts = len(rows), rows[-1].timestamp
+        session.add(tail)
+        chunk = chunk[room:]
+    for i in range(0, len(chunk), cap):
+        part = chunk[i:i + cap]
+        session.add(MessageArchive(
+            conversation_id=conversation_id, user_id=owner, month=month,
+            first_ts=part[0].timestamp, last_ts=part[-1].timestamp, count=len(part),
+            codec=CODEC, data=encode_segment(part),
+        ))
+
+def _archive_batch_op(conversation_id: str, owner: str, cutoff: datetime, limit: int):
+    def op(session: Session) -> int:
+        rows = session.exec(
+            select(Message)
+            .where(Message.conversation_id == conversation_id, Message.timestamp < cutoff)
+            .order_by(Message.timestamp.asc(), Message.id.asc())
+            .limit(limit)
+        ).all()
+        if not rows:
+            return 0
+        months = {}
+        for m in rows:
+            months.setdefault(m.timestamp.strftime("%Y-%m"), []).append(m)
+        for month, chunk in months.items():
+            _pack_month(session, conversation_id, owner, month, chunk)
+        # segment writes and hot-row delete commit together: a row is never in both or neither
+        session.exec(delete(Message).where(Message.id.in_([m.id for m in rows])))
+        return len(rows)
+    return op
+
+def archive_conversation(conversation_id: str, owner: str, cutoff: datetime) -> int:
+    """Moves one conversation's messages older than `cutoff` into segments. Returns rows moved."""
+    batch = max(1, settings.ARCHIVE_SEGMENT_ROWS)
+    moved = 0
+    while True:
+        n = _write(_archive_batch_op(conversation_id, owner, cutoff, batch))
+        moved += n
+        if n < batch:
+            break
+        time.sleep(0)  # let queued chat writes through between batches
+    if moved:
+        message_cache.by_conversation.invalidate(conversation_id)
+        message_cache.by_user.invalidate(owner)
+    return moved
+
+def archive_old_messages(older_than_days: Optional[int] = None) -> int:
+    """
+    Archives every conversation's messages older than `older_than_days`
+    (default ARCHIVE_AFTER_DAYS). Safe to re-run; returns rows moved.
+    """
+    days = settings.ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    with Session(engine) as session:
+        convs = session.exec(select(Conversation.id, Conversation.user_id)).all()
+    total = 0
+    for conv_id, owner in convs:
+        try:
+            total += archive_conversation(conv_id, owner, cutoff)
+        except Exception:
+            logger.exception("Archiving conversation %s failed", conv_id)
+    return total
+
+
+# -------------------------
+# Reads (keyset fall-through)
+# -------------------------
+_SEGMENT_KEYS = {"conversation_id": MessageArchive.conversation_id, "user_id": MessageArchive.user_id}
+
+def segment_ids_stmt(by: str, key: str, after: Optional[Position], ascending: bool):
+    """
+    (id, first_ts, last_ts) of the segments that can hold rows past `after`,
+    in read order: oldest first_ts first, or newest last_ts first (blobs not loaded).
+    """
+    stmt = select(MessageArchive.id, MessageArchive.first_ts, MessageArchive.last_ts).where(_SEGMENT_KEYS[by] == key)
+    if after is not None:
+        ts = after[0]
+        stmt = stmt.where(MessageArchive.last_ts >= ts if ascending else MessageArchive.first_ts <= ts)
+    if ascending:
+        return stmt.order_by(MessageArchive.first_ts.asc())
+    return stmt.order_by(MessageArchive.last_ts.desc())
+
+def page_rows(seg: MessageArchive, by: str, key: str, after: Optional[Position], ascending: bool) -> Iterable[Message]:
+    rows = decode_segment(seg)
+    if by == "user_id":
+        rows = [m for m in rows if m.user_id == key]
+    if after is not None:
+        rows = [m for m in rows if ((m.timestamp, m.id) > after if ascending else (m.timestamp, m.id) < after)]
+    return rows if ascending else reversed(rows)
+
+# A user's segments come from several conversations and their time ranges can
+# overlap, so pages are merged by (timestamp, id) rather than concatenated.
+# Reading stops once `limit` rows are held and no remaining segment can reach
+# into them (its first_ts / last_ts lies past the limit-th row).
+
+def _merge(out: List[Message], rows: Iterable[Message], ascending: bool):
+    out.extend(rows)
+    out.sort(key=lambda m: (m.timestamp, m.id), reverse=not ascending)
+
+def _page_full(out: List[Message], limit: int, edge: datetime, ascending: bool) -> bool:
+    if len(out) < limit:
+        return False
+    last = out[limit - 1].timestamp
+    return edge > last if ascending else edge < last
+
+def read_page_sql(session: Session, by: str, key: str, limit: int, after: Optional[Position], ascending: bool) -> List[Message]:
+    out: List[Message] = []
+    for seg_id, first_ts, last_ts in session.exec(segment_ids_stmt(by, key, after, ascending)).all():
+        if _page_full(out, limit, first_ts if ascending else last_ts, ascending):
+            break
+        _merge(out, page_rows(session.get(MessageArchive, seg_id), by, key, after, ascending), ascending)
+    return out[:limit]
+
+async def read_page_sql_async(session, by: str, key: str, limit: int, after: Optional[Position], ascending: bool) -> List[Message]:
+    out: List[Message] = []
+    for seg_id, first_ts, last_ts in (await session.exec(segment_ids_stmt(by, key, after, ascending))).all():
+        if _page_full(out, limit, first_ts if ascending else last_ts, ascending):
+            break
+        _merge(out, page_rows(await session.get(MessageArchive, seg_id), by, key, after, ascending), ascending)
+    return out[:limit]
@@ -1,8 +1,10 @@
 # app/database/base.py
 from pathlib import Path
-from typing import Generator
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Generator
 import os
 
+from sqlalchemy import event
 from sqlmodel import create_engine, Session
 from ..core.config import settings
 
@@ -11,6 +13,36 @@ Path("app/data").mkdir(parents=True, exist_ok=True)
 
 DB_MODE = (settings.DATABASE_MODE or "sqlite").lower()
 
+
+def _async_url(url: str) -> str:
+    """
+    Map a sync DATABASE_URL onto its async driver:
+    sqlite -> aiosqlite, postgres -> asyncpg.
+    """
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if base in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+def _apply_sqlite_profile(dbapi_conn, _record) -> None:
+    """
+    SQLite production profile: WAL lets readers run alongside the single writer,
+    synchronous=NORMAL fsyncs only at checkpoints (safe with WAL), and mmap
+    avoids read() copies for hot pages.
+    """
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+    cur.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+
+
 # SQLite (default) uses check_same_thread; Postgres does not.
 if DB_MODE in ("sqlite", "supabase"):
     print(f"[db.base] Initializing SQL DB (mode={DB_MODE})")
@@ -22,6 +54,23 @@ if DB_MODE in ("sqlite", "supabase"):
         connect_args = {"check_same_thread": False}
 
     engine = create_engine(database_url, echo=False, connect_args=connect_args)
+    if database_url.startswith("sqlite") and settings.SQLITE_PRODUCTION_PROFILE:
+        event.listen(engine, "connect", _apply_sqlite_profile)
+
+    # Async engine (aiosqlite / asyncpg) for request handlers. Optional: when the
+    # driver is missing, get_async_session hands out sync sessions and the async
+    # crud helpers run them in the threadpool instead.
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from sqlmodel.ext.asyncio.session import AsyncSession
+
+        async_engine = create_async_engine(_async_url(database_url), echo=False)
+        if database_url.startswith("sqlite") and settings.SQLITE_PRODUCTION_PROFILE:
+            event.listen(async_engine.sync_engine, "connect", _apply_sqlite_profile)
+    except Exception as exc:
+        print("[db.base] Async DB driver missing or failed, using sync sessions:", exc)
+        AsyncSession = None
+        async_engine = None
 
     def get_session() -> Generator[Session, None, None]:
         """
@@ -30,13 +79,35 @@ if DB_MODE in ("sqlite", "supabase"):
         with Session(engine) as session:
             yield session
 
+    async def get_async_session() -> AsyncGenerator:
+        """
+        Yield an AsyncSession (or a sync Session when no async driver is installed).
+        Use as a FastAPI dependency together with the crud *_async helpers.
+        """
+        if async_engine is None:
+            with Session(engine) as session:
+                yield session
+            return
+        # expire_on_commit=False: rows stay readable after commit without a lazy reload
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    # For code outside the request scope (e.g. streaming response bodies):
+    #     async with open_async_session() as session: ...
+    open_async_session = asynccontextmanager(get_async_session)
+
     def init_db() -> None:
         """
-        Create SQL tables (if using SQL). Import models lazily to avoid circular imports.
+        Create SQL tables (if using SQL) and apply pending migrations.
+        Import models lazily to avoid circular imports.
         """
         from .models import SQLModel  # SQLModel metadata includes all models
+        from .migrations import run_migrations
         SQLModel.metadata.create_all(engine)
         print("[db.base] SQLModel metadata created (tables initialized)")
+        applied = run_migrations(engine)
+        if applied:
+            print(f"[db.base] Applied migrations: {applied}")
 
 else:
-    raise ValueError(f"Unsupported DATABASE_MODE: {DB_MODE}")
\ No newline at end of file
+    raise ValueError(f"Unsupported DATABASE_MODE: {DB_MODE}")
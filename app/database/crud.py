@@ -1,9 +1,50 @@
 # app/database/crud.py
-from typing import Optional, List, Dict
-from sqlmodel import select, Session
+import base64
+import re
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import bindparam, func, text as sql_text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from sqlmodel import delete, select, Session
 from datetime import datetime
-from .models import User, Conversation, Message, Device, TrainingItem
-from .base import DB_MODE
+from anyio import to_thread
+from .models import User, Conversation, Message, Device, DeviceCommand, OutboxEntry, TrainingItem
+from .base import DB_MODE, AsyncSession, database_url
+from . import archive, message_cache
+from .writer import db_writer
+from ..core import auth_cache
+from ..core.config import settings
+
+# -------------------------
+# WRITE helpers
+# With the SQLite batch writer enabled every INSERT/UPDATE is group-committed
+# by one background thread; ids/timestamps are client-side so no refresh().
+# -------------------------
+def _insert_sql(session: Session, obj):
+    if db_writer.enabled:
+        return db_writer.add(obj).result()
+    session.add(obj)
+    session.commit()
+    session.refresh(obj)
+    return obj
+
+async def _insert_sql_async(session, obj):
+    if db_writer.enabled:
+        return await db_writer.add_async(obj)
+    session.add(obj)
+    await session.commit()
+    return obj
+
+def _get_or_create_conv_op(user_id: str):
+    # runs inside the writer transaction, so concurrent first messages can't create two conversations
+    def op(session: Session):
+        conv = session.exec(select(Conversation).where(Conversation.user_id == user_id)).first()
+        if conv:
+            return conv, False
+        conv = Conversation(user_id=user_id, title="Chat")
+        session.add(conv)
+        return conv, True
+    return op
 
 # -------------------------
 # USER helpers (SQL mode)
@@ -15,10 +56,31 @@ def get_user_by_id_sql(session: Session, user_id: str) -> Optional[User]:
     return session.get(User, user_id)
 
 def create_user_sql(session: Session, email: str, password_hash: str, name: Optional[str] = None) -> User:
-    user = User(email=email, password_hash=password_hash, name=name)
-    session.add(user)
-    session.commit()
-    session.refresh(user)
+    user = _insert_sql(session, User(email=email, password_hash=password_hash, name=name))
+    if message_cache.enabled():
+        message_cache.by_user.prime_empty(user.id)
+    return user
+
+def _update_user_op(user_id: str, changes: Dict):
+    def op(session: Session):
+        user = session.get(User, user_id)
+        if user:
+            for field, value in changes.items():
+                setattr(user, field, value)
+            session.add(user)
+        return user
+    return op
+
+def update_user_sql(session: Session, user_id: str, **changes) -> Optional[User]:
+    if db_writer.enabled:
+        user = db_writer.submit(_update_user_op(user_id, changes)).result()
+    else:
+        user = _update_user_op(user_id, changes)(session)
+        session.commit()
+        if user:
+            session.refresh(user)
+    # get_current_user serves cached snapshots; drop this one
+    auth_cache.invalidate_user(user_id)
     return user
 
 # -------------------------
@@ -28,21 +90,24 @@ def get_or_create_conv_sql(session: Session, user_id: str) -> Conversation:
     conv = session.exec(select(Conversation).where(Conversation.user_id == user_id)).first()
     if conv:
         return conv
-    conv = Conversation(user_id=user_id, title="Chat")
-    session.add(conv)
-    session.commit()
-    session.refresh(conv)
+    if db_writer.enabled:
+        conv, created = db_writer.submit(_get_or_create_conv_op(user_id)).result()
+        if not created:
+            return conv
+    else:
+        conv = Conversation(user_id=user_id, title="Chat")
+        session.add(conv)
+        session.commit()
+        session.refresh(conv)
+    if message_cache.enabled():
+        message_cache.by_conversation.prime_empty(conv.id)
     return conv
 
 # -------------------------
 # MESSAGE helpers
 # -------------------------
 def add_message_sql(session: Session, conversation_id: str, role: str, text: str, user_id: Optional[str] = None, meta: Optional[str] = None) -> Message:
-    m = Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text, meta=meta)
-    session.add(m)
-    session.commit()
-    session.refresh(m)
-    return m
+    return _insert_sql(session, Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text, meta=meta))
 
 def get_last_messages_sql(session: Session, conversation_id: str, limit: int = 50) -> List[Message]:
     q = session.exec(
@@ -50,20 +115,155 @@ def get_last_messages_sql(session: Session, conversation_id: str, limit: int = 5
     ).all()
     return list(reversed(q))  # oldest -> newest
 
+def get_recent_user_messages_sql(session: Session, user_id: str, limit: int = 30) -> List[Message]:
+    q = session.exec(
+        select(Message).where(Message.user_id == user_id).order_by(Message.timestamp.desc()).limit(limit)
+    ).all()
+    return list(reversed(q))  # oldest -> newest
+
+# -------------------------
+# KEYSET PAGINATION on (timestamp, id)
+# Cursors are opaque url-safe tokens naming the last row of the previous page.
+# -------------------------
+_PAGE_KEYS = {"conversation_id": Message.conversation_id, "user_id": Message.user_id}
+
+def encode_cursor(m) -> str:
+    raw = f"{m.timestamp.isoformat()}|{m.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError on a malformed cursor."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    ts, _, msg_id = raw.partition("|")
+    if not msg_id:
+        raise ValueError("malformed cursor")
+    return datetime.fromisoformat(ts), msg_id
+
+def _page_stmt(by: str, key: str, limit: int, cursor: Optional[str] = None, ascending: bool = False):
+    stmt = select(Message).where(_PAGE_KEYS[by] == key)
+    if cursor:
+        ts, msg_id = decode_cursor(cursor)
+        pos = tuple_(Message.timestamp, Message.id)
+        stmt = stmt.where(pos > tuple_(ts, msg_id) if ascending else pos < tuple_(ts, msg_id))
+    if ascending:
+        return stmt.order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit)
+    return stmt.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+def _position(cursor: Optional[str], rows) -> Optional[Tuple[datetime, str]]:
+    # keyset position after the last row read so far (or the caller's cursor)
+    if rows:
+        return rows[-1].timestamp, rows[-1].id
+    return decode_cursor(cursor) if cursor else None
+
+def get_messages_page_sql(session: Session, by: str, key: str, limit: int = 50, cursor: Optional[str] = None, ascending: bool = False) -> List[Message]:
+    """
+    One page of messages filtered by `by` ("conversation_id" | "user_id"),
+    in query order (newest first unless ascending). Archived rows are older
+    than every hot row, so the archive is read only past the hot range:
+    after the hot rows run out (newest first) or before them (ascending).
+    """
+    if not settings.ARCHIVE_ENABLED:
+        return session.exec(_page_stmt(by, key, limit, cursor, ascending)).all()
+    rows = []
+    if ascending:
+        rows = archive.read_page_sql(session, by, key, limit, _position(cursor, None), True)
+        if len(rows) >= limit:
+            return rows
+        cursor = encode_cursor(rows[-1]) if rows else cursor
+    rows += session.exec(_page_stmt(by, key, limit - len(rows), cursor, ascending)).all()
+    if not ascending and len(rows) < limit:
+        rows += archive.read_page_sql(session, by, key, limit - len(rows), _position(cursor, rows), False)
+    return rows
+
+def get_conversations_for_user_sql(session: Session, user_id: str) -> List[Conversation]:
+    return session.exec(select(Conversation).where(Conversation.user_id == user_id)).all()
+
+def get_conversation_sql(session: Session, conversation_id: str) -> Optional[Conversation]:
+    return session.get(Conversation, conversation_id)
+
+# -------------------------
+# FULL-TEXT SEARCH (SQLite FTS5, see migration 004)
+# Results are scoped to the user through conversation ownership, so assistant
+# replies (user_id NULL) are searchable too. Best match first (bm25).
+# -------------------------
+_FTS_TERM = re.compile(r"\w+", re.UNICODE)
+_FTS_MAX_TERMS = 16
+
+_SEARCH_SQL = sql_text(
+    "SELECT m.id, m.conversation_id, m.role, m.text, m.timestamp, "
+    "snippet(messages_fts, 0, :hl_open, :hl_close, '…', :snippet_tokens) AS snippet, "
+    "bm25(messages_fts) AS score "
+    "FROM messages_fts "
+    "JOIN messages m ON m.rowid = messages_fts.rowid "
+    "JOIN conversations c ON c.id = m.conversation_id "
+    "WHERE messages_fts MATCH :q AND c.user_id = :user_id "
+    "ORDER BY score LIMIT :limit"
+)
+
+def fts_available() -> bool:
+    return database_url.startswith("sqlite")
+
+def fts_query(query: str, match_any: bool = False, prefix: bool = False) -> Optional[str]:
+    """
+    Turn free text into a safe FTS5 MATCH expression. Every word becomes a
+    quoted string, so FTS operators and punctuation in user input are inert.
+    Terms are ANDed (or ORed with match_any); `prefix` makes the last term a
+    prefix match for search-as-you-type. None when there is nothing to match.
+    """
+    terms = _FTS_TERM.findall(query or "")[:_FTS_MAX_TERMS]
+    if not terms:
+        return None
+    parts = [f'"{t}"' for t in terms]
+    if prefix:
+        parts[-1] += "*"
+    return (" OR " if match_any else " ").join(parts)
+
+def _search_params(user_id: str, match: str, limit: int, highlight: Tuple[str, str], snippet_tokens: int) -> Dict:
+    return {
+        "q": match, "user_id": user_id, "limit": limit,
+        "hl_open": highlight[0], "hl_close": highlight[1], "snippet_tokens": snippet_tokens,
+    }
+
+def _search_row(r) -> Dict:
+    ts = r["timestamp"]
+    return {
+        "id": r["id"],
+        "conversation_id": r["conversation_id"],
+        "role": r["role"],
+        "text": r["text"],
+        "snippet": r["snippet"],
+        "score": -r["score"],  # bm25() is lower-is-better; expose higher-is-better
+        "timestamp": datetime.fromisoformat(ts) if isinstance(ts, str) else ts,
+    }
+
+def search_messages_sql(session: Session, user_id: str, query: str, limit: int = 20, match_any: bool = False,
+                        prefix: bool = False, highlight: Tuple[str, str] = ("<b>", "</b>"), snippet_tokens: int = 12) -> List[Dict]:
+    match = fts_query(query, match_any, prefix)
+    if not match or not fts_available():
+        return []
+    rows = session.exec(_SEARCH_SQL, params=_search_params(user_id, match, limit, highlight, snippet_tokens)).mappings().all()
+    return [_search_row(r) for r in rows]
+
 # -------------------------
 # DEVICE helpers
 # -------------------------
 def register_device_sql(session: Session, user_id: str, name: Optional[str], device_type: Optional[str], token: str) -> Device:
-    d = Device(user_id=user_id, name=name, type=device_type, token=token)
-    session.add(d)
-    session.commit()
-    session.refresh(d)
-    return d
+    return _insert_sql(session, Device(user_id=user_id, name=name, type=device_type, token=token))
 
 def get_devices_for_user_sql(session: Session, user_id: str) -> List[Device]:
     return session.exec(select(Device).where(Device.user_id == user_id)).all()
 
+def _touch_device_op(device_id: str):
+    def op(session: Session):
+        d = session.get(Device, device_id)
+        if d:
+            d.last_seen = datetime.utcnow()
+        return d
+    return op
+
 def update_device_last_seen_sql(session: Session, device_id: str):
+    if db_writer.enabled:
+        return db_writer.submit(_touch_device_op(device_id)).result()
     d = session.get(Device, device_id)
     if d:
         d.last_seen = datetime.utcnow()
@@ -72,15 +272,203 @@ def update_device_last_seen_sql(session: Session, device_id: str):
         session.refresh(d)
     return d
 
+def _touch_devices_op(seen: List[Tuple[str, str, datetime]]):
+    def op(session: Session):
+        devices = Device.__table__
+        session.connection().execute(
+            update(devices)
+            .where(devices.c.id == bindparam("b_id"), devices.c.user_id == bindparam("b_user"))
+            .values(last_seen=bindparam("b_seen")),
+            [{"b_id": device_id, "b_user": user_id, "b_seen": ts} for device_id, user_id, ts in seen],
+        )
+        return len(seen)
+    return op
+
+def _set_push_token_op(user_id: str, device_id: str, push_token: Optional[str]):
+    def op(session: Session):
+        d = session.get(Device, device_id)
+        if d is None or d.user_id != user_id:
+            return None
+        d.push_token = push_token
+        return d
+    return op
+
+def set_device_push_token_sql(session: Session, user_id: str, device_id: str, push_token: Optional[str]) -> Optional[Device]:
+    if db_writer.enabled:
+        return db_writer.submit(_set_push_token_op(user_id, device_id, push_token)).result()
+    d = _set_push_token_op(user_id, device_id, push_token)(session)
+    session.commit()
+    return d
+
+def get_push_tokens_sql(session: Session, user_ids: List[str]) -> List[str]:
+    """Push tokens of all devices of user_ids (one query for a whole broadcast)."""
+    if not user_ids:
+        return []
+    return list(session.exec(
+        select(Device.push_token).where(Device.user_id.in_(user_ids), Device.push_token.is_not(None))
+    ).all())
+
+def _clear_push_tokens_op(tokens: List[str]):
+    def op(session: Session):
+        res = session.connection().execute(
+            update(Device.__table__).where(Device.__table__.c.push_token.in_(tokens)).values(push_token=None)
+        )
+        return res.rowcount
+    return op
+
+def clear_push_tokens_sql(session: Session, tokens: List[str]) -> int:
+    """Forget push tokens the provider reported as invalid. Returns devices updated."""
+    if not tokens:
+        return 0
+    if db_writer.enabled:
+        return db_writer.submit(_clear_push_tokens_op(tokens)).result()
+    n = _clear_push_tokens_op(tokens)(session)
+    session.commit()
+    return n
+
+def update_devices_last_seen_sql(session: Session, seen: List[Tuple[str, str, datetime]]) -> int:
+    """
+    Writes many (device_id, user_id, last_seen) in one executemany UPDATE and
+    one commit (used by the presence flusher). A device only matches its own
+    user. Returns the number of entries written.
+    """
+    if not seen:
+        return 0
+    if db_writer.enabled:
+        return db_writer.submit(_touch_devices_op(seen)).result()
+    n = _touch_devices_op(seen)(session)
+    session.commit()
+    return n
+
+# -------------------------
+# OUTBOX (per-user sequenced delivery log)
+# seq is allocated inside the writing transaction as max(seq)+1 on the
+# (user_id, seq) primary key, so it is gap-free and unique across processes.
+# Trims never delete a user's newest entry: it carries the counter, so seq
+# keeps increasing after an idle user's older entries expire.
+# -------------------------
+def _append_outbox_op(user_id: str, payload: str, keep: int):
+    def op(session: Session) -> int:
+        last = session.exec(select(func.max(OutboxEntry.seq)).where(OutboxEntry.user_id == user_id)).one()
+        seq = (last or 0) + 1
+        session.add(OutboxEntry(user_id=user_id, seq=seq, payload=payload))
+        if keep > 0 and seq > keep:
+            session.exec(delete(OutboxEntry).where(OutboxEntry.user_id == user_id, OutboxEntry.seq <= seq - keep))
+        return seq
+    return op
+
+def append_outbox_sql(session: Session, user_id: str, payload: str, keep: int = 0) -> int:
+    """Appends a JSON payload to the user's outbox, trimming to the newest `keep`. Returns its seq."""
+    op = _append_outbox_op(user_id, payload, keep)
+    if db_writer.enabled:
+        return db_writer.submit(op).result()
+    for attempt in range(3):
+        try:
+            seq = op(session)
+            session.commit()
+            return seq
+        except IntegrityError:
+            # another process took the same seq; re-read max and retry
+            session.rollback()
+            if attempt == 2:
+                raise
+
+def get_outbox_after_sql(session: Session, user_id: str, after_seq: int, limit: int = 100) -> List[OutboxEntry]:
+    return session.exec(
+        select(OutboxEntry)
+        .where(OutboxEntry.user_id == user_id, OutboxEntry.seq > after_seq)
+        .order_by(OutboxEntry.seq.asc()).limit(limit)
+    ).all()
+
+def get_outbox_bounds_sql(session: Session, user_id: str) -> Tuple[Optional[int], Optional[int]]:
+    """(oldest retained seq, newest seq) for the user, or (None, None)."""
+    return tuple(session.exec(
+        select(func.min(OutboxEntry.seq), func.max(OutboxEntry.seq)).where(OutboxEntry.user_id == user_id)
+    ).one())
+
+def trim_outbox_sql(session: Session, older_than: datetime) -> int:
+    """Deletes entries created before `older_than`, except each user's newest. Returns rows removed."""
+    newer = aliased(OutboxEntry)
+    has_newer = select(newer.seq).where(newer.user_id == OutboxEntry.user_id, newer.seq > OutboxEntry.seq).exists()
+
+    def op(s: Session) -> int:
+        return s.exec(delete(OutboxEntry).where(OutboxEntry.created_at < older_than, has_newer)).rowcount
+    if db_writer.enabled:
+        return db_writer.submit(op).result()
+    n = op(session)
+    session.commit()
+    return n
+
+# -------------------------
+# DEVICE COMMANDS (system_control queue)
+# Status changes are compare-and-set UPDATEs (WHERE status IN ...), so a
+# late ack can't resurrect an expired command and two sweepers can't both
+# resend the same one.
+# -------------------------
+OPEN_COMMAND_STATUSES = ("queued", "sent", "acked")
+
+def create_command_sql(session: Session, cmd: DeviceCommand) -> DeviceCommand:
+    return _insert_sql(session, cmd)
+
+def get_command_sql(session: Session, command_id: str) -> Optional[DeviceCommand]:
+    return session.get(DeviceCommand, command_id)
+
+def list_commands_sql(session: Session, user_id: str, device_id: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[DeviceCommand]:
+    q = select(DeviceCommand).where(DeviceCommand.user_id == user_id)
+    if device_id:
+        q = q.where(DeviceCommand.device_id == device_id)
+    if status:
+        q = q.where(DeviceCommand.status == status)
+    return session.exec(q.order_by(DeviceCommand.created_at.desc()).limit(limit)).all()
+
+def get_open_commands_sql(session: Session, device_id: Optional[str] = None, limit: int = 1000) -> List[DeviceCommand]:
+    """Commands not yet finished (queued/sent/acked), oldest first; all devices if device_id is None."""
+    q = select(DeviceCommand).where(DeviceCommand.status.in_(OPEN_COMMAND_STATUSES))
+    if device_id:
+        q = q.where(DeviceCommand.device_id == device_id)
+    return session.exec(q.order_by(DeviceCommand.created_at.asc()).limit(limit)).all()
+
+def _transition_command_op(command_id: str, from_statuses, changes: Dict, device_id: Optional[str], user_id: Optional[str]):
+    def op(session: Session) -> bool:
+        table = DeviceCommand.__table__
+        q = update(table).where(table.c.id == command_id, table.c.status.in_(list(from_statuses)))
+        if device_id is not None:
+            q = q.where(table.c.device_id == device_id)
+        if user_id is not None:
+            q = q.where(table.c.user_id == user_id)
+        return session.connection().execute(q.values(**changes)).rowcount == 1
+    return op
+
+def transition_command_sql(session: Session, command_id: str, from_statuses, changes: Dict,
+                           device_id: Optional[str] = None, user_id: Optional[str] = None) -> bool:
+    """
+    Apply changes only if the command is currently in one of from_statuses
+    (and targets device_id / belongs to user_id, when given). Returns whether it was.
+    """
+    op = _transition_command_op(command_id, from_statuses, changes, device_id, user_id)
+    if db_writer.enabled:
+        return db_writer.submit(op).result()
+    ok = op(session)
+    session.commit()
+    return ok
+
+def trim_commands_sql(session: Session, older_than: datetime) -> int:
+    """Delete finished commands created before older_than. Returns rows removed."""
+    def op(s: Session) -> int:
+        return s.exec(delete(DeviceCommand).where(
+            DeviceCommand.created_at < older_than, DeviceCommand.status.not_in(OPEN_COMMAND_STATUSES)
+        )).rowcount
+    if db_writer.enabled:
+        return db_writer.submit(op).result()
+    n = op(session)
+    session.commit()
+    return n
+
 # -------------------------
 # TRAINING ITEMS
 # -------------------------
 def add_training_item_sql(session: Session, prompt: str, response: str, user_id: Optional[str] = None, source: Optional[str] = None, approved: bool = False) -> TrainingItem:
-    t = TrainingItem(user_id=user_id, prompt=prompt, response=response, source=source, approved=approved)
-    session.add(t)
-    session.commit()
-    session.refresh(t)
-    return t
+    return _insert_sql(session, TrainingItem(user_id=user_id, prompt=prompt, response=response, source=source, approved=approved))
 
 def list_approved_training_sql(session: Session) -> List[TrainingItem]:
     return session.exec(select(TrainingItem).where(TrainingItem.approved == True)).all()
@@ -103,6 +491,15 @@ def create_user(session_or_db, email: str, password_hash: str, name: Optional[st
     else:
         raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
 
+def update_user(session_or_db, user_id: str, **changes):
+    """
+    Updates user fields and invalidates the user's auth-cache entry.
+    """
+    if DB_MODE in ("sqlite", "supabase"):
+        return update_user_sql(session_or_db, user_id, **changes)
+    else:
+        raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+
 def get_or_create_conv(session_or_db, user_id: str):
     if DB_MODE in ("sqlite", "supabase"):
         return get_or_create_conv_sql(session_or_db, user_id)
@@ -110,14 +507,57 @@ def get_or_create_conv(session_or_db, user_id: str):
         raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
 
 def add_message(session_or_db, conv_id: str, role: str, text: str, user_id: Optional[str] = None, meta: Optional[str] = None):
+    """
+    Stores a message and writes it through to the recent-message cache.
+    """
     if DB_MODE in ("sqlite", "supabase"):
-        return add_message_sql(session_or_db, conv_id, role, text, user_id, meta)
+        m = add_message_sql(session_or_db, conv_id, role, text, user_id, meta)
     else:
         raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+    message_cache.record(m)
+    return m
+
+def _cached_recent(index, fetch, session_or_db, key: str, limit: int):
+    if not message_cache.enabled():
+        return fetch(session_or_db, key, limit)
+    hit = index.get(key, limit)
+    if hit is not None:
+        return hit
+    # warm the whole per-key window so the next turns are hits
+    want = max(limit, index.per_key)
+    stamp = index.begin_fill(key)
+    try:
+        rows = fetch(session_or_db, key, want)
+    except BaseException:
+        index.cancel_fill(key, stamp)
+        raise
+    index.fill(key, [message_cache.CachedMessage.from_row(m) for m in rows], want, stamp)
+    return rows[-limit:] if limit > 0 else []
 
 def get_last_messages(session_or_db, conv_id: str, limit: int = 50):
+    """
+    Newest `limit` messages of a conversation (oldest -> newest); cache first, DB on miss.
+    """
+    if DB_MODE in ("sqlite", "supabase"):
+        return _cached_recent(message_cache.by_conversation, get_last_messages_sql, session_or_db, conv_id, limit)
+    else:
+        raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+
+def get_recent_user_messages(session_or_db, user_id: str, limit: int = 30):
+    """
+    Newest `limit` messages written by a user (oldest -> newest); cache first, DB on miss.
+    """
+    if DB_MODE in ("sqlite", "supabase"):
+        return _cached_recent(message_cache.by_user, get_recent_user_messages_sql, session_or_db, user_id, limit)
+    else:
+        raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+
+def search_messages(session_or_db, user_id: str, query: str, limit: int = 20, match_any: bool = False, prefix: bool = False):
+    """
+    Ranked full-text search over the user's messages (dicts with snippet/score).
+    """
     if DB_MODE in ("sqlite", "supabase"):
-        return get_last_messages_sql(session_or_db, conv_id, limit)
+        return search_messages_sql(session_or_db, user_id, query, limit, match_any, prefix)
     else:
         raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
 
@@ -132,3 +572,224 @@ def get_devices_for_user(session_or_db, user_id: str):
         return get_devices_for_user_sql(session_or_db, user_id)
     else:
         raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+
+
+# -------------------------
+# ASYNC SQL helpers (AsyncSession; aiosqlite / asyncpg)
+# Sessions are opened with expire_on_commit=False and all defaults are
+# client-side, so no refresh() round-trip is needed after commit.
+# Writes go through the batch writer when it is enabled.
+# -------------------------
+async def get_user_by_id_sql_async(session, user_id: str) -> Optional[User]:
+    return await session.get(User, user_id)
+
+async def get_user_by_email_sql_async(session, email: str) -> Optional[User]:
+    return (await session.exec(select(User).where(User.email == email))).first()
+
+async def create_user_sql_async(session, email: str, password_hash: str, name: Optional[str] = None) -> User:
+    user = await _insert_sql_async(session, User(email=email, password_hash=password_hash, name=name))
+    if message_cache.enabled():
+        message_cache.by_user.prime_empty(user.id)
+    return user
+
+async def get_or_create_conv_sql_async(session, user_id: str) -> Conversation:
+    conv = (await session.exec(select(Conversation).where(Conversation.user_id == user_id))).first()
+    if conv:
+        return conv
+    if db_writer.enabled:
+        conv, created = await db_writer.submit_async(_get_or_create_conv_op(user_id))
+        if not created:
+            return conv
+    else:
+        conv = Conversation(user_id=user_id, title="Chat")
+        session.add(conv)
+        await session.commit()
+    if message_cache.enabled():
+        message_cache.by_conversation.prime_empty(conv.id)
+    return conv
+
+async def add_message_sql_async(session, conversation_id: str, role: str, text: str, user_id: Optional[str] = None, meta: Optional[str] = None) -> Message:
+    return await _insert_sql_async(session, Message(conversation_id=conversation_id, user_id=user_id, role=role, text=text, meta=meta))
+
+async def get_last_messages_sql_async(session, conversation_id: str, limit: int = 50) -> List[Message]:
+    q = (await session.exec(
+        select(Message).where(Message.conversation_id == conversation_id).order_by(Message.timestamp.desc()).limit(limit)
+    )).all()
+    return list(reversed(q))  # oldest -> newest
+
+async def get_recent_user_messages_sql_async(session, user_id: str, limit: int = 30) -> List[Message]:
+    q = (await session.exec(
+        select(Message).where(Message.user_id == user_id).order_by(Message.timestamp.desc()).limit(limit)
+    )).all()
+    return list(reversed(q))  # oldest -> newest
+
+async def get_messages_page_sql_async(session, by: str, key: str, limit: int = 50, cursor: Optional[str] = None, ascending: bool = False) -> List[Message]:
+    if not settings.ARCHIVE_ENABLED:
+        return (await session.exec(_page_stmt(by, key, limit, cursor, ascending))).all()
+    rows = []
+    if ascending:
+        rows = await archive.read_page_sql_async(session, by, key, limit, _position(cursor, None), True)
+        if len(rows) >= limit:
+            return rows
+        cursor = encode_cursor(rows[-1]) if rows else cursor
+    rows += (await session.exec(_page_stmt(by, key, limit - len(rows), cursor, ascending))).all()
+    if not ascending and len(rows) < limit:
+        rows += await archive.read_page_sql_async(session, by, key, limit - len(rows), _position(cursor, rows), False)
+    return rows
+
+async def get_conversations_for_user_sql_async(session, user_id: str) -> List[Conversation]:
+    return (await session.exec(select(Conversation).where(Conversation.user_id == user_id))).all()
+
+async def get_conversation_sql_async(session, conversation_id: str) -> Optional[Conversation]:
+    return await session.get(Conversation, conversation_id)
+
+async def search_messages_sql_async(session, user_id: str, query: str, limit: int = 20, match_any: bool = False,
+                                    prefix: bool = False, highlight: Tuple[str, str] = ("<b>", "</b>"), snippet_tokens: int = 12) -> List[Dict]:
+    match = fts_query(query, match_any, prefix)
+    if not match or not fts_available():
+        return []
+    rows = (await session.exec(_SEARCH_SQL, params=_search_params(user_id, match, limit, highlight, snippet_tokens))).mappings().all()
+    return [_search_row(r) for r in rows]
+
+async def get_outbox_after_sql_async(session, user_id: str, after_seq: int, limit: int = 100) -> List[OutboxEntry]:
+    return (await session.exec(
+        select(OutboxEntry)
+        .where(OutboxEntry.user_id == user_id, OutboxEntry.seq > after_seq)
+        .order_by(OutboxEntry.seq.asc()).limit(limit)
+    )).all()
+
+async def get_outbox_bounds_sql_async(session, user_id: str) -> Tuple[Optional[int], Optional[int]]:
+    return tuple((await session.exec(
+        select(func.min(OutboxEntry.seq), func.max(OutboxEntry.seq)).where(OutboxEntry.user_id == user_id)
+    )).one())
+
+async def register_device_sql_async(session, user_id: str, name: Optional[str], device_type: Optional[str], token: str) -> Device:
+    return await _insert_sql_async(session, Device(user_id=user_id, name=name, type=device_type, token=token))
+
+async def get_devices_for_user_sql_async(session, user_id: str) -> List[Device]:
+    return (await session.exec(select(Device).where(Device.user_id == user_id))).all()
+
+async def set_device_push_token_sql_async(session, user_id: str, device_id: str, push_token: Optional[str]) -> Optional[Device]:
+    if db_writer.enabled:
+        return await db_writer.submit_async(_set_push_token_op(user_id, device_id, push_token))
+    d = await session.get(Device, device_id)
+    if d is None or d.user_id != user_id:
+        return None
+    d.push_token = push_token
+    session.add(d)
+    await session.commit()
+    return d
+
+async def update_user_sql_async(session, user_id: str, changes: Dict) -> Optional[User]:
+    if db_writer.enabled:
+        user = await db_writer.submit_async(_update_user_op(user_id, changes))
+    else:
+        user = await session.get(User, user_id)
+        if user:
+            for field, value in changes.items():
+                setattr(user, field, value)
+            session.add(user)
+            await session.commit()
+    auth_cache.invalidate_user(user_id)
+    return user
+
+async def get_push_tokens_sql_async(session, user_ids: List[str]) -> List[str]:
+    if not user_ids:
+        return []
+    return list((await session.exec(
+        select(Device.push_token).where(Device.user_id.in_(user_ids), Device.push_token.is_not(None))
+    )).all())
+
+# -------------------------
+# ASYNC DISPATCHERS
+# Accept the session from base.get_async_session: an AsyncSession normally,
+# or a sync Session (run in the threadpool) when no async driver is installed.
+# -------------------------
+async def _run_sql(session_or_db, async_fn, sync_fn, *args):
+    if DB_MODE not in ("sqlite", "supabase"):
+        raise NotImplementedError("Only SQL DB_MODE supported in this CRUD implementation.")
+    if AsyncSession is not None and isinstance(session_or_db, AsyncSession):
+        return await async_fn(session_or_db, *args)
+    return await to_thread.run_sync(sync_fn, session_or_db, *args)
+
+async def get_user_by_id_async(session_or_db, user_id: str):
+    return await _run_sql(session_or_db, get_user_by_id_sql_async, get_user_by_id_sql, user_id)
+
+async def get_user_by_email_async(session_or_db, email: str):
+    return await _run_sql(session_or_db, get_user_by_email_sql_async, get_user_by_email_sql, email)
+
+async def create_user_async(session_or_db, email: str, password_hash: str, name: Optional[str] = None):
+    return await _run_sql(session_or_db, create_user_sql_async, create_user_sql, email, password_hash, name)
+
+async def get_or_create_conv_async(session_or_db, user_id: str):
+    return await _run_sql(session_or_db, get_or_create_conv_sql_async, get_or_create_conv_sql, user_id)
+
+async def add_message_async(session_or_db, conv_id: str, role: str, text: str, user_id: Optional[str] = None, meta: Optional[str] = None):
+    """
+    Async add_message: stores a message and writes it through to the recent-message cache.
+    """
+    m = await _run_sql(session_or_db, add_message_sql_async, add_message_sql, conv_id, role, text, user_id, meta)
+    message_cache.record(m)
+    return m
+
+async def _cached_recent_async(index, fetch_async, fetch_sync, session_or_db, key: str, limit: int):
+    if not message_cache.enabled():
+        return await _run_sql(session_or_db, fetch_async, fetch_sync, key, limit)
+    hit = index.get(key, limit)
+    if hit is not None:
+        return hit
+    want = max(limit, index.per_key)
+    stamp = index.begin_fill(key)
+    try:
+        rows = await _run_sql(session_or_db, fetch_async, fetch_sync, key, want)
+    except BaseException:
+        index.cancel_fill(key, stamp)
+        raise
+    index.fill(key, [message_cache.CachedMessage.from_row(m) for m in rows], want, stamp)
+    return rows[-limit:] if limit > 0 else []
+
+async def get_last_messages_async(session_or_db, conv_id: str, limit: int = 50):
+    return await _cached_recent_async(
+        message_cache.by_conversation, get_last_messages_sql_async, get_last_messages_sql, session_or_db, conv_id, limit
+    )
+
+async def get_recent_user_messages_async(session_or_db, user_id: str, limit: int = 30):
+    return await _cached_recent_async(
+        message_cache.by_user, get_recent_user_messages_sql_async, get_recent_user_messages_sql, session_or_db, user_id, limit
+    )
+
+async def register_device_async(session_or_db, user_id: str, name: Optional[str], device_type: Optional[str], token: str):
+    return await _run_sql(session_or_db, register_device_sql_async, register_device_sql, user_id, name, device_type, token)
+
+async def get_devices_for_user_async(session_or_db, user_id: str):
+    return await _run_sql(session_or_db, get_devices_for_user_sql_async, get_devices_for_user_sql, user_id)
+
+async def set_device_push_token_async(session_or_db, user_id: str, device_id: str, push_token: Optional[str]):
+    return await _run_sql(session_or_db, set_device_push_token_sql_async, set_device_push_token_sql, user_id, device_id, push_token)
+
+async def update_user_async(session_or_db, user_id: str, **changes):
+    """Updates user fields and invalidates the user's auth-cache entry."""
+    def sync_fn(session, user_id, changes):
+        return update_user_sql(session, user_id, **changes)
+    return await _run_sql(session_or_db, update_user_sql_async, sync_fn, user_id, changes)
+
+async def get_push_tokens_async(session_or_db, user_ids: List[str]):
+    return await _run_sql(session_or_db, get_push_tokens_sql_async, get_push_tokens_sql, user_ids)
+
+async def get_messages_page_async(session_or_db, by: str, key: str, limit: int = 50, cursor: Optional[str] = None, ascending: bool = False):
+    return await _run_sql(session_or_db, get_messages_page_sql_async, get_messages_page_sql, by, key, limit, cursor, ascending)
+
+async def get_conversations_for_user_async(session_or_db, user_id: str):
+    return await _run_sql(session_or_db, get_conversations_for_user_sql_async, get_conversations_for_user_sql, user_id)
+
+async def get_conversation_async(session_or_db, conversation_id: str):
+    return await _run_sql(session_or_db, get_conversation_sql_async, get_conversation_sql, conversation_id)
+
+async def search_messages_async(session_or_db, user_id: str, query: str, limit: int = 20, match_any: bool = False, prefix: bool = False):
+    return await _run_sql(session_or_db, search_messages_sql_async, search_messages_sql, user_id, query, limit, match_any, prefix)
+
+async def get_outbox_after_async(session_or_db, user_id: str, after_seq: int, limit: int = 100):
+    return await _run_sql(session_or_db, get_outbox_after_sql_async, get_outbox_after_sql, user_id, after_seq, limit)
+
+async def get_outbox_bounds_async(session_or_db, user_id: str):
+    return await _run_sql(session_or_db, get_outbox_bounds_sql_async, get_outbox_bounds_sql, user_id)
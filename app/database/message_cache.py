@@ -0,0 +1,217 @@
+# app/database/message_cache.py
+"""
+Write-through cache of recent messages.
+
+crud.add_message pushes every stored message here, so the chat hot path
+(brain history, /memory/recent) can be served from memory instead of a
+sorted query + ORM hydration per turn. Entries are created either when a
+conversation is known to be empty or when a DB read warms them; a key the
+cache has never seen is always a miss, so results never silently drop rows.
+
+A miss is filled from a DB read, and a message can be committed between
+that read and fill(). Readers therefore take a stamp with begin_fill()
+before querying; appends and invalidations while a read is in flight bump
+the key's version, and fill() discards a result read before the bump (the
+next lookup misses and reads again).
+
+The cache is per-process. It switches itself off (see enabled()) when the
+pub/sub backend connects several workers ("unix" / "redis"): writes then
+land in other processes. Disable it (MESSAGE_CACHE_ENABLED=False) for any
+other multi-process setup that writes the same DB.
+Changes made outside the process (archival runs in the scheduler) are not
+seen here, so a window is dropped MESSAGE_CACHE_TTL_SECONDS after it was
+filled and the next lookup reads the DB again.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+from ..core.config import settings
+from ..services.pubsub import backend_kind
+
+
+class CachedMessage:
+    """Detached, read-only snapshot of a Message row."""
+    __slots__ = ("id", "conversation_id", "user_id", "role", "text", "timestamp")
+
+    def __init__(self, id: str, conversation_id: str, user_id: Optional[str], role: str, text: str, timestamp: datetime):
+        self.id = id
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.role = role
+        self.text = text
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_row(cls, m) -> "CachedMessage":
+        return cls(m.id, m.conversation_id, m.user_id, m.role, m.text, m.timestamp)
+
+
+class _Recent:
+    __slots__ = ("items", "complete", "exhausted", "expires")
+
+    def __init__(self, capacity: int, expires: float):
+        self.items: deque = deque(maxlen=capacity)
+        self.expires = expires
+        # True while `items` holds the whole hot history for the key (nothing older in `messages`)
+        self.complete = False
+        # ...and a reader found nothing older in the archive either (see mark_exhausted)
+        self.exhausted = False
+
+
+class RecentMessageIndex:
+    """
+    LRU map of key -> newest N messages (oldest -> newest).
+    Windows live at most `ttl` seconds from their fill (0 = no expiry).
+    """
+
+    def __init__(self, per_key: int, max_keys: int, ttl: float = 0.0, clock=time.monotonic):
+        self.per_key = per_key
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[str, _Recent]" = OrderedDict()
+        self._inflight: Dict[str, List[int]] = {}  # key -> [reads in flight, version]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_fills = 0
+
+    def _touch(self, key: str) -> Optional[_Recent]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl and entry.expires <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _insert(self, key: str) -> _Recent:
+        expires = self.clock() + self.ttl if self.ttl else 0.0
+        entry = self._entries[key] = _Recent(self.per_key, expires)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return entry
+
+    def prime_empty(self, key: str):
+        """Mark `key` as known to have no messages yet (e.g. a new conversation)."""
+        with self._lock:
+            entry = self._insert(key)
+            entry.complete = entry.exhausted = True
+
+    def _bump(self, key: str):
+        state = self._inflight.get(key)
+        if state is not None:
+            state[1] += 1
+
+    def begin_fill(self, key: str) -> int:
+        """Call before the DB read that will feed fill(); returns the stamp to pass to it."""
+        with self._lock:
+            state = self._inflight.setdefault(key, [0, 0])
+            state[0] += 1
+            return state[1]
+
+    def _end_fill(self, key: str, stamp: int) -> bool:
+        """Finish one in-flight read (lock held). Returns False if the key changed meanwhile."""
+        state = self._inflight.get(key)
+        if state is None:
+            return True
+        fresh = state[1] == stamp
+        state[0] -= 1
+        if state[0] <= 0:
+            del self._inflight[key]
+        return fresh
+
+    def cancel_fill(self, key: str, stamp: int):
+        """The read started by begin_fill() failed; nothing is cached."""
+        with self._lock:
+            self._end_fill(key, stamp)
+
+    def fill(self, key: str, rows: Iterable[CachedMessage], requested: int, stamp: Optional[int] = None):
+        """
+        Warm `key` from a DB read of the newest `requested` rows (oldest -> newest).
+        With a stamp from begin_fill(), the rows are dropped if a message was
+        appended (or the key invalidated) after the read started.
+        """
+        rows = list(rows)
+        with self._lock:
+            if stamp is not None and not self._end_fill(key, stamp):
+                self.stale_fills += 1
+                return
+            entry = self._insert(key)
+            entry.items.extend(rows)
+            entry.complete = len(rows) < requested and len(rows) <= self.per_key
+
+    def append(self, key: str, msg: CachedMessage):
+        """Write-through: only keys already tracked are updated."""
+        with self._lock:
+            self._bump(key)
+            entry = self._touch(key)
+            if entry is None:
+                return
+            if len(entry.items) == entry.items.maxlen:
+                entry.complete = entry.exhausted = False
+            entry.items.append(msg)
+
+    def get(self, key: str, limit: int) -> Optional[List[CachedMessage]]:
+        """Newest `limit` messages (oldest -> newest), or None on a miss."""
+        with self._lock:
+            entry = self._touch(key)
+            if entry is None or (limit > len(entry.items) and not entry.complete):
+                self.misses += 1
+                return None
+            self.hits += 1
+            out = list(islice(reversed(entry.items), max(limit, 0)))
+        out.reverse()
+        return out
+
+    def mark_exhausted(self, key: str):
+        """
+        A read past the cached window (hot rows and archive) found nothing:
+        the window is the key's entire history until it slides or is dropped.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.complete:
+                entry.exhausted = True
+
+    def is_exhausted(self, key: str) -> bool:
+        """True if nothing older than the cached window exists anywhere (see mark_exhausted)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.exhausted and (not self.ttl or entry.expires > self.clock())
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._bump(key)
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+by_conversation = RecentMessageIndex(settings.MESSAGE_CACHE_PER_KEY, settings.MESSAGE_CACHE_MAX_KEYS,
+                                     settings.MESSAGE_CACHE_TTL_SECONDS)
+by_user = RecentMessageIndex(settings.MESSAGE_CACHE_PER_KEY, settings.MESSAGE_CACHE_MAX_KEYS,
+                             settings.MESSAGE_CACHE_TTL_SECONDS)
+
+
+def enabled() -> bool:
+    """MESSAGE_CACHE_ENABLED, unless the pub/sub backend spans several worker processes."""
+    return settings.MESSAGE_CACHE_ENABLED and backend_kind() in ("none", "inprocess")
+
+
+def record(msg) -> None:
+    """Write-through hook called after a message row is committed."""
+    if not enabled():
+        return
+    snap = CachedMessage.from_row(msg)
+    by_conversation.append(snap.conversation_id, snap)
+    if snap.user_id:
+        by_user.append(snap.user_id, snap)
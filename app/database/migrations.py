@@ -0,0 +1,180 @@
+# app/database/migrations.py
+"""
+Versioned schema migrations.
+
+Each migration is (version, name, fn(conn)). Applied versions are recorded in
+the `schema_migrations` table, so every migration runs exactly once per DB.
+create_all() still creates missing tables; everything after the initial
+schema (indexes, new columns, backfills) belongs here.
+
+Indexes are built online where the backend supports it: Postgres uses
+CREATE INDEX CONCURRENTLY (outside a transaction); SQLite builds them in a
+short write transaction, which readers in WAL mode do not wait on.
+"""
+
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger("db.migrations")
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+
+
+# -------------------------
+# DDL helpers
+# -------------------------
+def _create_index(conn: Connection, name: str, table: str, columns: List[str]):
+    cols = ", ".join(columns)
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({cols})"))
+    else:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})"))
+
+def _add_column(conn: Connection, table: str, column: str, ddl_type: str):
+    # create_all() already includes the column on fresh databases
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+def _drop_index(conn: Connection, name: str):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    else:
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+# -------------------------
+# MIGRATIONS (append only; never renumber)
+# -------------------------
+def _m001_message_hot_path_indexes(conn: Connection):
+    # get_last_messages: WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT n
+    _create_index(conn, "ix_messages_conversation_ts", "messages", ["conversation_id", "timestamp"])
+    # /memory/recent: WHERE user_id = ? ORDER BY timestamp DESC LIMIT n
+    _create_index(conn, "ix_messages_user_ts", "messages", ["user_id", "timestamp"])
+
+def _m002_drop_redundant_message_indexes(conn: Connection):
+    # single-column indexes are prefixes of the composites above; dropping them saves a write per insert
+    _drop_index(conn, "ix_messages_conversation_id")
+    _drop_index(conn, "ix_messages_user_id")
+
+def _m003_message_keyset_indexes(conn: Connection):
+    # keyset pagination orders by (timestamp, id); include id so pages need no sort
+    _create_index(conn, "ix_messages_conversation_ts_id", "messages", ["conversation_id", "timestamp", "id"])
+    _create_index(conn, "ix_messages_user_ts_id", "messages", ["user_id", "timestamp", "id"])
+    _drop_index(conn, "ix_messages_conversation_ts")
+    _drop_index(conn, "ix_messages_user_ts")
+
+
+def _m004_message_fts(conn: Connection):
+    # SQLite only: external-content FTS5 index over messages.text, kept in sync
+    # by triggers so every write path (crud, batch writer, archival deletes)
+    # updates it. The index stores no copy of the text; snippet() reads it back
+    # from messages via rowid. messages has no INTEGER PRIMARY KEY, so a VACUUM
+    # may renumber rowids: run rebuild_message_fts() after one.
+    if conn.dialect.name != "sqlite":
+        logger.info("Skipping FTS5 migration on %s", conn.dialect.name)
+        return
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.rowid, new.text); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text); "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.rowid, new.text); END"
+    ))
+    # backfill rows written before the index existed
+    rebuild_message_fts(conn)
+
+def rebuild_message_fts(conn: Connection):
+    """Re-index messages_fts from the messages table (backfill / after VACUUM)."""
+    conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+
+def _m005_message_archive_indexes(conn: Connection):
+    # archive reads walk a conversation's / user's segments in time order
+    _create_index(conn, "ix_message_archive_conversation_ts", "message_archive", ["conversation_id", "first_ts"])
+    _create_index(conn, "ix_message_archive_user_ts", "message_archive", ["user_id", "first_ts"])
+
+def _m006_outbox_retention_index(conn: Connection):
+    # retention trim deletes by age across all users
+    _create_index(conn, "ix_outbox_created_at", "outbox", ["created_at"])
+
+def _m007_device_push_tokens(conn: Connection):
+    # push fan-out reads tokens per user; pruning invalid tokens looks them up by value
+    _add_column(conn, "devices", "push_token", "VARCHAR")
+    _create_index(conn, "ix_devices_push_token", "devices", ["push_token"])
+
+def _m008_device_command_indexes(conn: Connection):
+    # delivery on connect: a device's open commands; the sweeper: all open commands
+    _create_index(conn, "ix_device_commands_device_status", "device_commands", ["device_id", "status", "created_at"])
+    _create_index(conn, "ix_device_commands_status_expires", "device_commands", ["status", "expires_at"])
+    _create_index(conn, "ix_device_commands_user_created", "device_commands", ["user_id", "created_at"])
+
+
+MIGRATIONS: List[Migration] = [
+    (1, "message_hot_path_indexes", _m001_message_hot_path_indexes),
+    (2, "drop_redundant_message_indexes", _m002_drop_redundant_message_indexes),
+    (3, "message_keyset_indexes", _m003_message_keyset_indexes),
+    (4, "message_fts", _m004_message_fts),
+    (5, "message_archive_indexes", _m005_message_archive_indexes),
+    (6, "outbox_retention_index", _m006_outbox_retention_index),
+    (7, "device_push_tokens", _m007_device_push_tokens),
+    (8, "device_command_indexes", _m008_device_command_indexes),
+]
+
+
+# -------------------------
+# Runner
+# -------------------------
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"
+        ))
+
+def applied_versions(engine: Engine) -> List[int]:
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    done = set(applied_versions(engine))
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+def run_migrations(engine: Engine) -> List[int]:
+    """
+    Apply pending migrations in version order. Returns the versions applied.
+    """
+    applied = []
+    for version, name, fn in pending_migrations(engine):
+        logger.info("Applying migration %03d_%s", version, name)
+        if engine.dialect.name == "postgresql":
+            # CONCURRENTLY cannot run inside a transaction block
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                fn(conn)
+            with engine.begin() as conn:
+                _record(conn, version, name)
+        else:
+            with engine.begin() as conn:
+                fn(conn)
+                _record(conn, version, name)
+        applied.append(version)
+    return applied
+
+def _record(conn: Connection, version: int, name: str):
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": version, "n": name, "t": datetime.utcnow().isoformat() + "Z"},
+    )
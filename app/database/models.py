@@ -1,5 +1,5 @@
 # app/database/models.py
-from sqlmodel import SQLModel, Field, Column, String
+from sqlmodel import SQLModel, Field, Column, String, LargeBinary
 from datetime import datetime
 from typing import Optional
 import uuid
@@ -9,7 +9,7 @@ def uid() -> str:
 
 # ---------------------------------------------------------------------
 # NOTE:
-# - Keep models small and stable; add indices in migrations if needed.
+# - Keep models small and stable; add indices in migrations (see migrations.py).
 # ---------------------------------------------------------------------
 
 class User(SQLModel, table=True):
@@ -32,14 +32,43 @@ class Conversation(SQLModel, table=True):
 class Message(SQLModel, table=True):
     __tablename__ = "messages"
     id: str = Field(default_factory=uid, primary_key=True)
-    conversation_id: str = Field(index=True, nullable=False)
-    user_id: Optional[str] = Field(default=None, index=True)
+    conversation_id: str = Field(nullable=False)  # indexed with (timestamp, id) (migration 003)
+    user_id: Optional[str] = Field(default=None)   # indexed with (timestamp, id) (migration 003)
     role: str  # "user" | "zylos" | "system"
     text: str
     meta: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
 
 
+class MessageArchive(SQLModel, table=True):
+    """
+    A compressed batch of cold messages from one conversation and month
+    (see archive.py). Segments of a conversation never overlap in time.
+    """
+    __tablename__ = "message_archive"
+    id: str = Field(default_factory=uid, primary_key=True)
+    conversation_id: str = Field(nullable=False)  # indexed with first_ts (migration 005)
+    user_id: str = Field(nullable=False)          # conversation owner; indexed with first_ts (migration 005)
+    month: str                                    # "YYYY-MM"
+    first_ts: datetime
+    last_ts: datetime
+    count: int
+    codec: str                                    # "zstd" | "zlib"
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+
+
+class OutboxEntry(SQLModel, table=True):
+    """
+    Per-user sequenced delivery log for realtime payloads (see services/outbox.py).
+    (user_id, seq) is the primary key, so replay reads are a range scan.
+    """
+    __tablename__ = "outbox"
+    user_id: str = Field(primary_key=True)
+    seq: int = Field(primary_key=True)
+    payload: str                                  # JSON
+    created_at: datetime = Field(default_factory=datetime.utcnow)  # indexed (migration 006)
+
+
 class Device(SQLModel, table=True):
     __tablename__ = "devices"
     id: str = Field(default_factory=uid, primary_key=True)
@@ -47,10 +76,33 @@ class Device(SQLModel, table=True):
     name: Optional[str] = None
     type: Optional[str] = None  # "android" / "windows" / "web"
     token: Optional[str] = None
+    push_token: Optional[str] = None    # FCM registration token (set by the app, pruned when invalid)
     capabilities: Optional[str] = None  # JSON string describing capabilities
     last_seen: datetime = Field(default_factory=datetime.utcnow)
 
 
+class DeviceCommand(SQLModel, table=True):
+    """
+    A system_control command for one device (see services/command_queue.py).
+    status: queued -> sent -> acked -> done | failed, or expired once past
+    expires_at; attempts counts deliveries to the device socket.
+    """
+    __tablename__ = "device_commands"
+    id: str = Field(default_factory=uid, primary_key=True)
+    user_id: str
+    device_id: str                                # indexed with status (migration 008)
+    action: str
+    params: Optional[str] = None                  # JSON
+    status: str = "queued"
+    attempts: int = 0
+    result: Optional[str] = None                  # device-reported result / failure reason
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
+    acked_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: datetime
+
+
 class TrainingItem(SQLModel, table=True):
     __tablename__ = "training_items"
     id: str = Field(default_factory=uid, primary_key=True)
@@ -1,6 +1,6 @@
 # app/database/schemas.py
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Any, Dict, Optional
 
 class RegisterIn(BaseModel):
     email: EmailStr
@@ -15,6 +15,10 @@ class LoginIn(BaseModel):
     email: EmailStr
     password: str
 
+class PasswordChangeIn(BaseModel):
+    old_password: str
+    new_password: str
+
 class ChatIn(BaseModel):
     conversation_id: Optional[str] = None
     text: str
@@ -31,6 +35,14 @@ class DeviceRegisterIn(BaseModel):
     name: Optional[str]
     device_type: Optional[str]
 
+class PushTokenIn(BaseModel):
+    push_token: Optional[str] = None   # None / omitted clears it
+
+class CommandIn(BaseModel):
+    action: str
+    params: Dict[str, Any] = {}
+    ttl_seconds: Optional[int] = None
+
 class DeviceOut(BaseModel):
     device_id: str
     token: str
\ No newline at end of file
@@ -0,0 +1,154 @@
+# app/database/writer.py
+"""
+Single-writer group commit for SQLite.
+
+SQLite allows one writer at a time, and every commit pays an fsync. Instead
+of each request committing its own row (and contending on the DB lock), all
+writes are queued to one background thread that drains the queue for a few
+milliseconds and commits the whole batch in a single transaction.
+
+Callers get a Future resolved once their write is durable:
+    msg = db_writer.add(Message(...)).result()          # sync code
+    msg = await db_writer.add_async(Message(...))       # async code
+
+Primary keys and timestamps are generated client-side (see models.py), so the
+returned objects are complete without a refresh() round-trip.
+"""
+
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlmodel import Session
+
+from ..core.config import settings
+from .base import engine, database_url
+
+logger = logging.getLogger("db.writer")
+
+_STOP = object()
+
+
+class BatchWriter:
+    def __init__(self, max_batch: int, max_delay_ms: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return (
+            settings.SQLITE_BATCH_WRITER
+            and database_url.startswith("sqlite")
+            and ":memory:" not in database_url
+        )
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def submit(self, op: Callable[[Session], Any]) -> Future:
+        """
+        Queue `op(session)` to run inside the next group commit.
+        The Future resolves to op's return value after COMMIT.
+        """
+        fut: Future = Future()
+        self._ensure_started()
+        self._queue.put((op, fut))
+        return fut
+
+    def add(self, obj) -> Future:
+        """Queue an INSERT of `obj`; resolves to `obj` once committed."""
+        def op(session: Session):
+            session.add(obj)
+            return obj
+        return self.submit(op)
+
+    async def add_async(self, obj):
+        return await asyncio.wrap_future(self.add(obj))
+
+    async def submit_async(self, op: Callable[[Session], Any]):
+        return await asyncio.wrap_future(self.submit(op))
+
+    def stop(self, timeout: float = 5.0):
+        """Flush pending writes and stop the writer thread."""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    # -------------------------
+    # Writer thread
+    # -------------------------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> Tuple[List[Tuple[Callable, Future]], bool]:
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            batch, stopping = self._collect()
+            if batch:
+                self._commit(batch)
+            if stopping:
+                return
+
+    def _commit(self, batch: List[Tuple[Callable, Future]]):
+        live = [(op, fut) for op, fut in batch if fut.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            with Session(engine, expire_on_commit=False) as session:
+                results = [op(session) for op, _ in live]
+                session.commit()
+        except Exception:
+            logger.exception("Group commit of %d writes failed; retrying individually", len(live))
+            self._commit_each(live)
+            return
+        self.batches += 1
+        self.writes += len(live)
+        for (_, fut), res in zip(live, results):
+            fut.set_result(res)
+
+    def _commit_each(self, live: List[Tuple[Callable, Future]]):
+        # isolate the failing write(s) so one bad row doesn't fail the whole batch
+        for op, fut in live:
+            try:
+                with Session(engine, expire_on_commit=False) as session:
+                    res = op(session)
+                    session.commit()
+                self.writes += 1
+                fut.set_result(res)
+            except Exception as e:
+                fut.set_exception(e)
+
+
+db_writer = BatchWriter(settings.SQLITE_WRITER_MAX_BATCH, settings.SQLITE_WRITER_MAX_DELAY_MS)
+atexit.register(db_writer.stop)
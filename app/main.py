@@ -1,10 +1,13 @@
 # app/main.py
 
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from app.core.config import settings
+from app.core.hashing_pool import hashing_pool
 from app.database.base import init_db
 from app.api import (
     routes_auth,
@@ -13,6 +16,11 @@ from app.api import (
     routes_memory,
     websocket as ws_router
 )
+from app.services.device_manager import presence, redis_bridge, ws_manager
+from app.services import command_queue
+from app.ai.tools import http_client
+from app.ai.tools.tool_cache import tool_cache
+from app.services.push import push_dispatcher
 
 import uvicorn
 
@@ -55,6 +63,28 @@ app.include_router(routes_memory.router, prefix=f"{settings.API_V1_STR}/memory")
 # WebSocket router (NO prefix)
 app.include_router(ws_router.router)
 
+@app.on_event("startup")
+async def start_bridge():
+    # multi-instance delivery (no-op unless REDIS_URL is set)
+    await redis_bridge.start()
+    # ack timeouts / retries / TTL for queued device commands
+    command_queue.start()
+    # spawn the bcrypt workers now so the first logins don't pay for it
+    await asyncio.to_thread(hashing_pool.warm_up)
+
+@app.on_event("shutdown")
+async def flush_presence():
+    # write the last batch of device last_seen values before exiting
+    await presence.stop()
+    if ws_manager.heartbeat is not None:
+        await ws_manager.heartbeat.stop()
+    await redis_bridge.stop()
+    await push_dispatcher.stop()
+    await command_queue.stop()
+    await http_client.aclose()
+    tool_cache.close()
+    hashing_pool.shutdown()
+
 @app.get("/", include_in_schema=False)
 async def root():
     return RedirectResponse(url="/portal/index.html")
@@ -72,5 +102,6 @@ if __name__ == "__main__":
         "app.main:app",
         host=settings.HOST,
         port=settings.PORT,
-        reload=settings.DEBUG
+        reload=settings.DEBUG,
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE
     )
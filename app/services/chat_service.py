@@ -0,0 +1,62 @@
+# app/services/chat_service.py
+"""
+One chat turn, shared by POST /api/chat/send and chat requests over the
+WebSocket: store the user message, run the brain in the threadpool, store
+the reply and fan it out to the user's devices.
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.ai.brain import process_user_message
+from app.ai.cancellation import CancelToken, current_token
+from app.database import crud
+from app.services.sync_manager import sync_manager
+
+logger = logging.getLogger("chat_service")
+logger.setLevel(logging.INFO)
+
+
+def _run_brain(token: Optional[CancelToken], user, conversation, text: str) -> str:
+    # bound here, inside the worker thread, so only this turn sees the token
+    current_token.set(token)
+    return process_user_message(user=user, conversation=conversation, text=text)
+
+
+async def run_chat_turn(
+    session,
+    user,
+    text: str,
+    token: Optional[CancelToken] = None,
+    request_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Run one turn for user and return {"reply", "message_id", "conversation_id"}.
+    Raises GenerationCancelled if token is cancelled mid-generation; nothing
+    is stored or pushed for the reply in that case.
+    """
+    # Get or create conversation
+    conv = await crud.get_or_create_conv_async(session, user.id)
+
+    # Store user message
+    await crud.add_message_async(session, conv.id, "user", text, user.id)
+
+    # Run AI brain (sync LLM/tool calls -> threadpool, keeps the event loop free)
+    reply = await run_in_threadpool(_run_brain, token, user, conv, text)
+
+    # Store AI reply
+    msg = await crud.add_message_async(session, conv.id, "zylos", reply)
+
+    # Multi-device sync: push same reply to all connected devices
+    payload = {"type": "reply", "conversation_id": conv.id, "reply": reply}
+    if request_id is not None:
+        payload["request_id"] = request_id
+    await sync_manager.push_reply_to_user(user.id, payload)
+
+    return {
+        "reply": reply,
+        "message_id": msg.id,
+        "conversation_id": conv.id
+    }
@@ -0,0 +1,238 @@
+# app/services/command_queue.py
+"""
+Durable per-device command queue for system_control.
+
+Commands are rows in `device_commands`. A command is pushed to its device's
+socket (ws_manager.send_to_device) as soon as it is queued, and open ones
+are pushed again whenever the device connects, so agents never poll:
+
+    server -> device  {"type": "command", "id", "action", "params", "expires_at", "attempt"}
+    device -> server  {"type": "command_ack", "id"}                       received
+    device -> server  {"type": "command_result", "id", "ok", "result"}    finished
+
+status: queued -> sent -> acked -> done | failed, or expired after the TTL.
+
+One sweeper task (every COMMAND_SWEEP_SECONDS) owns the timers:
+- sent but not acked within COMMAND_ACK_TIMEOUT_SECONDS -> resent, up to
+  COMMAND_MAX_ATTEMPTS deliveries, then failed; if the device went away it
+  goes back to queued and is delivered on reconnect
+- queued while the device is connected here (e.g. queued by another
+  instance) -> sent
+- past expires_at -> expired
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from anyio import to_thread
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.database import crud
+from app.database.base import engine
+from app.database.models import DeviceCommand
+from app.services.device_manager import presence, ws_manager
+
+logger = logging.getLogger("command_queue")
+logger.setLevel(logging.INFO)
+
+_sweeper: Optional[asyncio.Task] = None
+
+
+def _db(fn, *args):
+    with Session(engine) as session:
+        return fn(session, *args)
+
+
+async def _run_db(fn, *args):
+    return await to_thread.run_sync(_db, fn, *args)
+
+
+def command_out(cmd: DeviceCommand) -> Dict[str, Any]:
+    return {
+        "id": cmd.id,
+        "device_id": cmd.device_id,
+        "action": cmd.action,
+        "params": json.loads(cmd.params) if cmd.params else {},
+        "status": cmd.status,
+        "attempts": cmd.attempts,
+        "result": cmd.result,
+        "created_at": cmd.created_at.isoformat(),
+        "sent_at": cmd.sent_at.isoformat() if cmd.sent_at else None,
+        "acked_at": cmd.acked_at.isoformat() if cmd.acked_at else None,
+        "finished_at": cmd.finished_at.isoformat() if cmd.finished_at else None,
+        "expires_at": cmd.expires_at.isoformat(),
+    }
+
+
+# -------------------------
+# Producer side
+# -------------------------
+async def default_device(user_id: str) -> Optional[str]:
+    """The user's device connected here most recently, else the one seen last."""
+    live = ws_manager.device_map.get(user_id, {})
+    if live:
+        seen = presence.snapshot(user_id)
+        return max(live, key=lambda d: seen.get(d, (True, datetime.min))[1])
+    devices = await _run_db(crud.get_devices_for_user_sql, user_id)
+    return max(devices, key=lambda d: d.last_seen).id if devices else None
+
+
+def _new_command(user_id: str, device_id: str, action: str, params: Optional[Dict[str, Any]], ttl_seconds: Optional[int]) -> DeviceCommand:
+    now = datetime.utcnow()
+    return DeviceCommand(
+        user_id=user_id,
+        device_id=device_id,
+        action=action,
+        params=json.dumps(params or {}),
+        created_at=now,
+        expires_at=now + timedelta(seconds=ttl_seconds or settings.COMMAND_TTL_SECONDS),
+    )
+
+
+async def enqueue(user_id: str, device_id: str, action: str, params: Optional[Dict[str, Any]] = None,
+                  ttl_seconds: Optional[int] = None) -> DeviceCommand:
+    """Persist a command and push it to the device right away if it is connected here."""
+    cmd = await _run_db(crud.create_command_sql, _new_command(user_id, device_id, action, params, ttl_seconds))
+    start()
+    await _deliver(cmd)
+    return cmd
+
+
+def enqueue_sync(user_id: str, device_id: str, action: str, params: Optional[Dict[str, Any]] = None,
+                 ttl_seconds: Optional[int] = None) -> DeviceCommand:
+    """Persist only (for callers outside the event loop); the sweeper or the next connect delivers it."""
+    return _db(crud.create_command_sql, _new_command(user_id, device_id, action, params, ttl_seconds))
+
+
+async def _deliver(cmd: DeviceCommand) -> bool:
+    """Mark cmd sent and push it, if its device is connected to this instance."""
+    if not ws_manager.is_device_connected(cmd.user_id, cmd.device_id):
+        return False
+    attempt = cmd.attempts + 1
+    now = datetime.utcnow()
+    marked = await _run_db(
+        crud.transition_command_sql, cmd.id, ("queued", "sent"),
+        {"status": "sent", "sent_at": now, "attempts": attempt},
+    )
+    if not marked:
+        return False  # acked / finished / expired in the meantime
+    cmd.status, cmd.sent_at, cmd.attempts = "sent", now, attempt
+    await ws_manager.send_to_device(cmd.user_id, cmd.device_id, {
+        "type": "command",
+        "id": cmd.id,
+        "action": cmd.action,
+        "params": json.loads(cmd.params) if cmd.params else {},
+        "expires_at": cmd.expires_at.isoformat(),
+        "attempt": attempt,
+    })
+    return True
+
+
+# -------------------------
+# Device side (called from the websocket endpoint)
+# -------------------------
+async def deliver_pending(user_id: str, device_id: str) -> int:
+    """Push the device's open, unexpired, not yet acked commands. Returns how many were sent."""
+    now = datetime.utcnow()
+    sent = 0
+    for cmd in await _run_db(crud.get_open_commands_sql, device_id):
+        if cmd.user_id != user_id or cmd.status == "acked":
+            continue
+        if cmd.expires_at <= now:
+            await _expire(cmd, now)
+        elif await _deliver(cmd):
+            sent += 1
+    return sent
+
+
+async def ack(user_id: str, device_id: str, command_id: str) -> bool:
+    """Only the (authenticated) user's own device can ack its command."""
+    return await _run_db(
+        crud.transition_command_sql, command_id, ("queued", "sent"),
+        {"status": "acked", "acked_at": datetime.utcnow()}, device_id, user_id,
+    )
+
+
+async def complete(user_id: str, device_id: str, command_id: str, ok: bool, result: Any = None) -> bool:
+    if result is not None and not isinstance(result, str):
+        result = json.dumps(result)
+    changes = {"status": "done" if ok else "failed", "result": result[:4000] if result else None, "finished_at": datetime.utcnow()}
+    return await _run_db(crud.transition_command_sql, command_id, crud.OPEN_COMMAND_STATUSES, changes, device_id, user_id)
+
+
+# -------------------------
+# Sweeper (ack timeouts, retries, TTL)
+# -------------------------
+async def _expire(cmd: DeviceCommand, now: datetime):
+    await _run_db(
+        crud.transition_command_sql, cmd.id, crud.OPEN_COMMAND_STATUSES,
+        {"status": "expired", "finished_at": now},
+    )
+
+
+async def sweep(now: Optional[datetime] = None) -> Dict[str, int]:
+    now = now or datetime.utcnow()
+    ack_timeout = timedelta(seconds=settings.COMMAND_ACK_TIMEOUT_SECONDS)
+    counts = {"expired": 0, "resent": 0, "failed": 0, "requeued": 0, "sent": 0}
+    for cmd in await _run_db(crud.get_open_commands_sql, None):
+        if cmd.expires_at <= now:
+            await _expire(cmd, now)
+            counts["expired"] += 1
+        elif cmd.status == "queued":
+            if await _deliver(cmd):
+                counts["sent"] += 1
+        elif cmd.status == "sent" and cmd.sent_at is not None and cmd.sent_at + ack_timeout <= now:
+            if cmd.attempts >= settings.COMMAND_MAX_ATTEMPTS:
+                if await _run_db(crud.transition_command_sql, cmd.id, ("sent",), {
+                    "status": "failed", "result": f"no ack after {cmd.attempts} attempts", "finished_at": now,
+                }):
+                    counts["failed"] += 1
+            elif await _deliver(cmd):
+                counts["resent"] += 1
+            elif not ws_manager.is_device_connected(cmd.user_id, cmd.device_id):
+                # device went away: hold it until the device reconnects (no attempt burned)
+                if await _run_db(crud.transition_command_sql, cmd.id, ("sent",), {"status": "queued"}):
+                    counts["requeued"] += 1
+    return counts
+
+
+async def _run():
+    while True:
+        await asyncio.sleep(settings.COMMAND_SWEEP_SECONDS)
+        try:
+            await sweep()
+        except Exception:
+            logger.exception("Command sweep failed")
+
+
+def start():
+    """Start the sweeper (idempotent; needs a running event loop)."""
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.get_running_loop().create_task(_run())
+
+
+async def stop():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        _sweeper = None
+
+
+async def list_commands(user_id: str, device_id: Optional[str] = None, status: Optional[str] = None, limit: int = 50) -> List[DeviceCommand]:
+    return await _run_db(crud.list_commands_sql, user_id, device_id, status, limit)
+
+
+async def get_command(user_id: str, command_id: str) -> Optional[DeviceCommand]:
+    cmd = await _run_db(crud.get_command_sql, command_id)
+    return cmd if cmd is not None and cmd.user_id == user_id else None
+
+
+def trim_finished() -> int:
+    """Delete finished commands older than COMMAND_RETENTION_DAYS. Returns rows removed."""
+    cutoff = datetime.utcnow() - timedelta(days=settings.COMMAND_RETENTION_DAYS)
+    return _db(crud.trim_commands_sql, cutoff)
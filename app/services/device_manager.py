@@ -2,150 +2,671 @@
 """
 WebSocket manager that tracks multiple device sockets per user.
 Provides:
-- connect(user_id, websocket)
-- disconnect(user_id, websocket)
+- connect(user_id, websocket, device_id=None) -> conn_id
+- disconnect(conn_id)
 - send_personal(user_id, payload)  # send to all devices of a user
 - send_to_device(user_id, device_id, payload)
-Optional: Redis pub/sub integration for multi-instance broadcasting.
+- send_frame(user_id, frame)       # pre-built protocol.Frame, encoded once per protocol
+Each connection has a bounded send queue drained by its own writer task.
+- heartbeat: one timer-wheel task pings idle sockets and reaps dead ones
+- presence: live online/last-seen per device, flushed to the DB in batches
+Optional: pub/sub bridge (in-process / UNIX socket / Redis) for multi-instance broadcasting.
 """
 
 import asyncio
-import json
 import logging
-from typing import Dict, List, Optional
-
-try:
-    import aioredis
-except Exception:
-    aioredis = None
+import math
+import time
+import uuid
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
+from anyio import to_thread
 from fastapi import WebSocket
 
 from app.core.config import settings
+from app.services.protocol import JSON, Frame
+from app.services.pubsub import backend_from_settings
 
 logger = logging.getLogger("device_manager")
 logger.setLevel(logging.INFO)
 
 
+class _Presence:
+    __slots__ = ("user_id", "sockets", "last_seen", "dirty")
+
+    def __init__(self, user_id: str, last_seen: datetime):
+        self.user_id = user_id
+        self.sockets = 0
+        self.last_seen = last_seen
+        self.dirty = True
+
+
+class PresenceTable:
+    """
+    In-memory device presence: connect / ping / disconnect only touch a dict.
+    Changed last_seen values are written to `devices` by one batched UPDATE
+    every PRESENCE_FLUSH_SECONDS (see flush()), instead of one transaction
+    per heartbeat. Per process: with several instances each reports the
+    devices connected to it.
+    """
+
+    def __init__(self, flush_seconds: float):
+        self.flush_seconds = flush_seconds
+        self._devices: Dict[str, _Presence] = {}        # device_id -> presence
+        self._by_user: Dict[str, set] = {}               # user_id -> {device_id}
+        self._task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _entry(self, user_id: str, device_id: str, now: datetime) -> _Presence:
+        p = self._devices.get(device_id)
+        if p is None or p.user_id != user_id:
+            p = self._devices[device_id] = _Presence(user_id, now)
+            self._by_user.setdefault(user_id, set()).add(device_id)
+        return p
+
+    def touch(self, user_id: str, device_id: Optional[str]):
+        if not device_id:
+            return
+        now = datetime.utcnow()
+        p = self._entry(user_id, device_id, now)
+        p.last_seen = now
+        p.dirty = True
+
+    def connect(self, user_id: str, device_id: Optional[str]):
+        if not device_id:
+            return
+        self.touch(user_id, device_id)
+        self._devices[device_id].sockets += 1
+        self._ensure_flusher()
+
+    def disconnect(self, user_id: str, device_id: str):
+        p = self._devices.get(device_id)
+        if p is None or p.user_id != user_id:
+            return
+        p.sockets = max(0, p.sockets - 1)
+        p.last_seen = datetime.utcnow()
+        p.dirty = True
+
+    def snapshot(self, user_id: str) -> Dict[str, Tuple[bool, datetime]]:
+        """device_id -> (online, last_seen) for the user's devices seen by this process."""
+        out = {}
+        for device_id in self._by_user.get(user_id, ()):
+            p = self._devices[device_id]
+            out[device_id] = (p.sockets > 0, p.last_seen)
+        return out
+
+    def _drain(self) -> List[Tuple[str, str, datetime]]:
+        seen = []
+        for device_id, p in list(self._devices.items()):
+            if p.dirty:
+                p.dirty = False
+                seen.append((device_id, p.user_id, p.last_seen))
+            elif p.sockets == 0:
+                # offline and persisted: nothing left to report from memory
+                self._devices.pop(device_id, None)
+                devs = self._by_user.get(p.user_id)
+                if devs is not None:
+                    devs.discard(device_id)
+                    if not devs:
+                        self._by_user.pop(p.user_id, None)
+        return seen
+
+    async def flush(self) -> int:
+        """Write dirty last_seen values in one batched UPDATE. Returns rows written."""
+        seen = self._drain()
+        if not seen:
+            return 0
+        try:
+            n = await to_thread.run_sync(_write_last_seen, seen)
+        except Exception:
+            logger.exception("Presence flush of %d devices failed; will retry", len(seen))
+            for device_id, _, _ in seen:
+                p = self._devices.get(device_id)
+                if p is not None:
+                    p.dirty = True
+            return 0
+        self.flushes += 1
+        self.flushed_rows += n
+        return n
+
+    def _ensure_flusher(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def stop(self):
+        """Cancel the flush loop and write whatever is still dirty."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+def _write_last_seen(seen: List[Tuple[str, str, datetime]]) -> int:
+    from app.database import crud
+    from app.database.base import engine
+    from sqlmodel import Session
+    with Session(engine) as session:
+        return crud.update_devices_last_seen_sql(session, seen)
+
+
+presence = PresenceTable(settings.PRESENCE_FLUSH_SECONDS)
+
+
+class _Connection:
+    """
+    One accepted websocket with its own bounded outbound queue. A dedicated
+    writer task drains the queue, so a slow socket only delays itself.
+    """
+    __slots__ = ("id", "user_id", "device_id", "ws", "proto", "pending", "wakeup", "task", "closed", "last_rx", "slot")
+
+    def __init__(self, user_id: str, device_id: Optional[str], ws: WebSocket, proto: str = JSON):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.device_id = device_id
+        self.ws = ws
+        self.proto = proto              # protocol.JSON (text frames) or protocol.MSGPACK (binary)
+        self.pending: deque = deque()   # (coalesce_key | None, encoded frame)
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_rx = time.monotonic()  # last frame received from the client
+        self.slot = -1                   # HeartbeatWheel bucket
+
+
+class HeartbeatWheel:
+    """
+    Server-driven heartbeats for every socket of the process from ONE task.
+
+    Connections are spread over `interval / tick` buckets; each tick visits
+    only the next bucket, so every socket is checked once per interval and
+    the work per tick is connections / buckets (~3.3k at 100k sockets with
+    the 30s / 1s defaults) instead of one sleeping task per socket.
+    When its bucket comes up, a socket that
+    - sent nothing for idle_timeout seconds is reaped (closed with 1001),
+      which is how half-open connections of sleeping phones get dropped;
+    - sent nothing for about an interval gets an app-level {"type": "ping"}
+      (clients answer "pong"; any inbound frame counts as alive).
+    Deadlines are only checked on those visits, so a dead socket goes away
+    between idle_timeout and idle_timeout + interval after its last frame.
+    Per-tick reap counts are kept for the last minute for rate reporting.
+    """
+
+    def __init__(self, manager: "InMemoryWSManager", interval: float, tick: float, idle_timeout: float):
+        self.manager = manager
+        self.interval = interval
+        self.tick = tick
+        self.idle_timeout = idle_timeout
+        self.slots: List[Dict[str, _Connection]] = [dict() for _ in range(max(1, math.ceil(interval / tick)))]
+        self._cursor = 0
+        self._placed = 0
+        self._task: Optional[asyncio.Task] = None
+        self._recent: deque = deque(maxlen=max(1, math.ceil(60 / tick)))  # reaps per tick, last minute
+        self.pings_sent = 0
+        self.reaped = 0
+
+    def add(self, conn: _Connection):
+        # round-robin, so a reconnect storm still spreads evenly over the ticks
+        conn.slot = self._placed % len(self.slots)
+        self._placed += 1
+        self.slots[conn.slot][conn.id] = conn
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def remove(self, conn: _Connection):
+        if conn.slot >= 0:
+            self.slots[conn.slot].pop(conn.id, None)
+            conn.slot = -1
+
+    def advance(self, now: Optional[float] = None) -> int:
+        """Visit the next bucket; returns sockets reaped."""
+        now = time.monotonic() if now is None else now
+        bucket = self.slots[self._cursor]
+        self._cursor = (self._cursor + 1) % len(self.slots)
+        ping = Frame({"type": "ping"})
+        reaped = 0
+        for conn in list(bucket.values()):
+            idle = now - conn.last_rx
+            if idle >= self.idle_timeout:
+                self.manager._reap(conn)
+                reaped += 1
+            elif idle >= self.interval - self.tick:
+                self.manager._enqueue(conn, ping.key, ping.encode(conn.proto))
+                self.pings_sent += 1
+        self._recent.append(reaped)
+        self.reaped += reaped
+        return reaped
+
+    async def _run(self):
+        next_at = time.monotonic()
+        while True:
+            next_at += self.tick
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            try:
+                self.advance()
+            except Exception:
+                logger.exception("Heartbeat tick failed")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        window = len(self._recent) * self.tick
+        last_minute = sum(self._recent)
+        return {
+            "interval_seconds": self.interval,
+            "idle_timeout_seconds": self.idle_timeout,
+            "pings_sent": self.pings_sent,
+            "reaped": self.reaped,
+            "reaped_last_minute": last_minute,
+            "reap_rate_per_minute": round(last_minute * 60 / window, 2) if window else 0.0,
+        }
+
+
 class InMemoryWSManager:
-    def __init__(self):
-        # user_id -> list of websockets
-        self.active: Dict[str, List[WebSocket]] = {}
-        # user_id -> dict device_id -> websocket (if devices supply id)
-        self.device_map: Dict[str, Dict[str, WebSocket]] = {}
-        self.lock = asyncio.Lock()
-
-    async def connect(self, user_id: str, websocket: WebSocket, device_id: Optional[str] = None):
+    """
+    Registries are keyed by connection id, so connect/disconnect are O(1)
+    dict operations and need no manager-wide lock (they never await while
+    mutating). Sends only enqueue; delivery happens in per-connection writer
+    tasks, so fan-out to a user's devices is concurrent.
+
+    When a connection's queue is full (WS_SEND_QUEUE_SIZE) the
+    WS_SLOW_CONSUMER_POLICY applies:
+    - "drop":       discard the oldest queued frame
+    - "coalesce":   replace a queued frame of the same coalescible type
+                    (ping/pong/presence/typing/status); otherwise disconnect
+    - "disconnect": close the socket (1013) so the client reconnects and resyncs
+
+    With heartbeat_interval > 0 a HeartbeatWheel pings idle sockets and reaps
+    the ones that stay silent (see HeartbeatWheel).
+    """
+
+    def __init__(
+        self,
+        queue_size: int,
+        policy: str,
+        heartbeat_interval: float = 0,
+        heartbeat_tick: float = 1.0,
+        idle_timeout: float = 0,
+    ):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.heartbeat: Optional[HeartbeatWheel] = None
+        if heartbeat_interval > 0:
+            self.heartbeat = HeartbeatWheel(self, heartbeat_interval, heartbeat_tick, idle_timeout or 2.5 * heartbeat_interval)
+        self.connections: Dict[str, _Connection] = {}            # conn_id -> connection
+        self.by_user: Dict[str, Dict[str, _Connection]] = {}     # user_id -> {conn_id: connection}
+        self.device_map: Dict[str, Dict[str, _Connection]] = {}  # user_id -> {device_id: connection}
+        # (on_online, on_offline) callbacks fired when a user's first socket
+        # connects / last socket leaves this process (used by the pub/sub bridge)
+        self._user_listeners: List[Tuple[Callable[[str], None], Callable[[str], None]]] = []
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    async def connect(
+        self,
+        user_id: str,
+        websocket: WebSocket,
+        device_id: Optional[str] = None,
+        proto: str = JSON,
+        subprotocol: Optional[str] = None,
+    ) -> str:
         """
-        Register websocket under user_id. Optionally associate a device_id.
+        Accept and register websocket under user_id (optionally as device_id),
+        speaking the negotiated wire protocol (see app.services.protocol).
+        Returns the connection id used for disconnect().
         """
-        await websocket.accept()
-        async with self.lock:
-            self.active.setdefault(user_id, []).append(websocket)
-            if device_id:
-                self.device_map.setdefault(user_id, {})[device_id] = websocket
-        logger.info("WS connect user=%s device=%s sockets=%d", user_id, device_id, len(self.active.get(user_id, [])))
-
-    async def disconnect(self, user_id: str, websocket: WebSocket):
-        async with self.lock:
-            conns = self.active.get(user_id, [])
-            if websocket in conns:
-                conns.remove(websocket)
-            # remove from device_map if present
-            for devmap in (self.device_map.get(user_id, {}),):
-                for did, ws in list(devmap.items()):
-                    if ws == websocket:
-                        devmap.pop(did, None)
+        if subprotocol:
+            await websocket.accept(subprotocol=subprotocol)
+        else:
+            await websocket.accept()
+        conn = _Connection(user_id, device_id, websocket, proto)
+        self.connections[conn.id] = conn
+        first = user_id not in self.by_user
+        self.by_user.setdefault(user_id, {})[conn.id] = conn
+        if first:
+            for on_online, _ in self._user_listeners:
+                on_online(user_id)
+        if device_id:
+            self.device_map.setdefault(user_id, {})[device_id] = conn
+        conn.task = asyncio.create_task(self._writer(conn))
+        if self.heartbeat is not None:
+            self.heartbeat.add(conn)
+        presence.connect(user_id, device_id)
+        logger.info("WS connect user=%s device=%s sockets=%d", user_id, device_id, len(self.by_user[user_id]))
+        return conn.id
+
+    async def disconnect(self, conn_id: str):
+        """Unregister a connection (idempotent) and stop its writer task."""
+        self._unregister(conn_id)
+
+    async def close(self, conn_id: str, code: int = 1000):
+        """Close one connection with the given close code (e.g. 4401) and unregister it."""
+        conn = self.connections.get(conn_id)
+        if conn is not None:
+            await self._close(conn, code)
+
+    def _unregister(self, conn_id: str):
+        conn = self.connections.pop(conn_id, None)
+        if conn is None:
+            return
+        conn.closed = True
+        conn.wakeup.set()
+        if self.heartbeat is not None:
+            self.heartbeat.remove(conn)
+        conns = self.by_user.get(conn.user_id)
+        if conns is not None:
+            conns.pop(conn_id, None)
             if not conns:
-                self.active.pop(user_id, None)
-                self.device_map.pop(user_id, None)
-        logger.info("WS disconnect user=%s remaining=%d", user_id, len(self.active.get(user_id, [])) if user_id in self.active else 0)
+                self.by_user.pop(conn.user_id, None)
+                for _, on_offline in self._user_listeners:
+                    on_offline(conn.user_id)
+        if conn.device_id:
+            devmap = self.device_map.get(conn.user_id)
+            if devmap is not None and devmap.get(conn.device_id) is conn:
+                devmap.pop(conn.device_id, None)
+                if not devmap:
+                    self.device_map.pop(conn.user_id, None)
+            presence.disconnect(conn.user_id, conn.device_id)
+        if conn.task is not None and conn.task is not asyncio.current_task():
+            conn.task.cancel()
+        logger.info("WS disconnect user=%s remaining=%d", conn.user_id, len(self.by_user.get(conn.user_id, {})))
+
+    def mark_alive(self, conn_id: str):
+        """Record inbound traffic on conn_id (resets its idle deadline)."""
+        conn = self.connections.get(conn_id)
+        if conn is not None:
+            conn.last_rx = time.monotonic()
+
+    def is_connected(self, user_id: str) -> bool:
+        return user_id in self.by_user
+
+    def is_device_connected(self, user_id: str, device_id: str) -> bool:
+        return device_id in self.device_map.get(user_id, {})
+
+    def add_user_listener(self, on_online: Callable[[str], None], on_offline: Callable[[str], None]):
+        """Register sync callbacks for a user's first connect / last disconnect here."""
+        self._user_listeners.append((on_online, on_offline))
+        for user_id in list(self.by_user):
+            on_online(user_id)
 
+    # -------------------------
+    # Sending (enqueue only)
+    # -------------------------
     async def send_personal(self, user_id: str, payload: dict):
         """
-        Send payload to all active websockets for user_id.
+        Queue payload for all active websockets of user_id (serialized once per protocol).
         """
-        conns = list(self.active.get(user_id, []))
+        await self.send_frame(user_id, Frame(payload))
+
+    async def send_frame(self, user_id: str, frame: Frame):
+        """Like send_personal, for a Frame the caller also publishes (shares its encodings)."""
+        conns = self.by_user.get(user_id)
         if not conns:
             logger.debug("No active sockets for user %s", user_id)
             return
-        msg = json.dumps(payload)
-        for ws in list(conns):
-            try:
-                await ws.send_text(msg)
-            except Exception as e:
-                logger.exception("Failed sending to websocket for user %s: %s", user_id, e)
-                # best-effort cleanup
-                await self.disconnect(user_id, ws)
+        for conn in list(conns.values()):
+            self._enqueue(conn, frame.key, frame.encode(conn.proto))
 
     async def send_to_device(self, user_id: str, device_id: str, payload: dict):
-        devmap = self.device_map.get(user_id, {})
-        ws = devmap.get(device_id)
-        if not ws:
+        conn = self.device_map.get(user_id, {}).get(device_id)
+        if not conn:
             logger.debug("Device %s for user %s not connected", device_id, user_id)
             return
+        frame = Frame(payload)
+        self._enqueue(conn, frame.key, frame.encode(conn.proto))
+
+    async def send_to_connection(self, conn_id: str, payload: dict):
+        """Queue payload for one connection only (e.g. a reply to its own request)."""
+        conn = self.connections.get(conn_id)
+        if conn is not None:
+            frame = Frame(payload)
+            self._enqueue(conn, frame.key, frame.encode(conn.proto))
+
+    def _enqueue(self, conn: _Connection, key: Optional[str], msg: Union[str, bytes]):
+        if conn.closed:
+            return
+        pending = conn.pending
+        if len(pending) >= self.queue_size:
+            if self.policy == "drop":
+                pending.popleft()
+                self.dropped += 1
+            elif self.policy == "coalesce" and key is not None and self._coalesce(conn, key, msg):
+                return
+            else:
+                self._slow_disconnect(conn)
+                return
+        pending.append((key, msg))
+        conn.wakeup.set()
+
+    def _coalesce(self, conn: _Connection, key: str, msg: Union[str, bytes]) -> bool:
+        # replace the oldest queued frame of the same type; the newest value wins
+        for i, (k, _) in enumerate(conn.pending):
+            if k == key:
+                del conn.pending[i]
+                conn.pending.append((key, msg))
+                self.coalesced += 1
+                return True
+        return False
+
+    def _slow_disconnect(self, conn: _Connection):
+        self.slow_disconnects += 1
+        logger.warning("WS slow consumer user=%s conn=%s queued=%d; disconnecting", conn.user_id, conn.id, len(conn.pending))
+        self._unregister(conn.id)
+        asyncio.create_task(self._close(conn, code=1013))
+
+    def _reap(self, conn: _Connection):
+        logger.info("WS reaping idle socket user=%s conn=%s", conn.user_id, conn.id)
+        self._unregister(conn.id)
+        asyncio.create_task(self._close(conn, code=1001))
+
+    async def _close(self, conn: _Connection, code: int = 1000):
+        self._unregister(conn.id)
         try:
-            await ws.send_json(payload)
+            # bounded: a half-open peer never completes the closing handshake
+            await asyncio.wait_for(conn.ws.close(code=code), timeout=5.0)
         except Exception:
-            await self.disconnect(user_id, ws)
+            pass
+
+    async def _writer(self, conn: _Connection):
+        try:
+            while not conn.closed:
+                if not conn.pending:
+                    conn.wakeup.clear()
+                    await conn.wakeup.wait()
+                    continue
+                _, msg = conn.pending.popleft()
+                if isinstance(msg, bytes):
+                    await conn.ws.send_bytes(msg)
+                else:
+                    await conn.ws.send_text(msg)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.warning("Failed sending to websocket for user %s: %s", conn.user_id, e)
+            await self._close(conn)
+
+    def stats(self) -> dict:
+        return {
+            "connections": len(self.connections),
+            "users": len(self.by_user),
+            "queued": sum(len(c.pending) for c in self.connections.values()),
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "heartbeat": self.heartbeat.stats() if self.heartbeat is not None else None,
+        }
+
 
 # Instantiate in-memory manager
-ws_manager = InMemoryWSManager()
+ws_manager = InMemoryWSManager(
+    settings.WS_SEND_QUEUE_SIZE,
+    settings.WS_SLOW_CONSUMER_POLICY,
+    heartbeat_interval=settings.WS_HEARTBEAT_INTERVAL_SECONDS,
+    heartbeat_tick=settings.WS_HEARTBEAT_TICK_SECONDS,
+    idle_timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+)
+
+
+# Optional pub/sub bridge for multi-instance / multi-worker delivery
+class PubSubBridge:
+    """
+    Forwards user payloads between app instances over a pub/sub backend
+    (see services/pubsub.py: in-process, UNIX-socket broker, or Redis).
 
+    - Targeted: an instance subscribes only to the channels of users that
+      have a socket on it (per-user channel, or with REDIS_BRIDGE_SHARDS > 0
+      a hashed shard channel), instead of pattern-subscribing to everyone.
+    - Echo-free: every envelope carries the publisher's instance_id and an
+      instance drops its own publishes (it already delivered locally).
+    - Envelope is a header line "<src>\t<user>\t<coalesce key>" followed by
+      the payload JSON as already serialized for local delivery, so a publish
+      adds no extra encode and receivers forward it without re-parsing.
+    """
 
-# Optional Redis-backed pubsub for multi-instance scaling
-class RedisPubSubBridge:
-    def __init__(self, redis_url: Optional[str]):
-        self.redis_url = redis_url
+    def __init__(self, backend=None, manager: Optional["InMemoryWSManager"] = None, shards: int = 0):
+        self.backend = backend
+        self.manager = manager or ws_manager
+        self.shards = shards
+        self.instance_id = uuid.uuid4().hex[:12]
         self._pub = None
         self._sub = None
-        self._task = None
+        self._tasks: List[asyncio.Task] = []
+        self._ops: Optional[asyncio.Queue] = None
+        self._channels: Dict[str, int] = {}  # channel -> local users on it
+        self.published = 0
+        self.delivered = 0
+        self.echoes_dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._pub is not None
+
+    def channel_for(self, user_id: str) -> str:
+        if self.shards > 0:
+            return f"zylos:shard:{zlib.crc32(user_id.encode()) % self.shards}"
+        return f"zylos:user:{user_id}"
 
     async def start(self):
-        if not aioredis or not self.redis_url:
-            logger.info("Redis pubsub not available or not configured.")
+        if self.backend is None:
+            logger.info("Pub/sub bridge not configured (single instance).")
             return
         try:
-            self._pub = await aioredis.from_url(self.redis_url, encoding="utf-8", decode_responses=True)
-            self._sub = self._pub  # using same client for convenience
-            self._task = asyncio.create_task(self._listen())
-            logger.info("RedisPubSubBridge started.")
+            self._pub = await self.backend.client()
+            self._sub = self._pub.pubsub()
         except Exception as e:
-            logger.exception("RedisPubSubBridge init failed: %s", e)
+            logger.exception("PubSubBridge init failed (%s): %s", self.backend.name, e)
+            self._pub = self._sub = None
+            return
+        # an always-on instance channel keeps the subscriber connection in subscribed mode
+        await self._sub.subscribe(f"zylos:instance:{self.instance_id}")
+        self._ops = asyncio.Queue()
+        self.manager.add_user_listener(self._user_online, self._user_offline)
+        self._tasks = [asyncio.create_task(self._apply_ops()), asyncio.create_task(self._listen())]
+        logger.info("PubSubBridge started (backend=%s, instance=%s, shards=%s).",
+                    self.backend.name, self.instance_id, self.shards or "per-user")
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        for c in (self._sub, self._pub):
+            if c is not None:
+                try:
+                    await c.close()
+                except Exception:
+                    pass
+        self._pub = self._sub = None
+        if self.backend is not None:
+            await self.backend.close()
 
     async def publish_user(self, user_id: str, payload: dict):
+        await self.publish_frame(user_id, Frame(payload))
+
+    async def publish_frame(self, user_id: str, frame: Frame):
         if not self._pub:
             return
-        channel = f"zylos:user:{user_id}"
-        await self._pub.publish(channel, json.dumps(payload))
+        envelope = f"{self.instance_id}\t{user_id}\t{frame.key or ''}\n{frame.json}"
+        await self._pub.publish(self.channel_for(user_id), envelope)
+        self.published += 1
+
+    # -------------------------
+    # Subscriptions follow local connections
+    # -------------------------
+    def _user_online(self, user_id: str):
+        ch = self.channel_for(user_id)
+        n = self._channels.get(ch, 0)
+        self._channels[ch] = n + 1
+        if n == 0:
+            self._ops.put_nowait(("subscribe", ch))
+
+    def _user_offline(self, user_id: str):
+        ch = self.channel_for(user_id)
+        n = self._channels.get(ch, 0) - 1
+        if n > 0:
+            self._channels[ch] = n
+            return
+        self._channels.pop(ch, None)
+        self._ops.put_nowait(("unsubscribe", ch))
+
+    async def _apply_ops(self):
+        # one task applies (un)subscribes in order, so a quick reconnect can't reorder them
+        while True:
+            op, ch = await self._ops.get()
+            if (op == "subscribe") != (ch in self._channels):
+                continue  # superseded by a later connect/disconnect
+            try:
+                await getattr(self._sub, op)(ch)
+            except Exception:
+                logger.exception("PubSubBridge %s %s failed", op, ch)
 
     async def _listen(self):
-        # subscribe to pattern "zylos:user:*"
-        try:
-            pubsub = self._pub.pubsub()
-            await pubsub.psubscribe("zylos:user:*")
-            async for message in pubsub.listen():
-                if message is None:
-                    continue
-                typ = message.get("type")
-                if typ not in ("message", "pmessage"):
-                    continue
-                data = message.get("data")
-                if not data:
+        while True:
+            try:
+                message = await self._sub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("PubSubBridge listener error")
+                await asyncio.sleep(1.0)
+                continue
+            if not message or message.get("type") != "message":
+                continue
+            try:
+                data = message["data"]
+                if isinstance(data, bytes):
+                    data = data.decode("utf-8")
+                header, _, body = data.partition("\n")
+                src, user_id, key = header.split("\t")
+                if src == self.instance_id:
+                    self.echoes_dropped += 1
                     continue
-                try:
-                    payload = json.loads(data)
-                    channel = message.get("channel") or message.get("pattern")
-                    # extract user id from channel name
-                    # channel like "zylos:user:{user_id}"
-                    parts = channel.split(":")
-                    user_id = parts[-1]
-                    # forward to local ws_manager
-                    await ws_manager.send_personal(user_id, payload)
-                except Exception:
-                    logger.exception("RedisPubSubBridge failed process msg")
-        except Exception:
-            logger.exception("RedisPubSubBridge listener crashed")
+                # shard channels carry other users too; only deliver to local ones
+                if self.manager.is_connected(user_id):
+                    await self.manager.send_frame(user_id, Frame.from_json(body, key))
+                    self.delivered += 1
+            except Exception:
+                logger.exception("PubSubBridge failed process msg")
+
+    def stats(self) -> dict:
+        return {
+            "instance_id": self.instance_id, "channels": len(self._channels),
+            "published": self.published, "delivered": self.delivered, "echoes_dropped": self.echoes_dropped,
+        }
+
 
+# kept for existing imports
+RedisPubSubBridge = PubSubBridge
 
-redis_bridge = RedisPubSubBridge(settings.REDIS_URL if getattr(settings, "REDIS_URL", None) else None)
\ No newline at end of file
+redis_bridge = PubSubBridge(backend_from_settings(), shards=settings.REDIS_BRIDGE_SHARDS)
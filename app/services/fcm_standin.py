@@ -0,0 +1,85 @@
+# app/services/fcm_standin.py
+"""
+Local stand-in for FCM's legacy multicast endpoint (POST /fcm/send), so
+push delivery can be exercised offline:
+
+    python -m app.services.fcm_standin --port 8765
+    FCM_SERVER_KEY=dev FCM_ENDPOINT=http://127.0.0.1:8765/fcm/send uvicorn app.main:app
+
+or in-process with httpx.ASGITransport(app=create_app()).
+
+The per-token result depends on the token:
+- "invalid-..."  -> NotRegistered (the dispatcher prunes it)
+- "flaky-..."    -> Unavailable on its first delivery, success afterwards
+- anything else  -> success
+POST /_control {"fail_next": n, "retry_after": s} makes the next n requests
+answer 503. GET /_batches lists what was received.
+"""
+
+import argparse
+from typing import Any, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="FCM stand-in")
+    app.state.batches = []
+    app.state.attempts = {}              # token -> deliveries seen
+    app.state.fail_next = 0
+    app.state.retry_after = 0
+
+    @app.post("/fcm/send")
+    async def send(request: Request):
+        if not request.headers.get("authorization", "").startswith("key="):
+            return JSONResponse({"error": "Unauthorized"}, status_code=401)
+        if app.state.fail_next > 0:
+            app.state.fail_next -= 1
+            return JSONResponse({"error": "Unavailable"}, status_code=503, headers={"Retry-After": str(app.state.retry_after)})
+
+        body = await request.json()
+        tokens = body.get("registration_ids") or []
+        if not tokens or len(tokens) > 1000:
+            return JSONResponse({"error": "InvalidParameters"}, status_code=400)
+        app.state.batches.append(body)
+
+        results = []
+        for token in tokens:
+            n = app.state.attempts[token] = app.state.attempts.get(token, 0) + 1
+            if token.startswith("invalid-"):
+                results.append({"error": "NotRegistered"})
+            elif token.startswith("flaky-") and n == 1:
+                results.append({"error": "Unavailable"})
+            else:
+                results.append({"message_id": f"0:{len(app.state.batches)}:{n}"})
+        failures = sum(1 for r in results if "error" in r)
+        return {
+            "multicast_id": len(app.state.batches),
+            "success": len(results) - failures,
+            "failure": failures,
+            "canonical_ids": 0,
+            "results": results,
+        }
+
+    @app.post("/_control")
+    async def control(options: Dict[str, Any]):
+        app.state.fail_next = int(options.get("fail_next", 0))
+        app.state.retry_after = options.get("retry_after", 0)
+        return {"ok": True}
+
+    @app.get("/_batches")
+    async def batches():
+        return {"batches": app.state.batches}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local FCM stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    uvicorn.run(create_app(), host=args.host, port=args.port)
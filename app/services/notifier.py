@@ -2,56 +2,53 @@
 """
 Notifier service:
 - in-app push via WebSocket (preferred)
-- FCM push for Android (requires server key)
+- FCM push for Android (requires server key); batched, retried and
+  pruned asynchronously by services/push.py
 - Email (optional)
 This module provides safe wrappers; actual provider keys must be configured via .env.
 """
 
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
-from app.services.device_manager import ws_manager
-from app.core.config import settings
+from app.database import crud
+from app.database.base import open_async_session
+from app.services.push import push_dispatcher
+from app.services.sync_manager import sync_manager
 
 logger = logging.getLogger("notifier")
 logger.setLevel(logging.INFO)
 
-# Optional placeholders for FCM — install pyfcm if you want
-try:
-    from pyfcm import FCMNotification
-except Exception:
-    FCMNotification = None
-
-_fcm_client = None
-if getattr(settings, "SUPABASE_KEY", None) and FCMNotification is None:
-    logger.info("pyfcm not installed; FCM disabled.")
-
-def init_fcm(server_key: str):
-    global _fcm_client
-    if FCMNotification is None:
-        raise RuntimeError("pyfcm not installed")
-    _fcm_client = FCMNotification(api_key=server_key)
+def init_fcm(server_key: str, endpoint: Optional[str] = None):
+    """Enable FCM push at runtime (normally configured via FCM_SERVER_KEY / FCM_ENDPOINT)."""
+    push_dispatcher.configure(server_key=server_key, endpoint=endpoint)
 
 async def notify_in_app(user_id: str, payload: Dict[str, Any]):
     """
-    Preferred: deliver via websocket(s). If user not connected, store or fallback.
+    Preferred: deliver via websocket(s). Goes through the same per-user
+    record-and-send path as chat replies, so live frames keep seq order and
+    offline devices receive it when they resume.
+    """
+    await sync_manager.push_reply_to_user(user_id, payload)
+
+def send_fcm(token: str, title: str, body: str, data: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Queue an FCM push to one device token. Returns immediately; delivery is
+    batched and retried by services/push.py. Call from the event loop.
     """
-    try:
-        await ws_manager.send_personal(user_id, payload)
-    except Exception:
-        logger.exception("In-app notify failed for user %s", user_id)
-        # TODO: enqueue to DB for later delivery
+    return push_dispatcher.send([token], title, body, data) == 1
 
-def send_fcm(token: str, title: str, body: str, data: Optional[Dict[str, Any]] = None):
+async def push_to_users(user_ids: List[str], title: str, body: str, data: Optional[Dict[str, Any]] = None) -> int:
     """
-    Send FCM push to single device token. Blocks (sync) intentionally simple wrapper.
+    Queue one notification for every device of user_ids that registered a
+    push token (one DB query, one multicast per PUSH_BATCH_SIZE tokens).
+    Returns the number of tokens queued.
     """
-    if not _fcm_client:
-        logger.warning("FCM client not configured")
-        return {"error": "fcm-not-configured"}
-    try:
-        res = _fcm_client.notify_single_device(registration_id=token, message_title=title, message_body=body, data_message=data or {})
-        return res
-    except Exception as e:
-        logger.exception("FCM send failed: %s", e)
-        return {"error": str(e)}
\ No newline at end of file
+    if not push_dispatcher.enabled:
+        return 0
+    async with open_async_session() as session:
+        tokens = await crud.get_push_tokens_async(session, list(user_ids))
+    return push_dispatcher.send(tokens, title, body, data)
+
+async def push_to_user(user_id: str, title: str, body: str, data: Optional[Dict[str, Any]] = None) -> int:
+    return await push_to_users([user_id], title, body, data)
@@ -0,0 +1,92 @@
+# app/services/outbox.py
+"""
+Durable per-user outbox for realtime payloads.
+
+Every payload pushed to a user (chat replies, in-app notifications) is first
+appended to the `outbox` table with the user's next sequence number, and the
+live frame carries that `seq`. A client that was offline (or lost frames)
+reconnects with /ws/{user_id}?last_seq=N, or sends {"type": "resume",
+"last_seq": N}, and receives only the entries after N in "batch" frames of
+OUTBOX_REPLAY_BATCH items, followed by "replay_done".
+
+Retention is bounded per user (OUTBOX_MAX_PER_USER, trimmed on append) and
+by age (OUTBOX_RETENTION_HOURS, trimmed by the scheduler). The age trim
+keeps each user's newest entry so seq never restarts. When the gap is older
+than what is retained, or the client claims a seq the server never issued
+(e.g. a restored database), the client gets "resync_required" and should
+refetch history instead.
+
+Live frames and replay can overlap around a reconnect; clients drop any
+frame whose seq they have already seen.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+from anyio import to_thread
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.database import crud
+from app.database.base import engine, open_async_session
+from app.services.device_manager import ws_manager
+
+logger = logging.getLogger("outbox")
+logger.setLevel(logging.INFO)
+
+
+def _append_sync(user_id: str, raw: str) -> int:
+    with Session(engine) as session:
+        return crud.append_outbox_sql(session, user_id, raw, keep=settings.OUTBOX_MAX_PER_USER)
+
+
+async def record(user_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Persist payload in the user's outbox and return it stamped with its seq.
+    Falls back to the unstamped payload (live delivery only) if the write fails.
+    """
+    if not settings.OUTBOX_ENABLED:
+        return payload
+    try:
+        seq = await to_thread.run_sync(_append_sync, user_id, json.dumps(payload))
+    except Exception:
+        logger.exception("Outbox append failed for user %s", user_id)
+        return payload
+    return dict(payload, seq=seq)
+
+
+async def replay(conn_id: str, user_id: str, last_seq: int):
+    """
+    Send the entries after last_seq to one connection, in batches.
+    """
+    batch = max(1, settings.OUTBOX_REPLAY_BATCH)
+    async with open_async_session() as session:
+        oldest, newest = await crud.get_outbox_bounds_async(session, user_id)
+        if last_seq == (newest or 0):
+            await ws_manager.send_to_connection(conn_id, {"type": "replay_done", "seq": newest or 0})
+            return
+        if newest is None or last_seq > newest or last_seq < oldest - 1:
+            # part of the gap was trimmed away (or the client is ahead of us):
+            # a partial replay would hide that
+            await ws_manager.send_to_connection(conn_id, {"type": "resync_required", "seq": newest or 0})
+            return
+        cursor = last_seq
+        while True:
+            rows = await crud.get_outbox_after_async(session, user_id, cursor, batch)
+            if not rows:
+                break
+            items = [dict(json.loads(r.payload), seq=r.seq) for r in rows]
+            await ws_manager.send_to_connection(conn_id, {"type": "batch", "items": items})
+            cursor = rows[-1].seq
+            if len(rows) < batch:
+                break
+        await ws_manager.send_to_connection(conn_id, {"type": "replay_done", "seq": cursor})
+
+
+def trim_expired() -> int:
+    """Delete outbox entries older than OUTBOX_RETENTION_HOURS. Returns rows removed."""
+    cutoff = datetime.utcnow() - timedelta(hours=settings.OUTBOX_RETENTION_HOURS)
+    with Session(engine) as session:
+        return crud.trim_outbox_sql(session, cutoff)
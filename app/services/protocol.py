@@ -0,0 +1,106 @@
+# app/services/protocol.py
+"""
+WebSocket wire protocols.
+
+Clients pick one at connect time through the WebSocket subprotocol header
+(Sec-WebSocket-Protocol: zylos.msgpack, zylos.json) or ?proto=msgpack|json:
+- json:    text frames (default)
+- msgpack: binary MessagePack frames, ~30-50% smaller for typical payloads
+
+Compression (permessage-deflate) is negotiated by the WebSocket server
+itself; see WS_PER_MESSAGE_DEFLATE / uvicorn's ws_per_message_deflate.
+
+Outbound payloads are wrapped in a Frame, which encodes lazily and at most
+once per protocol, so one fan-out to N sockets (plus the pub/sub publish)
+costs one json.dumps and at most one msgpack.packb.
+"""
+
+import json
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+SUBPROTOCOLS = {"zylos.json": JSON, "zylos.msgpack": MSGPACK}
+
+_COALESCIBLE_TYPES = {"ping", "pong", "presence", "typing", "status"}
+
+
+def supported() -> Tuple[str, ...]:
+    return (JSON, MSGPACK) if msgpack is not None else (JSON,)
+
+
+def negotiate(offered: Iterable[str], query: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Pick (protocol, subprotocol to echo in accept) from the client's offer.
+    Subprotocols are honoured in the client's preference order; unsupported
+    ones (e.g. msgpack without the package) fall back to JSON.
+    """
+    for sub in offered:
+        proto = SUBPROTOCOLS.get(sub.strip())
+        if proto in supported():
+            return proto, sub.strip()
+    if query in supported():
+        return query, None
+    return JSON, None
+
+
+class Frame:
+    """One outbound payload, encoded on demand and cached per protocol."""
+    __slots__ = ("_payload", "_json", "_msgpack", "key")
+
+    def __init__(self, payload: Optional[Dict[str, Any]] = None, json_text: Optional[str] = None, key: Optional[str] = None):
+        self._payload = payload
+        self._json = json_text
+        self._msgpack: Optional[bytes] = None
+        # frames with a key may replace a queued older one of the same key (see InMemoryWSManager)
+        if key is None and isinstance(payload, dict):
+            typ = payload.get("type")
+            key = typ if typ in _COALESCIBLE_TYPES else None
+        self.key = key
+
+    @classmethod
+    def from_json(cls, text: str, key: Optional[str] = None) -> "Frame":
+        """Wrap an already serialized JSON payload (e.g. from the pub/sub hop) without parsing it."""
+        return cls(json_text=text, key=key or None)
+
+    @property
+    def payload(self) -> Dict[str, Any]:
+        if self._payload is None:
+            self._payload = json.loads(self._json)
+        return self._payload
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(self._payload)
+        return self._json
+
+    def encode(self, proto: str) -> Union[str, bytes]:
+        if proto == MSGPACK:
+            if self._msgpack is None:
+                self._msgpack = msgpack.packb(self.payload, use_bin_type=True)
+            return self._msgpack
+        return self.json
+
+
+def decode_incoming(message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Decode an ASGI websocket.receive message: text frames are JSON, binary
+    frames MessagePack. Returns None for frames that are not an object;
+    raises ValueError (or the codec's error) for frames that don't decode.
+    """
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("binary frame but MessagePack is not installed")
+        data = msgpack.unpackb(message["bytes"], raw=False)
+    elif message.get("text") is not None:
+        data = json.loads(message["text"])
+    else:
+        return None
+    return data if isinstance(data, dict) else None
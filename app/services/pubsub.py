@@ -0,0 +1,406 @@
+# app/services/pubsub.py
+"""
+Pub/sub backends for the cross-instance bridge (device_manager.PubSubBridge).
+
+Every backend hands out a client with the subset of the redis.asyncio API
+the bridge uses:
+
+    client = await backend.client()
+    await client.publish(channel, data)
+    ps = client.pubsub()
+    await ps.subscribe(channel); await ps.unsubscribe(channel)
+    msg = await ps.get_message(ignore_subscribe_messages=True, timeout=1.0)
+
+Backends (PUBSUB_BACKEND):
+- "inprocess": LocalBroker, for several app instances in one process (tests).
+- "unix":      a small broker on a UNIX domain socket (PUBSUB_UNIX_PATH), so
+               uvicorn workers on one host reach each other without Redis.
+               The first worker to take the lock file serves the broker;
+               it can also run standalone: python -m app.services.pubsub
+- "redis":     REDIS_URL, for multiple hosts.
+- "auto":      redis when REDIS_URL is set, otherwise none (single worker).
+"""
+
+import asyncio
+import logging
+import os
+import struct
+from typing import Dict, Optional, Set, Tuple
+
+try:
+    import fcntl
+except Exception:  # non-POSIX: no UNIX-socket broker
+    fcntl = None
+
+try:
+    from redis import asyncio as aioredis
+except Exception:
+    try:
+        import aioredis
+    except Exception:
+        aioredis = None
+
+from app.core.config import settings
+
+logger = logging.getLogger("pubsub")
+logger.setLevel(logging.INFO)
+
+
+# -------------------------
+# In-process broker
+# -------------------------
+class LocalBroker:
+    def __init__(self):
+        self._subs: Dict[str, Set["LocalPubSub"]] = {}
+        self.published = 0
+
+    def client(self) -> "LocalClient":
+        return LocalClient(self)
+
+
+class LocalClient:
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+
+    async def publish(self, channel: str, data) -> int:
+        """Deliver to current subscribers; returns how many received it (like Redis)."""
+        subs = list(self.broker._subs.get(channel, ()))
+        self.broker.published += 1
+        for ps in subs:
+            ps._queue.put_nowait({"type": "message", "channel": channel, "data": data})
+        return len(subs)
+
+    def pubsub(self) -> "LocalPubSub":
+        return LocalPubSub(self.broker)
+
+    async def close(self):
+        pass
+
+
+class LocalPubSub:
+    def __init__(self, broker: LocalBroker):
+        self.broker = broker
+        self.channels: Set[str] = set()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def subscribe(self, *channels: str):
+        for ch in channels:
+            self.broker._subs.setdefault(ch, set()).add(self)
+            self.channels.add(ch)
+            self._queue.put_nowait({"type": "subscribe", "channel": ch, "data": len(self.channels)})
+
+    async def unsubscribe(self, *channels: str):
+        for ch in channels or tuple(self.channels):
+            subs = self.broker._subs.get(ch)
+            if subs is not None:
+                subs.discard(self)
+                if not subs:
+                    self.broker._subs.pop(ch, None)
+            self.channels.discard(ch)
+            self._queue.put_nowait({"type": "unsubscribe", "channel": ch, "data": len(self.channels)})
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = None):
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+            try:
+                msg = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if ignore_subscribe_messages and msg["type"] != "message":
+                continue
+            return msg
+
+    async def close(self):
+        await self.unsubscribe()
+
+
+# -------------------------
+# UNIX-socket broker
+# Frame: u32 big-endian body length | u8 op | u16 channel length | channel | data
+# -------------------------
+OP_SUB, OP_UNSUB, OP_PUB, OP_MSG = 1, 2, 3, 4
+_HEADER = struct.Struct(">I")
+_BODY = struct.Struct(">BH")
+MAX_FRAME = 16 * 1024 * 1024
+MAX_SUBSCRIBER_BUFFER = 8 * 1024 * 1024  # a subscriber this far behind is dropped
+
+
+def encode_frame(op: int, channel: str, data: bytes = b"") -> bytes:
+    ch = channel.encode("utf-8")
+    body = _BODY.pack(op, len(ch)) + ch + data
+    return _HEADER.pack(len(body)) + body
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, str, bytes]:
+    (length,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    if length < _BODY.size or length > MAX_FRAME:
+        raise ValueError(f"bad frame length {length}")
+    body = await reader.readexactly(length)
+    op, ch_len = _BODY.unpack_from(body)
+    start = _BODY.size
+    return op, body[start:start + ch_len].decode("utf-8"), body[start + ch_len:]
+
+def _as_bytes(data) -> bytes:
+    return data if isinstance(data, bytes) else str(data).encode("utf-8")
+
+
+class UnixSocketBroker:
+    """Fan-out server: routes PUB frames to the connections subscribed to the channel."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._subs: Dict[str, Set[asyncio.StreamWriter]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.routed = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # stale socket from a dead owner (we hold the lock)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        logger.info("UNIX pub/sub broker listening on %s", self.path)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels: Set[str] = set()
+        try:
+            while True:
+                op, ch, data = await read_frame(reader)
+                if op == OP_SUB:
+                    self._subs.setdefault(ch, set()).add(writer)
+                    channels.add(ch)
+                elif op == OP_UNSUB:
+                    self._unsubscribe(writer, ch)
+                    channels.discard(ch)
+                elif op == OP_PUB:
+                    self._route(ch, data)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            for ch in channels:
+                self._unsubscribe(writer, ch)
+            writer.close()
+
+    def _unsubscribe(self, writer: asyncio.StreamWriter, ch: str):
+        subs = self._subs.get(ch)
+        if subs is not None:
+            subs.discard(writer)
+            if not subs:
+                self._subs.pop(ch, None)
+
+    def _route(self, ch: str, data: bytes):
+        subs = self._subs.get(ch)
+        if not subs:
+            return
+        frame = encode_frame(OP_MSG, ch, data)  # encoded once for all subscribers
+        for w in list(subs):
+            if w.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                logger.warning("Dropping slow pub/sub subscriber on %s", ch)
+                self._unsubscribe(w, ch)
+                w.close()
+                continue
+            w.write(frame)
+            self.routed += 1
+
+
+class UnixSocketClient:
+    def __init__(self, path: str):
+        self.path = path
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def publish(self, channel: str, data) -> None:
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing():
+                _, self._writer = await asyncio.open_unix_connection(self.path)
+            self._writer.write(encode_frame(OP_PUB, channel, _as_bytes(data)))
+            await self._writer.drain()
+
+    def pubsub(self) -> "UnixSocketPubSub":
+        return UnixSocketPubSub(self.path)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class UnixSocketPubSub:
+    """Subscriber connection; a reader task turns MSG frames into redis-style messages."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.channels: Set[str] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def _ensure(self):
+        if self._writer is None:
+            reader, self._writer = await asyncio.open_unix_connection(self.path)
+            self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader):
+        delay = 0.1
+        while True:
+            try:
+                while True:
+                    op, ch, data = await read_frame(reader)
+                    if op == OP_MSG:
+                        self._queue.put_nowait({"type": "message", "channel": ch, "data": data.decode("utf-8")})
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                logger.warning("Pub/sub broker connection lost; reconnecting")
+            # reconnect and restore this connection's subscriptions
+            while True:
+                await asyncio.sleep(delay)
+                try:
+                    reader, self._writer = await asyncio.open_unix_connection(self.path)
+                except OSError:
+                    delay = min(delay * 2, 5.0)
+                    continue
+                for ch in self.channels:
+                    self._writer.write(encode_frame(OP_SUB, ch))
+                await self._writer.drain()
+                delay = 0.1
+                break
+
+    async def subscribe(self, *channels: str):
+        await self._ensure()
+        for ch in channels:
+            self._writer.write(encode_frame(OP_SUB, ch))
+            self.channels.add(ch)
+        await self._writer.drain()
+
+    async def unsubscribe(self, *channels: str):
+        if self._writer is None:
+            return
+        for ch in channels or tuple(self.channels):
+            self._writer.write(encode_frame(OP_UNSUB, ch))
+            self.channels.discard(ch)
+        await self._writer.drain()
+
+    async def get_message(self, ignore_subscribe_messages: bool = False, timeout: Optional[float] = None):
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+# -------------------------
+# Backends
+# -------------------------
+class InProcessBackend:
+    name = "inprocess"
+
+    def __init__(self, broker: Optional[LocalBroker] = None):
+        self.broker = broker or LocalBroker()
+
+    async def client(self):
+        return self.broker.client()
+
+    async def close(self):
+        pass
+
+
+class UnixSocketBackend:
+    name = "unix"
+
+    def __init__(self, path: str, serve: bool = True):
+        self.path = path
+        self.serve = serve
+        self.broker: Optional[UnixSocketBroker] = None
+        self._lock_fd: Optional[int] = None
+
+    def _try_own(self) -> bool:
+        # the lock file elects exactly one broker owner per host, even across restarts
+        if fcntl is None:
+            return False
+        fd = os.open(self.path + ".lock", os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def client(self):
+        if self.serve and self.broker is None and self._try_own():
+            self.broker = UnixSocketBroker(self.path)
+            await self.broker.start()
+        # non-owners may race the owner's bind; wait briefly for the socket
+        for _ in range(50):
+            if os.path.exists(self.path):
+                break
+            await asyncio.sleep(0.1)
+        return UnixSocketClient(self.path)
+
+    async def close(self):
+        if self.broker is not None:
+            await self.broker.close()
+            self.broker = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+class RedisBackend:
+    name = "redis"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    async def client(self):
+        if aioredis is None:
+            raise RuntimeError("redis package not installed")
+        return aioredis.from_url(self.url, encoding="utf-8", decode_responses=True)
+
+    async def close(self):
+        pass
+
+
+def backend_kind() -> str:
+    """PUBSUB_BACKEND with "auto" resolved: "inprocess", "unix", "redis" or "none"."""
+    kind = (settings.PUBSUB_BACKEND or "auto").lower()
+    if kind == "auto":
+        kind = "redis" if settings.REDIS_URL else "none"
+    if kind == "redis" and not settings.REDIS_URL:
+        return "none"
+    return kind if kind in ("inprocess", "unix", "redis") else "none"
+
+
+def backend_from_settings():
+    """The configured backend, or None when cross-instance delivery is off."""
+    kind = backend_kind()
+    if kind == "redis":
+        return RedisBackend(settings.REDIS_URL)
+    if kind == "unix":
+        return UnixSocketBackend(settings.PUBSUB_UNIX_PATH)
+    if kind == "inprocess":
+        return InProcessBackend()
+    return None
+
+
+async def _serve_forever(path: str):
+    backend = UnixSocketBackend(path)
+    if not backend._try_own():
+        raise SystemExit(f"another broker already owns {path}")
+    backend.broker = UnixSocketBroker(path)
+    await backend.broker.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_serve_forever(settings.PUBSUB_UNIX_PATH))
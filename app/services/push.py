@@ -0,0 +1,317 @@
+# app/services/push.py
+"""
+Batched, asynchronous push delivery (FCM HTTP multicast).
+
+send() only enqueues (message, token) pairs and returns. One dispatcher task:
+- gathers pairs for PUSH_BATCH_WINDOW_MS and groups the tokens of identical
+  messages into multicast requests of up to PUSH_BATCH_SIZE tokens
+- keeps at most PUSH_CONCURRENCY requests in flight over one keep-alive client
+- retries what failed transiently (network errors, HTTP 429/5xx, per-token
+  Unavailable / InternalServerError) with exponential backoff and full
+  jitter, honouring Retry-After, up to PUSH_MAX_RETRIES attempts
+- hands tokens the provider rejects (NotRegistered, InvalidRegistration, ...)
+  to on_invalid, which by default clears them from `devices`
+
+The wire format is FCM's legacy multicast API (registration_ids in, one
+result per token out). app/services/fcm_standin.py serves the same API
+locally for offline runs and tests.
+"""
+
+import asyncio
+import json
+import logging
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from anyio import to_thread
+
+from app.core.config import settings
+
+try:
+    import httpx
+except Exception:
+    httpx = None
+
+logger = logging.getLogger("push")
+logger.setLevel(logging.INFO)
+
+INVALID_TOKEN_ERRORS = {"NotRegistered", "InvalidRegistration", "MismatchSenderId", "MissingRegistration"}
+RETRYABLE_ERRORS = {"Unavailable", "InternalServerError", "DeviceMessageRateExceeded"}
+
+
+class _Message:
+    """One notification; `key` is its JSON, so identical messages share batches."""
+    __slots__ = ("payload", "key")
+
+    def __init__(self, title: str, body: str, data: Optional[Dict[str, Any]]):
+        self.payload = {"notification": {"title": title, "body": body}, "data": data or {}}
+        self.key = json.dumps(self.payload, sort_keys=True)
+
+
+# (message, token, attempts so far)
+_Item = Tuple[_Message, str, int]
+
+
+class PushDispatcher:
+    def __init__(
+        self,
+        endpoint: str,
+        server_key: Optional[str],
+        batch_size: int = 500,
+        window: float = 0.02,
+        concurrency: int = 4,
+        queue_size: int = 50_000,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60.0,
+        timeout: float = 10.0,
+        on_invalid: Optional[Callable[[List[str]], Awaitable[Any]]] = None,
+        transport=None,
+    ):
+        self.endpoint = endpoint
+        self.server_key = server_key
+        self.batch_size = max(1, min(batch_size, 1000))
+        self.window = window
+        self.concurrency = max(1, concurrency)
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.on_invalid = on_invalid if on_invalid is not None else _prune_invalid_tokens
+        self.transport = transport  # e.g. httpx.ASGITransport(fcm_standin.create_app())
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._client = None
+        self._inflight: set = set()
+        self._outstanding = 0      # tokens queued or being delivered
+        self._retries_pending = 0  # retry batches waiting out their backoff
+        self.queued = 0
+        self.requests = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.invalid = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.server_key) and httpx is not None
+
+    def configure(self, server_key: Optional[str] = None, endpoint: Optional[str] = None):
+        if server_key is not None:
+            self.server_key = server_key
+        if endpoint is not None:
+            self.endpoint = endpoint
+
+    # -------------------------
+    # Producer side
+    # -------------------------
+    def send(self, tokens: List[str], title: str, body: str, data: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Queue one notification for tokens; never blocks on the network.
+        Must be called from the event loop. Returns the number of tokens queued
+        (tokens beyond PUSH_QUEUE_SIZE are dropped and counted).
+        """
+        if not self.enabled:
+            logger.warning("Push not configured (FCM_SERVER_KEY / httpx missing); %d tokens skipped", len(tokens))
+            return 0
+        self._ensure_started()
+        msg = _Message(title, body, data)
+        n = 0
+        for token in dict.fromkeys(t for t in tokens if t):
+            if self._put((msg, token, 0)):
+                n += 1
+        self.queued += n
+        return n
+
+    def _put(self, item: _Item) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            self._outstanding += 1
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(maxsize=self.queue_size)
+            self._sem = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    # -------------------------
+    # Dispatcher
+    # -------------------------
+    async def _run(self):
+        while True:
+            items = [await self._queue.get()]
+            await asyncio.sleep(self.window)  # let concurrent sends join the batch
+            limit = self.batch_size * self.concurrency
+            while len(items) < limit and not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            groups: Dict[str, Tuple[_Message, List[Tuple[str, int]]]] = {}
+            for msg, token, attempt in items:
+                groups.setdefault(msg.key, (msg, []))[1].append((token, attempt))
+            for msg, entries in groups.values():
+                for i in range(0, len(entries), self.batch_size):
+                    await self._sem.acquire()  # bounded concurrency; backpressure on the gatherer
+                    task = asyncio.create_task(self._deliver(msg, entries[i:i + self.batch_size]))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._inflight.discard(task)
+        self._sem.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Push batch crashed", exc_info=task.exception())
+
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            )
+        return self._client
+
+    async def _deliver(self, msg: _Message, entries: List[Tuple[str, int]]):
+        try:
+            await self._deliver_batch(msg, entries)
+        finally:
+            self._outstanding -= len(entries)  # retries were re-counted by _retry
+
+    async def _deliver_batch(self, msg: _Message, entries: List[Tuple[str, int]]):
+        body = dict(msg.payload, registration_ids=[token for token, _ in entries])
+        self.requests += 1
+        try:
+            resp = await self._http().post(self.endpoint, json=body, headers={"Authorization": f"key={self.server_key}"})
+        except httpx.HTTPError as e:
+            logger.warning("Push request failed (%s); retrying %d tokens", e, len(entries))
+            self._retry(msg, entries, None)
+            return
+        if resp.status_code == 429 or resp.status_code >= 500:
+            self._retry(msg, entries, _retry_after(resp))
+            return
+        if resp.status_code != 200:
+            # 400 / 401: the request or server key is wrong; retrying won't help
+            logger.error("Push rejected with HTTP %d: %s", resp.status_code, resp.text[:200])
+            self.failed += len(entries)
+            return
+
+        results = resp.json().get("results") or []
+        invalid: List[str] = []
+        retry: List[Tuple[str, int]] = []
+        for (token, attempt), result in zip(entries, results):
+            error = result.get("error")
+            if not error:
+                self.delivered += 1
+            elif error in INVALID_TOKEN_ERRORS:
+                invalid.append(token)
+            elif error in RETRYABLE_ERRORS:
+                retry.append((token, attempt))
+            else:
+                self.failed += 1
+        if retry:
+            self._retry(msg, retry, _retry_after(resp))
+        if invalid:
+            self.invalid += len(invalid)
+            try:
+                await self.on_invalid(invalid)
+            except Exception:
+                logger.exception("Pruning %d invalid push tokens failed", len(invalid))
+
+    def backoff(self, attempt: int) -> float:
+        """Full jitter: uniform in [0, min(max, base * 2^attempt)]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _retry(self, msg: _Message, entries: List[Tuple[str, int]], retry_after: Optional[float]):
+        live = [(token, attempt + 1) for token, attempt in entries if attempt + 1 <= self.max_retries]
+        self.failed += len(entries) - len(live)
+        if not live:
+            return
+        attempt = max(a for _, a in live)
+        delay = max(retry_after or 0.0, self.backoff(attempt - 1))
+        self.retried += len(live)
+        self._retries_pending += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, msg, live)
+
+    def _requeue(self, msg: _Message, entries: List[Tuple[str, int]]):
+        self._retries_pending -= 1
+        for token, attempt in entries:
+            self._put((msg, token, attempt))
+
+    # -------------------------
+    # Lifecycle / introspection
+    # -------------------------
+    def idle(self) -> bool:
+        return self._outstanding == 0 and self._retries_pending == 0
+
+    async def drain(self, timeout: float = 30.0) -> bool:
+        """Wait until nothing is queued, in flight or waiting for a retry."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.idle():
+            if loop.time() > deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def stop(self, timeout: float = 5.0):
+        """Give queued pushes a moment to go out, then stop the dispatcher."""
+        if self._task is not None:
+            await self.drain(timeout)
+            self._task.cancel()
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": self.queued,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "in_flight": len(self._inflight),
+            "requests": self.requests,
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "failed": self.failed,
+            "invalid_pruned": self.invalid,
+            "dropped": self.dropped,
+        }
+
+
+def _retry_after(resp) -> Optional[float]:
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _clear_tokens_sync(tokens: List[str]) -> int:
+    from app.database import crud
+    from app.database.base import engine
+    from sqlmodel import Session
+    with Session(engine) as session:
+        return crud.clear_push_tokens_sql(session, tokens)
+
+
+async def _prune_invalid_tokens(tokens: List[str]):
+    n = await to_thread.run_sync(_clear_tokens_sync, tokens)
+    logger.info("Pruned %d invalid push tokens (%d devices)", len(tokens), n)
+
+
+push_dispatcher = PushDispatcher(
+    settings.FCM_ENDPOINT,
+    settings.FCM_SERVER_KEY,
+    batch_size=settings.PUSH_BATCH_SIZE,
+    window=settings.PUSH_BATCH_WINDOW_MS / 1000,
+    concurrency=settings.PUSH_CONCURRENCY,
+    queue_size=settings.PUSH_QUEUE_SIZE,
+    max_retries=settings.PUSH_MAX_RETRIES,
+    backoff_base=settings.PUSH_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.PUSH_BACKOFF_MAX_SECONDS,
+    timeout=settings.PUSH_TIMEOUT_SECONDS,
+)
@@ -2,6 +2,9 @@
 """
 Background scheduler for Zylos tasks.
 - cleanup memory daily
+- archive cold chat messages daily
+- trim the realtime outbox hourly
+- drop finished device commands past their retention hourly
 - rebuild index periodically (if requested)
 - trigger training jobs (when enough training items approved)
 This file is intended to be run as a background process (see run.sh)
@@ -13,6 +16,10 @@ from datetime import datetime, timedelta
 
 from app.ai.memory_engine import cleanup_memory, summarize_user_memory
 from app.ai.trainer import schedule_training
+from app.core.config import settings
+from app.database.archive import archive_old_messages
+from app.services.outbox import trim_expired as trim_outbox
+from app.services.command_queue import trim_finished as trim_commands
 from app.database.vector_store import vector_store
 
 logger = logging.getLogger("zylos.scheduler")
@@ -31,9 +38,32 @@ def run_scheduler(poll_seconds: int = DEFAULT_POLL_SECONDS):
             if (now - last_cleanup) > timedelta(days=1):
                 logger.info("Running daily memory cleanup...")
                 removed = cleanup_memory(max_age_days=365, keep_recent_per_user=200)
-                logger.info("Memory cleanup removed=%s users", removed)
+                logger.info("Memory cleanup removed=%s items", removed)
+                if settings.ARCHIVE_ENABLED:
+                    try:
+                        archived = archive_old_messages(settings.ARCHIVE_AFTER_DAYS)
+                        logger.info("Message archival moved=%s rows", archived)
+                    except Exception:
+                        logger.exception("Message archival failed")
                 last_cleanup = now
 
+            # OUTBOX RETENTION
+            if settings.OUTBOX_ENABLED:
+                try:
+                    trimmed = trim_outbox()
+                    if trimmed:
+                        logger.info("Outbox trim removed=%s entries", trimmed)
+                except Exception:
+                    logger.exception("Outbox trim failed")
+
+            # DEVICE COMMAND RETENTION
+            try:
+                trimmed = trim_commands()
+                if trimmed:
+                    logger.info("Device command trim removed=%s rows", trimmed)
+            except Exception:
+                logger.exception("Device command trim failed")
+
             # PERIODIC INDEX SAVE (if vector store exists)
             if vector_store and hasattr(vector_store, "save") and (now - last_index) > timedelta(hours=6):
                 try:
@@ -1,14 +1,17 @@
 # app/services/sync_manager.py
 """
 SyncManager: ensures the SAME reply is delivered to all devices of a user.
-If Redis is configured, publishes to Redis channel for multi-host delivery.
+Payloads are first recorded in the user's outbox (seq-stamped) so offline
+devices catch up on reconnect. If Redis is configured, publishes to Redis
+channel for multi-host delivery.
 """
 
 import asyncio
 import logging
 from typing import Dict
 
-from app.services import device_manager
+from app.services import device_manager, outbox
+from app.services.protocol import Frame
 from app.core.config import settings
 
 logger = logging.getLogger("sync_manager")
@@ -26,18 +29,25 @@ class SyncManager:
         """
         Push the same payload to all devices for user_id.
         Uses local WS manager and optionally publishes to Redis for other instances.
+        Every outbox-recorded payload (replies, in-app notifications) goes through
+        here: seq allocation and send happen under the user's lock, so live
+        frames leave in seq order and clients can trust gaps for resume.
         """
         lock = _user_locks.setdefault(user_id, asyncio.Lock())
         async with lock:
-            # First try local websocket delivery
+            # Durable first: offline devices replay it from the outbox
+            payload = await outbox.record(user_id, payload)
+            # one Frame for local sockets and the publish: serialized once per protocol
+            frame = Frame(payload)
+            # Then local websocket delivery
             try:
-                await self.ws_manager.send_personal(user_id, payload)
+                await self.ws_manager.send_frame(user_id, frame)
             except Exception:
                 logger.exception("Local push failed for user %s", user_id)
             # Then publish to Redis channel so other instances get it too
             try:
-                if self.redis_bridge and self.redis_bridge.redis_url:
-                    await self.redis_bridge.publish_user(user_id, payload)
+                if self.redis_bridge and self.redis_bridge.enabled:
+                    await self.redis_bridge.publish_frame(user_id, frame)
             except Exception:
                 logger.exception("Redis publish failed for user %s", user_id)
 
@@ -0,0 +1,26 @@
+# app/tests/test_ai.py
+import threading
+import time
+
+import pytest
+
+from app.ai import llm_local
+from app.ai.cancellation import CancelToken, GenerationCancelled, current_token
+
+
+def test_cancel_token_kills_llm_process(monkeypatch, tmp_path):
+    runner = tmp_path / "runner.sh"
+    runner.write_text("#!/bin/sh\nsleep 30\necho done\n")
+    runner.chmod(0o755)
+    monkeypatch.setattr(llm_local.settings, "MODEL_CLI_CMD", str(runner))
+
+    token = CancelToken()
+    reset = current_token.set(token)
+    threading.Timer(0.3, token.cancel).start()
+    t0 = time.time()
+    try:
+        with pytest.raises(GenerationCancelled):
+            llm_local.call_local_llm("hi", timeout=30)
+    finally:
+        current_token.reset(reset)
+    assert time.time() - t0 < 5
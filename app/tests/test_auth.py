@@ -0,0 +1,123 @@
+# app/tests/test_auth.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+from app.core import auth_cache, security
+from app.core.config import settings
+from app.core.hashing_pool import HashingPool, HashPoolBusy
+from app.database import crud
+
+
+def test_hashing_pool_rejects_over_capacity_and_frees_slots():
+    pool = HashingPool(workers=0, queue=1)  # one running + one waiting
+    gate = threading.Event()
+
+    def slow(x):
+        gate.wait(5)
+        return x * 2
+
+    async def run():
+        first = asyncio.ensure_future(pool.run(slow, 1))
+        second = asyncio.ensure_future(pool.run(slow, 2))
+        await asyncio.sleep(0.05)
+        assert pool.inflight == 2
+        with pytest.raises(HashPoolBusy):
+            await pool.run(slow, 3)
+        gate.set()
+        assert await asyncio.gather(first, second) == [2, 4]
+        # slots are back: the next call is admitted
+        assert await pool.run(slow, 5) == 10
+
+    asyncio.run(run())
+    assert pool.stats() == {"workers": 0, "capacity": 2, "inflight": 0, "completed": 3, "rejected": 1}
+
+
+class _BrokenExecutor:
+    def __init__(self, at_submit: bool):
+        self.at_submit = at_submit
+        self.submits = 0
+
+    def submit(self, fn, *args):
+        self.submits += 1
+        if self.at_submit:
+            raise BrokenProcessPool("worker died")
+        future = Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.mark.parametrize("at_submit", [True, False])
+def test_hashing_pool_falls_back_to_threadpool_when_broken(monkeypatch, at_submit):
+    pool = HashingPool(workers=1, queue=0)
+    executor = _BrokenExecutor(at_submit)
+    monkeypatch.setattr(pool, "_get_executor", lambda: executor)
+
+    # broken twice in a row: the call still succeeds, hashed in a thread
+    assert asyncio.run(pool.run(pow, 2, 10)) == 1024
+    assert executor.submits == 2
+    assert pool.inflight == 0 and pool.completed == 1
+
+
+def _auth_env(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'auth.db'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(settings, "MESSAGE_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "AUTH_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "AUTH_USER_CACHE_TTL_SECONDS", 60)
+    for cache in (auth_cache.tokens, auth_cache.users):
+        monkeypatch.setattr(cache, "_entries", OrderedDict())
+    monkeypatch.setattr(auth_cache, "_revoked", {})
+    lookups = []
+    real = crud.get_user_by_id_async
+
+    async def counted(session, user_id):
+        lookups.append(user_id)
+        return await real(session, user_id)
+
+    monkeypatch.setattr(crud, "get_user_by_id_async", counted)
+    return Session(engine), lookups
+
+
+def test_auth_cache_hits_expires_and_invalidates(monkeypatch, tmp_path):
+    session, lookups = _auth_env(monkeypatch, tmp_path)
+    now = [time.time()]
+    monkeypatch.setattr(auth_cache.time, "time", lambda: now[0])
+    user = crud.create_user(session, "a@b.c", "hash-1")
+    token = security.create_access_token(user.id)
+
+    async def resolve():
+        return await security.resolve_user(token, session)
+
+    async def run():
+        assert (await resolve()).id == user.id
+        assert (await resolve()).id == user.id
+        assert len(lookups) == 1  # second request: token and user both cached
+
+        # the snapshot expires after AUTH_USER_CACHE_TTL_SECONDS
+        now[0] += 61
+        await resolve()
+        assert len(lookups) == 2
+
+        # a user update drops the snapshot at once
+        await crud.update_user_async(session, user.id, name="Renamed")
+        assert (await resolve()).name == "Renamed"
+        assert len(lookups) == 3
+
+        # logout: the token is refused from now on, though its exp is hours away
+        security.revoke_access_token(token)
+        assert await resolve() is None
+        assert security.decode_token(token) == user.id
+
+    asyncio.run(run())
+    session.close()
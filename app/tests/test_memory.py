@@ -0,0 +1,704 @@
+# app/tests/test_memory.py
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app.core.config import settings
+from app.database.archive import _archive_batch_op, read_page_sql
+from app.database.message_cache import CachedMessage, RecentMessageIndex
+from app.database.crud import _page_stmt, encode_cursor, fts_query, get_messages_page_sql, search_messages_sql
+from app.database.migrations import MIGRATIONS, applied_versions, run_migrations
+from app.database.models import Conversation, Message, MessageArchive
+
+
+def _migrated_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plan.db'}")
+    SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    return engine
+
+
+def _plan(engine, stmt) -> str:
+    compiled = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return "\n".join(r[-1] for r in rows)
+
+
+def test_migrations_apply_once(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    assert applied_versions(engine) == [v for v, _, _ in MIGRATIONS]
+    assert run_migrations(engine) == []
+
+
+def test_last_messages_uses_composite_index(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    stmt = (
+        select(Message).where(Message.conversation_id == "c1")
+        .order_by(Message.timestamp.desc()).limit(10)
+    )
+    plan = _plan(engine, stmt)
+    assert "SEARCH messages USING INDEX ix_messages_conversation_ts_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_recent_user_messages_uses_composite_index(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    stmt = (
+        select(Message).where(Message.user_id == "u1")
+        .order_by(Message.timestamp.desc()).limit(30)
+    )
+    plan = _plan(engine, stmt)
+    assert "SEARCH messages USING INDEX ix_messages_user_ts_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_keyset_page_uses_index_without_sort(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    last = Message(conversation_id="c1", role="user", text="x")
+    for ascending in (False, True):
+        stmt = _page_stmt("conversation_id", "c1", 50, encode_cursor(last), ascending=ascending)
+        plan = _plan(engine, stmt)
+        assert "USING INDEX ix_messages_conversation_ts_id" in plan
+        assert "TEMP B-TREE" not in plan
+
+
+def test_fts_search_is_ranked_scoped_and_synced(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    with Session(engine) as session:
+        mine, other = Conversation(user_id="u1"), Conversation(user_id="u2")
+        session.add_all([mine, other])
+        session.add_all([
+            Message(conversation_id=mine.id, user_id="u1", role="user", text="my router password is hunter2"),
+            Message(conversation_id=mine.id, role="zylos", text="router reboot done, router is back online"),
+            Message(conversation_id=other.id, user_id="u2", role="user", text="router for user two"),
+        ])
+        session.commit()
+
+        hits = search_messages_sql(session, "u1", "router")
+        assert [h["role"] for h in hits] == ["zylos", "user"]  # two matches rank above one
+        assert "<b>router</b>" in hits[0]["snippet"]
+        assert search_messages_sql(session, "u1", "pass", prefix=True)[0]["role"] == "user"
+
+        session.exec(Message.__table__.delete().where(Message.role == "zylos"))
+        session.commit()
+        assert [h["role"] for h in search_messages_sql(session, "u1", "router")] == ["user"]
+
+
+def test_lexical_memory_skips_prompt_history(tmp_path, monkeypatch):
+    from app.ai import memory_engine
+    from app.database import base
+
+    engine = _migrated_engine(tmp_path)
+    monkeypatch.setattr(base, "engine", engine)
+    with Session(engine) as session:
+        conv = Conversation(user_id="u1")
+        old = Message(conversation_id=conv.id, user_id="u1", role="user", text="my wifi router is a netgear")
+        recent = Message(conversation_id=conv.id, role="zylos", text="router noted")
+        current = Message(conversation_id=conv.id, user_id="u1", role="user", text="which router do I have?")
+        session.add_all([conv, old, recent, current])
+        session.commit()
+        ids = [recent.id, current.id]
+
+    hits = memory_engine.lexical_search("u1", "which router do I have?", k=5, exclude_ids=ids)
+    assert hits == ["my wifi router is a netgear"]
+    # the query itself never comes back as a "past message"
+    assert "which router do I have?" not in memory_engine.lexical_search("u1", "which router do I have?")
+
+
+
+def _plain(value):
+    # comparable form of crud results: models -> dicts, containers recursively
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def test_async_crud_matches_sync_and_keeps_the_loop_free(tmp_path, monkeypatch):
+    import time
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from app.database import crud
+
+    engine = _migrated_engine(tmp_path)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'plan.db'}")
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(settings, "MESSAGE_CACHE_ENABLED", False)
+
+    async def run():
+        with Session(engine, expire_on_commit=False) as sync_s:
+            async with AsyncSession(async_engine, expire_on_commit=False) as async_s:
+                async def both(fn, *args, **kwargs):
+                    # the same call through the threadpool (sync session) and the async driver;
+                    # each session has to re-read what the other one wrote
+                    sync_s.expunge_all()
+                    async_s.expunge_all()
+                    a = _plain(await fn(sync_s, *args, **kwargs))
+                    b = _plain(await fn(async_s, *args, **kwargs))
+                    assert a == b, fn.__name__
+                    return a
+
+                # writes through either path are visible to both
+                u1 = await crud.create_user_async(sync_s, "one@x.io", "h1")
+                u2 = await crud.create_user_async(async_s, "two@x.io", "h2", name="Two")
+                assert (await both(crud.get_user_by_email_async, "two@x.io"))["id"] == u2.id
+                await crud.update_user_async(async_s, u1.id, name="One")
+                assert (await both(crud.get_user_by_id_async, u1.id))["name"] == "One"
+
+                conv = await crud.get_or_create_conv_async(sync_s, u1.id)
+                assert (await crud.get_or_create_conv_async(async_s, u1.id)).id == conv.id
+                await crud.add_message_async(sync_s, conv.id, "user", "hello world", user_id=u1.id)
+                await crud.add_message_async(async_s, conv.id, "user", "hello again", user_id=u1.id)
+                assert len(await both(crud.get_last_messages_async, conv.id, 10)) == 2
+                await both(crud.get_recent_user_messages_async, u1.id, 10)
+                for ascending in (True, False):
+                    await both(crud.get_messages_page_async, "user_id", u1.id, 1, None, ascending)
+                assert len(await both(crud.search_messages_async, u1.id, "hello")) == 2
+                await both(crud.get_conversations_for_user_async, u1.id)
+                await both(crud.get_conversation_async, conv.id)
+
+                d1 = await crud.register_device_async(sync_s, u1.id, "phone", "android", "t1")
+                await crud.register_device_async(async_s, u1.id, "laptop", "web", "t2")
+                assert len(await both(crud.get_devices_for_user_async, u1.id)) == 2
+                await crud.set_device_push_token_async(async_s, u1.id, d1.id, "push-1")
+                assert await both(crud.get_push_tokens_async, [u1.id, u2.id]) == ["push-1"]
+
+                crud.append_outbox_sql(sync_s, u1.id, "{}")
+                assert await both(crud.get_outbox_bounds_async, u1.id) == [1, 1]
+                assert len(await both(crud.get_outbox_after_async, u1.id, 0)) == 1
+
+                # a slow sync-path query runs in a worker thread; the loop keeps ticking
+                slow_sql = crud.get_user_by_id_sql
+                monkeypatch.setattr(crud, "get_user_by_id_sql", lambda s, uid: (time.sleep(0.2), slow_sql(s, uid))[1])
+                ticks = 0
+
+                async def ticker():
+                    nonlocal ticks
+                    while True:
+                        ticks += 1
+                        await asyncio.sleep(0.01)
+
+                task = asyncio.ensure_future(ticker())
+                assert (await crud.get_user_by_id_async(sync_s, u2.id)).id == u2.id
+                task.cancel()
+                assert ticks >= 5
+        await async_engine.dispose()
+
+    asyncio.run(run())
+
+def test_fts_query_neutralises_operators():
+    assert fts_query('router" OR NEAR(x') == '"router" "OR" "NEAR" "x"'
+    assert fts_query("a b", match_any=True, prefix=True) == '"a" OR "b"*'
+    assert fts_query("  ?! ") is None
+
+
+def test_archived_messages_page_through_transparently(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    start = datetime(2024, 1, 30)
+    with Session(engine) as session:
+        conv = Conversation(user_id="u1")
+        session.add(conv)
+        session.add_all([
+            Message(conversation_id=conv.id, user_id="u1", role="user", text=f"m{i}", timestamp=start + timedelta(days=i))
+            for i in range(6)
+        ])
+        session.commit()
+        # days 0-3 span two months -> two segments; days 4-5 stay hot
+        assert _archive_batch_op(conv.id, "u1", start + timedelta(days=4), 100)(session) == 4
+        session.commit()
+        assert len(session.exec(select(Message)).all()) == 2
+
+        newest_first, cursor = [], None
+        while True:
+            page = get_messages_page_sql(session, "conversation_id", conv.id, limit=4, cursor=cursor)
+            newest_first += [m.text for m in page]
+            if len(page) < 4:
+                break
+            cursor = encode_cursor(page[-1])
+        assert newest_first == [f"m{i}" for i in reversed(range(6))]
+
+        page = get_messages_page_sql(session, "user_id", "u1", limit=3, ascending=True)
+        assert [m.text for m in page] == ["m0", "m1", "m2"]
+        page = get_messages_page_sql(session, "user_id", "u1", limit=3, cursor=encode_cursor(page[-1]), ascending=True)
+        assert [m.text for m in page] == ["m3", "m4", "m5"]
+
+
+
+def test_repeated_archival_tops_up_the_month_segment(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "ARCHIVE_SEGMENT_ROWS", 5)
+    engine = _migrated_engine(tmp_path)
+    start = datetime(2024, 5, 1)
+    with Session(engine) as session:
+        conv = Conversation(user_id="u1")
+        session.add(conv)
+        session.add_all([
+            Message(conversation_id=conv.id, user_id="u1", role="user", text=f"m{i}", timestamp=start + timedelta(days=i))
+            for i in range(8)
+        ])
+        session.commit()
+        # two daily runs over the same month end up in one segment
+        for day in (2, 4):
+            assert _archive_batch_op(conv.id, "u1", start + timedelta(days=day), 100)(session) == 2
+            session.commit()
+        [seg] = session.exec(select(MessageArchive)).all()
+        assert seg.count == 4 and seg.first_ts == start and seg.last_ts == start + timedelta(days=3)
+
+        # past ARCHIVE_SEGMENT_ROWS the rest overflows into a new segment
+        assert _archive_batch_op(conv.id, "u1", start + timedelta(days=7), 100)(session) == 3
+        session.commit()
+        assert sorted(s.count for s in session.exec(select(MessageArchive)).all()) == [2, 5]
+        page = read_page_sql(session, "conversation_id", conv.id, 10, None, True)
+        assert [m.text for m in page] == [f"m{i}" for i in range(7)]
+
+
+def test_archived_user_pages_merge_overlapping_conversations(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    start = datetime(2024, 3, 1)
+    with Session(engine) as session:
+        convs = [Conversation(user_id="u1"), Conversation(user_id="u1")]
+        session.add_all(convs)
+        # the two conversations interleave: a0 b0 a1 b1 ...
+        session.add_all([
+            Message(conversation_id=conv.id, user_id="u1", role="user", text=f"{name}{i}",
+                    timestamp=start + timedelta(hours=2 * i + offset))
+            for offset, (name, conv) in enumerate(zip("ab", convs))
+            for i in range(4)
+        ])
+        session.commit()
+        for conv in convs:
+            assert _archive_batch_op(conv.id, "u1", start + timedelta(days=1), 100)(session) == 4
+        session.commit()
+
+        expected = [f"{name}{i}" for i in range(4) for name in "ab"]
+        for ascending in (True, False):
+            seen, cursor = [], None
+            while True:
+                page = get_messages_page_sql(session, "user_id", "u1", limit=3, cursor=cursor, ascending=ascending)
+                seen += [m.text for m in page]
+                if len(page) < 3:
+                    break
+                cursor = encode_cursor(page[-1])
+            assert seen == (expected if ascending else expected[::-1])
+
+def _fresh_memory(monkeypatch, tmp_path):
+    """memory_engine with empty stores persisted under tmp_path."""
+    from app.ai import memory_engine
+
+    for name in ("LONG_PATH", "MID_PATH", "KG_PATH"):
+        monkeypatch.setattr(memory_engine, name, str(tmp_path / f"{name.lower()}.json"))
+    monkeypatch.setattr(memory_engine, "_short_memory", memory_engine.OrderedDict())
+    monkeypatch.setattr(memory_engine, "_short_item_count", 0)
+    monkeypatch.setattr(memory_engine, "_mid_cache", {})
+    monkeypatch.setattr(memory_engine, "_mid_view", {})
+    monkeypatch.setattr(memory_engine, "_long_cache", {})
+    monkeypatch.setattr(memory_engine, "_summary_backoff", {})
+    return memory_engine
+
+
+
+def test_short_memory_ring_buffer_and_eviction(monkeypatch, tmp_path):
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    now = [1000.0]
+    monkeypatch.setattr(memory.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(memory.settings, "SHORT_TERM_MEMORY_LIMIT", 3)
+    monkeypatch.setattr(memory.settings, "SHORT_TERM_IDLE_TTL_SECONDS", 60)
+    monkeypatch.setattr(memory.settings, "SHORT_TERM_MAX_CONVERSATIONS", 2)
+    monkeypatch.setattr(memory.settings, "SHORT_TERM_MAX_ITEMS", 5)
+
+    # the ring buffer keeps the newest turns, oldest -> newest
+    for i in range(5):
+        memory.add_short_memory("a", {"text": f"a{i}"})
+    assert [it["text"] for it in memory.retrieve_short("a")] == ["a2", "a3", "a4"]
+    assert [it["text"] for it in memory.retrieve_short("a", limit=2)] == ["a3", "a4"]
+    assert memory._short_item_count == 3
+
+    # conversation cap: the least recently used buffer goes first
+    memory.add_short_memory("b", {"text": "b0"})
+    memory.retrieve_short("a")
+    memory.add_short_memory("c", {"text": "c0"})
+    assert list(memory._short_memory) == ["a", "c"]
+
+    # item cap: evicting "a" brings the count back under 5
+    memory.add_short_memory("c", {"text": "c1"})
+    memory.add_short_memory("c", {"text": "c2"})
+    assert list(memory._short_memory) == ["c"] and memory._short_item_count == 3
+
+    # idle TTL: expired on read, and swept by the next write
+    now[0] += 61
+    assert memory.retrieve_short("c") == []
+    memory.add_short_memory("d", {"text": "d0"})
+    now[0] += 30
+    memory.add_short_memory("e", {"text": "e0"})
+    now[0] += 31
+    memory.add_short_memory("f", {"text": "f0"})
+    assert list(memory._short_memory) == ["e", "f"] and memory._short_item_count == 2
+
+def test_failed_summaries_keep_pending_turns(monkeypatch, tmp_path):
+    from app.ai import llm_local
+
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    monkeypatch.setattr(llm_local.settings, "MODEL_CLI_CMD", "/bin/false")
+    monkeypatch.setattr(memory.settings, "SUMMARY_FANOUT", 2)
+    memory._mid_state("u1")["pending"][:] = ["turn 1", "turn 2"]
+
+    memory.summarize_user_memory("u1")
+    assert memory._mid_cache["u1"]["pending"] == ["turn 1", "turn 2"]
+    assert memory.get_mid_memory("u1") == []
+
+    # a full level stays put when the merge call fails
+    memory.add_mid_memory("u1", "leaf a")
+    memory.add_mid_memory("u1", "leaf b")
+    assert [e["summary"] for e in memory._mid_cache["u1"]["levels"][0]] == ["leaf a", "leaf b"]
+    assert memory.get_mid_memory("u1") == ["leaf a", "leaf b"]
+
+
+def test_cancelled_summary_restores_pending_turns(monkeypatch, tmp_path):
+    from app.ai.cancellation import GenerationCancelled
+
+    memory = _fresh_memory(monkeypatch, tmp_path)
+
+    def cancelled(*args, **kwargs):
+        raise GenerationCancelled()
+
+    monkeypatch.setattr(memory, "summarize_text", cancelled)
+    memory._mid_state("u1")["pending"][:] = ["turn 1"]
+    with pytest.raises(GenerationCancelled):
+        memory.summarize_user_memory("u1")
+    assert memory._mid_cache["u1"]["pending"] == ["turn 1"]
+
+
+def test_failing_summaries_back_off_and_cap_pending_turns(monkeypatch, tmp_path):
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    now = [1000.0]
+    calls = []
+    replies = ["[LLM error] down"]
+
+    def summarize(text, **kwargs):
+        calls.append(text)
+        return replies[0]
+
+    monkeypatch.setattr(memory.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(memory, "summarize_text", summarize)
+    monkeypatch.setattr(memory, "add_long_memory", lambda *args, **kwargs: {})
+    monkeypatch.setattr(memory.settings, "SUMMARIZE_MEMORY_INTERVAL", 2)
+    monkeypatch.setattr(memory.settings, "SUMMARY_MAX_PENDING", 4)
+    monkeypatch.setattr(memory.settings, "SUMMARY_RETRY_SECONDS", 60)
+    monkeypatch.setattr(memory.settings, "SUMMARY_RETRY_MAX_SECONDS", 100)
+
+    # the first failure starts a back-off: later turns don't call the LLM again
+    for i in range(6):
+        memory.add_memory_item("u1", f"q{i}", f"a{i}")
+    assert len(calls) == 1
+    assert memory._summary_backoff["u1"] == (1060.0, 60)
+
+    # pending keeps only the newest SUMMARY_MAX_PENDING turns
+    pending = memory._mid_cache["u1"]["pending"]
+    assert len(pending) == 4 and "q2" in pending[0] and "q5" in pending[-1]
+
+    # retried once the delay has passed; a second failure doubles it, up to the cap
+    now[0] += 60
+    memory.add_memory_item("u1", "q6", "a6")
+    assert len(calls) == 2
+    assert memory._summary_backoff["u1"] == (1160.0, 100)
+    assert len(memory._mid_cache["u1"]["pending"]) == 4
+
+    # a success summarizes what is left and clears the back-off
+    replies[0] = "summary"
+    now[0] += 100
+    memory.summarize_user_memory("u1")
+    assert "u1" not in memory._summary_backoff
+    assert memory._mid_cache["u1"]["pending"] == []
+    assert memory.get_mid_memory("u1") == ["summary"]
+
+
+
+
+def test_long_memory_dedup_window(monkeypatch, tmp_path):
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    monkeypatch.setattr(memory, "_dedup_stats", {"checked": 0, "merged": 0, "embed_checks": 0})
+    monkeypatch.setattr(memory.settings, "MEMORY_DEDUP_ENABLED", True)
+    monkeypatch.setattr(memory.settings, "MEMORY_DEDUP_WINDOW", 2)
+    fact = "my favourite drink is green tea with honey in the morning"
+
+    first = memory.add_long_memory("u1", {"text": fact})
+    # case / punctuation changes are the same SimHash; a changed word is not
+    assert memory.add_long_memory("u1", {"text": "My favourite drink is green tea, with honey in the morning!"}) is first
+    assert first["count"] == 2 and "last_seen" in first
+    other = memory.add_long_memory("u1", {"text": fact.replace("morning", "evening")})
+    assert other is not first
+
+    # only the newest MEMORY_DEDUP_WINDOW items are compared
+    memory.add_long_memory("u1", {"text": "the car is parked on level three"})
+    memory.add_long_memory("u1", {"text": "dentist appointment moved to friday"})
+    again = memory.add_long_memory("u1", {"text": fact})
+    assert again is not first and again["count"] == 1
+    assert len(memory.get_long_memory("u1")) == 5
+    assert memory.get_dedup_stats()["merged"] == 1
+
+def test_merged_duplicate_moves_to_last_seen_month(monkeypatch, tmp_path):
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    now = datetime.utcnow()
+    old = (now - timedelta(days=400)).isoformat() + "Z"
+    recent = (now - timedelta(days=10)).isoformat() + "Z"
+
+    first = memory.add_long_memory("u1", {"text": "my favourite drink is green tea", "ts": old})
+    memory.add_long_memory("u1", {"text": "the car is parked on level three", "ts": old})
+    merged = memory.add_long_memory("u1", {"text": "my favourite drink is green tea", "ts": recent})
+    assert merged is first and merged["count"] == 2
+    buckets = memory._long_cache["u1"]
+    assert buckets[recent[:7]] == [first]
+    assert [e["text"] for e in buckets[old[:7]]] == ["the car is parked on level three"]
+
+    # the repeated fact outlives its first-seen month; the stale one expires
+    assert memory.cleanup_memory(max_age_days=365) == 1
+    assert [e["text"] for e in memory.get_long_memory("u1")] == ["my favourite drink is green tea"]
+
+
+def test_cleanup_memory_expires_buckets_with_per_user_floor(monkeypatch, tmp_path):
+    memory = _fresh_memory(monkeypatch, tmp_path)
+    monkeypatch.setattr(memory.settings, "MEMORY_DEDUP_ENABLED", False)
+    now = datetime.utcnow()
+    for user, ages in (("u1", (500, 500, 450, 5)), ("u2", (500,))):
+        for n, days in enumerate(ages):
+            ts = (now - timedelta(days=days)).isoformat() + "Z"
+            memory.add_long_memory(user, {"text": f"{user} fact {n}", "ts": ts})
+
+    # the floor keeps each user's 3 newest: the oldest month of u1 is cut mid-bucket
+    assert memory.cleanup_memory(max_age_days=365, keep_recent_per_user=3) == 1
+    assert [e["text"] for e in memory.get_long_memory("u1")] == ["u1 fact 1", "u1 fact 2", "u1 fact 3"]
+    assert [e["text"] for e in memory.get_long_memory("u2")] == ["u2 fact 0"]
+
+    # without it, expired months go whole and an emptied user is dropped
+    assert memory.cleanup_memory(max_age_days=365) == 3
+    assert [e["text"] for e in memory.get_long_memory("u1")] == ["u1 fact 3"]
+    assert "u2" not in memory._long_cache
+
+def _cached(n: int, key: str = "c1") -> CachedMessage:
+    return CachedMessage(f"m{n}", key, "u1", "user", f"text {n}", datetime(2024, 1, 1) + timedelta(minutes=n))
+
+
+def test_message_cache_hit_miss_append_and_invalidate():
+    index = RecentMessageIndex(per_key=4, max_keys=2)
+    assert index.get("c1", 2) is None  # never seen -> miss
+
+    index.fill("c1", [_cached(1), _cached(2)], requested=4, stamp=index.begin_fill("c1"))
+    assert [m.id for m in index.get("c1", 10)] == ["m1", "m2"]  # complete: short history is a hit
+
+    # write-through after the fill; the window slides once full
+    for n in (3, 4, 5):
+        index.append("c1", _cached(n))
+    assert [m.id for m in index.get("c1", 4)] == ["m2", "m3", "m4", "m5"]
+    assert index.get("c1", 5) is None  # older rows exist only in the DB now
+
+    index.invalidate("c1")
+    assert index.get("c1", 1) is None
+    assert (index.hits, index.misses) == (2, 3)
+
+
+def test_message_cache_windows_expire():
+    now = [100.0]
+    index = RecentMessageIndex(per_key=4, max_keys=2, ttl=30, clock=lambda: now[0])
+    index.fill("c1", [_cached(1)], requested=4, stamp=index.begin_fill("c1"))
+    now[0] += 29
+    index.append("c1", _cached(2))  # appends don't extend the window's life
+    assert [m.id for m in index.get("c1", 4)] == ["m1", "m2"]
+    # e.g. archived by another process: the window is re-read from the DB
+    now[0] += 1
+    assert index.get("c1", 1) is None
+
+
+def test_message_cache_exhausted_flag():
+    index = RecentMessageIndex(per_key=2, max_keys=4)
+    index.prime_empty("new")
+    assert index.is_exhausted("new")  # a new conversation has nothing anywhere
+
+    index.fill("c1", [_cached(1)], requested=2, stamp=index.begin_fill("c1"))
+    assert not index.is_exhausted("c1")  # hot rows complete; the archive is unknown
+    index.mark_exhausted("c1")
+    index.append("c1", _cached(2))
+    assert index.is_exhausted("c1")
+    index.append("c1", _cached(3))  # the window slides: m1 is only in the DB now
+    assert not index.is_exhausted("c1")
+    index.mark_exhausted("c1")  # ignored for an incomplete window
+    assert not index.is_exhausted("c1")
+
+def test_message_cache_refuses_fill_raced_by_append():
+    index = RecentMessageIndex(per_key=4, max_keys=2)
+    stamp = index.begin_fill("c1")
+    rows = [_cached(1)]                  # DB read done...
+    index.append("c1", _cached(2))       # ...then a message is committed (key not tracked yet)
+    index.fill("c1", rows, requested=4, stamp=stamp)
+    assert index.get("c1", 1) is None and index.stale_fills == 1
+
+    # the retry reads both rows and sticks
+    index.fill("c1", [_cached(1), _cached(2)], requested=4, stamp=index.begin_fill("c1"))
+    assert [m.id for m in index.get("c1", 4)] == ["m1", "m2"]
+
+    # an invalidation during a read also voids it
+    stamp = index.begin_fill("c2")
+    index.invalidate("c2")
+    index.fill("c2", [_cached(1, "c2")], requested=4, stamp=stamp)
+    assert index.get("c2", 1) is None
+
+
+def test_message_cache_stays_off_across_workers(tmp_path, monkeypatch):
+    from app.database import crud, message_cache
+
+    engine = _migrated_engine(tmp_path)
+    monkeypatch.setattr(message_cache, "by_conversation", RecentMessageIndex(per_key=10, max_keys=10))
+    monkeypatch.setattr(settings, "REDIS_URL", None)
+    with Session(engine) as session:
+        conv = Conversation(user_id="u1")
+        session.add(conv)
+        session.add(Message(conversation_id=conv.id, user_id="u1", role="user", text="first"))
+        session.commit()
+
+        def other_worker_writes(text):
+            # a commit made by another process: no write-through into this cache
+            session.add(Message(conversation_id=conv.id, user_id="u1", role="user", text=text))
+            session.commit()
+
+        # single process: the cache serves the window
+        monkeypatch.setattr(settings, "PUBSUB_BACKEND", "auto")
+        assert message_cache.enabled()
+        assert len(crud.get_last_messages(session, conv.id, 10)) == 1
+        other_worker_writes("second")
+        assert len(crud.get_last_messages(session, conv.id, 10)) == 1
+
+        # workers sharing a unix / redis bridge: every read goes to the DB
+        for backend, url in (("unix", None), ("redis", "redis://localhost:6379/0")):
+            monkeypatch.setattr(settings, "PUBSUB_BACKEND", backend)
+            monkeypatch.setattr(settings, "REDIS_URL", url)
+            assert not message_cache.enabled()
+        other_worker_writes("third")
+        assert [m.text for m in crud.get_last_messages(session, conv.id, 10)] == ["first", "second", "third"]
+
+
+def test_batch_writer_group_commit_isolates_bad_row(tmp_path, monkeypatch):
+    from sqlalchemy.exc import IntegrityError
+    from app.database import writer
+
+    engine = _migrated_engine(tmp_path)
+    monkeypatch.setattr(writer, "engine", engine)
+    w = writer.BatchWriter(max_batch=50, max_delay_ms=200)
+    conv = Conversation(user_id="u1")
+    try:
+        w.add(conv).result(5)
+
+        # one group commit for a burst of writes
+        futs = [w.add(Message(conversation_id=conv.id, role="user", text=f"ok {i}")) for i in range(3)]
+        assert [f.result(5).text for f in futs] == ["ok 0", "ok 1", "ok 2"]
+        assert w.batches == 2 and w.writes == 4
+
+        # a duplicate primary key fails the batch; the retry commits the rest one by one
+        dup = Message(id=futs[0].result().id, conversation_id=conv.id, role="user", text="dup")
+        good = [Message(conversation_id=conv.id, role="user", text=f"after {i}") for i in range(2)]
+        bad_fut = w.add(dup)
+        good_futs = [w.add(m) for m in good]
+        with pytest.raises(IntegrityError):
+            bad_fut.result(5)
+        assert [f.result(5).text for f in good_futs] == ["after 0", "after 1"]
+
+        # submit_async surfaces the op's exception to the awaiting coroutine
+        def failing(session):
+            raise ValueError("bad op")
+
+        async def run():
+            with pytest.raises(ValueError, match="bad op"):
+                await w.submit_async(failing)
+            return await w.submit_async(lambda s: "ok")
+        assert asyncio.run(run()) == "ok"
+    finally:
+        w.stop()
+
+    with Session(engine) as session:
+        texts = sorted(m.text for m in session.exec(select(Message)).all())
+    assert texts == ["after 0", "after 1", "ok 0", "ok 1", "ok 2"]
+
+
+def test_history_routes_skip_known_empty_top_up_and_export_streams(tmp_path, monkeypatch):
+    import contextlib
+    import json
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import routes_memory
+    from app.core.security import get_current_user
+    from app.database import crud, message_cache
+    from app.database.base import get_async_session
+    from app.database.models import User
+
+    engine = _migrated_engine(tmp_path)
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(settings, "MESSAGE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "PUBSUB_BACKEND", "inprocess")
+    monkeypatch.setattr(settings, "EXPORT_BATCH_SIZE", 2)
+    monkeypatch.setattr(message_cache, "by_conversation", RecentMessageIndex(per_key=10, max_keys=10))
+    monkeypatch.setattr(message_cache, "by_user", RecentMessageIndex(per_key=10, max_keys=10))
+
+    start = datetime(2024, 2, 1)
+    with Session(engine) as session:
+        archived, live = Conversation(user_id="u1"), Conversation(user_id="u1")
+        session.add_all([archived, live])
+        session.add_all([
+            Message(conversation_id=archived.id, user_id="u1", role="user", text=f"a{i}", timestamp=start + timedelta(days=i))
+            for i in range(5)
+        ] + [
+            Message(conversation_id=live.id, user_id="u1", role="user", text=f"b{i}", timestamp=start + timedelta(days=10 + i))
+            for i in range(3)
+        ])
+        session.commit()
+        assert _archive_batch_op(archived.id, "u1", start + timedelta(days=3), 100)(session) == 3
+        session.commit()
+        ids = {"archived": archived.id, "live": live.id}
+
+    def db_session():
+        with Session(engine, expire_on_commit=False) as session:
+            yield session
+
+    @contextlib.asynccontextmanager
+    async def open_session():
+        with Session(engine, expire_on_commit=False) as session:
+            yield session
+
+    pages = []
+    real_page = crud.get_messages_page_async
+
+    async def counted_page(*args, **kwargs):
+        pages.append(args[2])
+        return await real_page(*args, **kwargs)
+
+    monkeypatch.setattr(crud, "get_messages_page_async", counted_page)
+    monkeypatch.setattr(routes_memory, "open_async_session", open_session)
+    app = FastAPI()
+    app.include_router(routes_memory.router)
+    app.dependency_overrides[get_async_session] = db_session
+    app.dependency_overrides[get_current_user] = lambda: User(id="u1", email="u1@x.io", password_hash="-")
+    client = TestClient(app)
+
+    def history(conv_id):
+        body = client.get("/memory/history", params={"conversation_id": conv_id, "limit": 10}).json()
+        return [m["text"] for m in body["history"]]
+
+    # a short history with nothing archived: one top-up finds nothing, later pages skip it
+    assert history(ids["live"]) == ["b2", "b1", "b0"]
+    assert history(ids["live"]) == ["b2", "b1", "b0"]
+    assert pages == [ids["live"]]
+    # archived rows are still read behind the cached hot rows every time
+    assert history(ids["archived"]) == ["a4", "a3", "a2", "a1", "a0"]
+    assert history(ids["archived"]) == ["a4", "a3", "a2", "a1", "a0"]
+
+    with client.stream("GET", "/memory/export") as resp:
+        assert resp.status_code == 200
+        body = "".join(resp.iter_text())
+    assert body.endswith("\n")
+    rows = [json.loads(line) for line in body.splitlines()]
+    by_conv = {}
+    for row in rows:
+        by_conv.setdefault(row["conversation_id"], []).append(row["text"])
+    # oldest first, archive then live table, batch boundaries neither skip nor repeat
+    assert by_conv == {ids["archived"]: [f"a{i}" for i in range(5)], ids["live"]: ["b0", "b1", "b2"]}
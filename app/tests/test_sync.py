@@ -0,0 +1,470 @@
+# app/tests/test_sync.py
+import asyncio
+import contextlib
+import json
+from datetime import datetime, timedelta
+
+import httpx
+from sqlmodel import Session, SQLModel, create_engine, select, update
+
+from app.core.config import settings
+from app.database import base, crud
+from app.database.models import Device, OutboxEntry
+from app.services import command_queue, fcm_standin, outbox
+from app.services.device_manager import InMemoryWSManager, PresenceTable, PubSubBridge
+from app.services.protocol import JSON, MSGPACK, Frame, negotiate, supported
+from app.services.pubsub import InProcessBackend, LocalBroker, UnixSocketBackend
+from app.services.push import PushDispatcher
+
+
+class _FakeSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def accept(self, subprotocol=None):
+        self.subprotocol = subprotocol
+
+    async def send_text(self, msg):
+        self.frames.append(msg)
+
+    async def send_bytes(self, msg):
+        self.frames.append(msg)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def _instance(broker, shards=0):
+    backend = broker if not isinstance(broker, LocalBroker) else InProcessBackend(broker)
+    manager = InMemoryWSManager(queue_size=64, policy="disconnect")
+    bridge = PubSubBridge(backend, manager=manager, shards=shards)
+    await bridge.start()
+    return manager, bridge
+
+
+async def _settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_bridge_targets_connected_users_and_drops_echo():
+    async def run():
+        broker = LocalBroker()
+        (m1, b1), (m2, b2) = await _instance(broker), await _instance(broker)
+        s1, s2 = _FakeSocket(), _FakeSocket()
+        await m1.connect("alice", s1)
+        await m2.connect("alice", s2)
+        await _settle()
+
+        # what SyncManager does on instance 1: deliver locally, then publish
+        await m1.send_personal("alice", {"type": "reply", "n": 1})
+        await b1.publish_user("alice", {"type": "reply", "n": 1})
+        await _settle()
+        assert len(s1.frames) == 1 and len(s2.frames) == 1
+        assert b1.echoes_dropped == 1 and b2.delivered == 1
+
+        # nobody is subscribed to a user without local sockets
+        assert await broker.client().publish(b1.channel_for("bob"), "{}") == 0
+
+        conn_id = next(iter(m2.connections))
+        await m2.disconnect(conn_id)
+        await _settle()
+        assert b2.channel_for("alice") not in b2._sub.channels
+        await b1.stop()
+        await b2.stop()
+
+    asyncio.run(run())
+
+
+def test_bridge_shards_filter_to_local_users():
+    async def run():
+        broker = LocalBroker()
+        (m1, b1), (m2, b2) = await _instance(broker, shards=1), await _instance(broker, shards=1)
+        s2 = _FakeSocket()
+        await m2.connect("alice", s2)
+        await m1.connect("bob", _FakeSocket())
+        await _settle()
+        await b1.publish_user("carol", {"type": "reply"})
+        await b1.publish_user("alice", {"type": "reply"})
+        await _settle()
+        assert len(s2.frames) == 1 and b2.delivered == 1
+        await b1.stop()
+        await b2.stop()
+
+    asyncio.run(run())
+
+
+def test_bridge_over_unix_socket_broker(tmp_path):
+    async def run():
+        path = str(tmp_path / "ps.sock")
+        (m1, b1), (m2, b2) = await _instance(UnixSocketBackend(path)), await _instance(UnixSocketBackend(path))
+        assert b1.backend.broker is not None and b2.backend.broker is None  # one owner per path
+        s2 = _FakeSocket()
+        await m2.connect("alice", s2)
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if b1.backend.broker._subs.get(b2.channel_for("alice")):
+                break
+        await b1.publish_user("alice", {"type": "reply", "text": "héllo"})
+        for _ in range(50):
+            await asyncio.sleep(0.01)
+            if s2.frames:
+                break
+        assert s2.frames and json.loads(s2.frames[0])["text"] == "héllo"
+        await b2.stop()
+        await b1.stop()
+
+    asyncio.run(run())
+
+
+def test_frame_encodes_once_and_negotiates():
+    frame = Frame({"type": "typing", "text": "hi"})
+    assert frame.key == "typing"
+    assert frame.encode(JSON) is frame.encode(JSON)
+    assert negotiate(["bogus", "zylos.json"]) == (JSON, "zylos.json")
+    assert negotiate([], "nope") == (JSON, None)
+    if MSGPACK in supported():
+        assert negotiate(["zylos.msgpack", "zylos.json"]) == (MSGPACK, "zylos.msgpack")
+        assert frame.encode(MSGPACK) is frame.encode(MSGPACK)
+
+    async def run():
+        # relayed frames keep the publisher's JSON text and coalesce key
+        broker = LocalBroker()
+        (m1, b1), (m2, b2) = await _instance(broker), await _instance(broker)
+        s2 = _FakeSocket()
+        await m2.connect("alice", s2, subprotocol="zylos.json")
+        await _settle()
+        await b1.publish_frame("alice", frame)
+        await _settle()
+        assert s2.subprotocol == "zylos.json" and s2.frames == [frame.json]
+        await b1.stop()
+        await b2.stop()
+
+    asyncio.run(run())
+
+
+def test_heartbeat_wheel_pings_then_reaps_idle_sockets():
+    async def run():
+        manager = InMemoryWSManager(queue_size=64, policy="disconnect", heartbeat_interval=3, heartbeat_tick=1, idle_timeout=5)
+        wheel = manager.heartbeat
+        quiet, chatty = _FakeSocket(), _FakeSocket()
+        await manager.connect("alice", quiet)
+        chatty_id = await manager.connect("alice", chatty)
+        base = min(c.last_rx for c in manager.connections.values())
+
+        for _ in range(3):  # one full turn: both idle for an interval -> pinged
+            wheel.advance(now=base + 3)
+        await _settle()
+        assert wheel.pings_sent == 2 and json.loads(quiet.frames[-1]) == {"type": "ping"}
+
+        manager.connections[chatty_id].last_rx = base + 5  # answered the ping
+        for _ in range(3):
+            wheel.advance(now=base + 6)
+        await _settle()
+        assert list(manager.connections) == [chatty_id]
+        assert wheel.stats()["reaped_last_minute"] == 1 and manager.stats()["heartbeat"]["reaped"] == 1
+        await wheel.stop()
+
+    asyncio.run(run())
+
+
+def test_push_batches_retries_and_prunes_invalid_tokens():
+    async def run():
+        provider = fcm_standin.create_app()
+        provider.state.fail_next = 1  # first request gets a 503
+        pruned = []
+
+        async def on_invalid(tokens):
+            pruned.extend(tokens)
+
+        push = PushDispatcher(
+            "http://fcm/fcm/send", "dev", batch_size=2, window=0.01, backoff_base=0.01,
+            on_invalid=on_invalid, transport=httpx.ASGITransport(app=provider),
+        )
+        tokens = ["ok-1", "ok-2", "ok-3", "flaky-1", "invalid-1"]
+        assert push.send(tokens + ["ok-1"], "Hi", "there") == 5
+        assert await push.drain(timeout=5)
+
+        stats = push.stats()
+        assert stats["delivered"] == 4 and stats["invalid_pruned"] == 1 and stats["failed"] == 0
+        assert pruned == ["invalid-1"]
+        assert all(len(b["registration_ids"]) <= 2 for b in provider.state.batches)
+        await push.stop()
+
+    asyncio.run(run())
+
+
+def _command_env(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'commands.db'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(settings, "COMMAND_ACK_TIMEOUT_SECONDS", 10.0)
+    monkeypatch.setattr(settings, "COMMAND_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(command_queue, "engine", engine)
+    manager = InMemoryWSManager(queue_size=64, policy="disconnect")
+    monkeypatch.setattr(command_queue, "ws_manager", manager)
+    return manager
+
+
+def _commands(sock):
+    return [f for f in map(json.loads, sock.frames) if f.get("type") == "command"]
+
+
+def test_command_queue_deliver_ack_complete(monkeypatch, tmp_path):
+    manager = _command_env(monkeypatch, tmp_path)
+
+    async def run():
+        # queued while offline, delivered on connect
+        queued = await command_queue.enqueue("alice", "phone", "screenshot")
+        assert queued.status == "queued"
+        sock = _FakeSocket()
+        await manager.connect("alice", sock, "phone")
+        assert await command_queue.deliver_pending("alice", "phone") == 1
+        await _settle()
+        [frame] = _commands(sock)
+        assert frame["id"] == queued.id and frame["attempt"] == 1
+        assert (await command_queue.get_command("alice", queued.id)).status == "sent"
+
+        # acks from another device or another user's socket are rejected
+        assert not await command_queue.ack("alice", "laptop", queued.id)
+        assert not await command_queue.ack("mallory", "phone", queued.id)
+        assert await command_queue.ack("alice", "phone", queued.id)
+        assert not await command_queue.complete("alice", "laptop", queued.id, True)
+        assert await command_queue.complete("alice", "phone", queued.id, True, {"path": "/s.png"})
+        done = await command_queue.get_command("alice", queued.id)
+        assert done.status == "done" and json.loads(done.result) == {"path": "/s.png"}
+        assert done.acked_at is not None and done.finished_at is not None
+
+        # finished commands can't be acked again and aren't re-sent on connect
+        assert not await command_queue.ack("alice", "phone", queued.id)
+        assert await command_queue.deliver_pending("alice", "phone") == 0
+        await command_queue.stop()
+
+    asyncio.run(run())
+
+
+def test_command_queue_resends_fails_and_expires(monkeypatch, tmp_path):
+    manager = _command_env(monkeypatch, tmp_path)
+
+    async def run():
+        sock = _FakeSocket()
+        await manager.connect("alice", sock, "phone")
+        cmd = await command_queue.enqueue("alice", "phone", "open_app", {"app_name": "calc"}, ttl_seconds=600)
+        now = datetime.utcnow()
+
+        # not acked within the timeout: resent until COMMAND_MAX_ATTEMPTS, then failed
+        assert (await command_queue.sweep(now + timedelta(seconds=5)))["resent"] == 0
+        assert (await command_queue.sweep(now + timedelta(seconds=11)))["resent"] == 1
+        assert (await command_queue.sweep(now + timedelta(seconds=22)))["resent"] == 1
+        assert (await command_queue.sweep(now + timedelta(seconds=33)))["failed"] == 1
+        await _settle()
+        assert [f["attempt"] for f in _commands(sock)] == [1, 2, 3]
+        failed = await command_queue.get_command("alice", cmd.id)
+        assert failed.status == "failed" and failed.attempts == 3
+
+        # past its TTL an open command expires, and a late ack no longer applies
+        short = await command_queue.enqueue("alice", "phone", "restart", ttl_seconds=5)
+        assert (await command_queue.sweep(datetime.utcnow() + timedelta(seconds=6)))["expired"] == 1
+        assert (await command_queue.get_command("alice", short.id)).status == "expired"
+        assert not await command_queue.ack("alice", "phone", short.id)
+        await command_queue.stop()
+
+    asyncio.run(run())
+
+
+def _outbox_env(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'outbox.db'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(settings, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(settings, "OUTBOX_MAX_PER_USER", 5)
+    monkeypatch.setattr(settings, "OUTBOX_REPLAY_BATCH", 2)
+    monkeypatch.setattr(outbox, "engine", engine)
+
+    @contextlib.asynccontextmanager
+    async def session():
+        with Session(engine) as s:
+            yield s
+
+    monkeypatch.setattr(outbox, "open_async_session", session)
+    manager = InMemoryWSManager(queue_size=64, policy="disconnect")
+    monkeypatch.setattr(outbox, "ws_manager", manager)
+    return engine, manager
+
+
+def test_outbox_seq_survives_count_and_age_trims(monkeypatch, tmp_path):
+    engine, _ = _outbox_env(monkeypatch, tmp_path)
+
+    async def run():
+        seqs = [(await outbox.record("alice", {"n": n}))["seq"] for n in range(8)]
+        assert seqs == list(range(1, 9))
+        with Session(engine) as session:
+            # count trim on append kept the newest OUTBOX_MAX_PER_USER
+            assert [r.seq for r in session.exec(select(OutboxEntry)).all()] == [4, 5, 6, 7, 8]
+            # everything ages out; the age trim still keeps the newest row
+            session.exec(update(OutboxEntry).values(created_at=datetime.utcnow() - timedelta(days=30)))
+            session.commit()
+        assert outbox.trim_expired() == 4
+        assert (await outbox.record("alice", {"n": 8}))["seq"] == 9
+        assert (await outbox.record("bob", {"n": 0}))["seq"] == 1
+
+    asyncio.run(run())
+
+
+def test_outbox_replay_batches_gaps_and_clients_ahead(monkeypatch, tmp_path):
+    _, manager = _outbox_env(monkeypatch, tmp_path)
+
+    async def replay(last_seq):
+        sock = _FakeSocket()
+        conn_id = await manager.connect("alice", sock)
+        await outbox.replay(conn_id, "alice", last_seq)
+        await _settle()
+        await manager.disconnect(conn_id)
+        return [json.loads(f) for f in sock.frames]
+
+    async def run():
+        assert await replay(0) == [{"type": "replay_done", "seq": 0}]
+        for n in range(8):
+            await outbox.record("alice", {"type": "reply", "n": n})  # seqs 4..8 retained
+
+        frames = await replay(5)  # mid-point: 6, 7, 8 in batches of two
+        assert [[i["seq"] for i in f["items"]] for f in frames[:-1]] == [[6, 7], [8]]
+        assert frames[-1] == {"type": "replay_done", "seq": 8}
+        assert (await replay(3))[0]["type"] == "batch"  # 4 is the oldest kept: no gap
+        assert await replay(8) == [{"type": "replay_done", "seq": 8}]
+        # inside the trimmed range, or ahead of the server: refetch, never "caught up"
+        assert await replay(2) == [{"type": "resync_required", "seq": 8}]
+        assert await replay(500) == [{"type": "resync_required", "seq": 8}]
+
+    asyncio.run(run())
+
+
+def test_presence_batches_updates_and_flushes_on_stop(monkeypatch, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'presence.db'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(settings, "SQLITE_BATCH_WRITER", False)
+    monkeypatch.setattr(base, "engine", engine)
+    with Session(engine) as session:
+        session.add_all([Device(id="phone", user_id="alice"), Device(id="laptop", user_id="alice")])
+        session.commit()
+    writes = []
+    real = crud.update_devices_last_seen_sql
+
+    def counted(session, seen):
+        writes.append(sorted(device_id for device_id, _, _ in seen))
+        return real(session, seen)
+
+    monkeypatch.setattr(crud, "update_devices_last_seen_sql", counted)
+
+    def stored(device_id):
+        with Session(engine) as session:
+            return session.get(Device, device_id).last_seen
+
+    async def run():
+        table = PresenceTable(flush_seconds=0.2)
+        table.connect("alice", "phone")
+        for _ in range(10):
+            table.touch("alice", "phone")
+        table.touch("alice", "laptop")
+        table.touch("mallory", "ghost")  # unknown device: matched by no row
+        await asyncio.sleep(0.35)
+        # eleven heartbeats within one interval: a single write
+        assert writes == [["ghost", "laptop", "phone"]]
+        assert table.flushes == 1
+        assert stored("phone") == table.snapshot("alice")["phone"][1]
+
+        # pending state is written on shutdown, without waiting for the interval
+        table.disconnect("alice", "phone")
+        await table.stop()
+        assert writes[1:] == [["phone"]]
+        online, last_seen = table.snapshot("alice")["phone"]
+        assert not online and stored("phone") == last_seen
+        await asyncio.sleep(0.25)
+        assert len(writes) == 2  # the flush loop is gone
+
+    asyncio.run(run())
+
+
+class _StalledSocket(_FakeSocket):
+    """A client that stops reading: sends block until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+        self.close_code = None
+
+    async def send_text(self, msg):
+        await self.release.wait()
+        self.frames.append(msg)
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+
+def test_send_queue_slow_consumer_policies():
+    def sent(sock):
+        return [json.loads(f).get("n", json.loads(f)["type"]) for f in sock.frames]
+
+    async def fill(policy, payloads):
+        manager = InMemoryWSManager(queue_size=3, policy=policy)
+        sock = _StalledSocket()
+        conn_id = await manager.connect("alice", sock)
+        await _settle()  # the writer is parked on an empty queue
+        for payload in payloads:
+            await manager.send_personal("alice", payload)
+        return manager, sock, conn_id
+
+    async def run():
+        replies = [{"type": "reply", "n": n} for n in range(6)]
+
+        # drop: the queue stays bounded, the oldest frames go
+        manager, sock, conn_id = await fill("drop", replies)
+        assert len(manager.connections[conn_id].pending) == 3 and manager.dropped == 3
+        sock.release.set()
+        await _settle()
+        assert sent(sock) == [3, 4, 5]
+        await manager.disconnect(conn_id)
+
+        # disconnect: one frame past the bound closes the socket with 1013
+        manager, sock, conn_id = await fill("disconnect", replies[:4])
+        await _settle()
+        assert manager.slow_disconnects == 1 and sock.close_code == 1013
+        assert conn_id not in manager.connections and not manager.is_connected("alice")
+
+        # coalesce: a newer frame of the same type replaces the queued one...
+        frames = [replies[0], {"type": "typing", "v": 1}, replies[1], {"type": "typing", "v": 2}]
+        manager, sock, conn_id = await fill("coalesce", frames)
+        assert manager.coalesced == 1 and manager.slow_disconnects == 0
+        queued = [json.loads(msg) for _, msg in manager.connections[conn_id].pending]
+        assert queued == [replies[0], replies[1], {"type": "typing", "v": 2}]
+        # ...and a full queue without one to replace still disconnects
+        await manager.send_personal("alice", replies[2])
+        await _settle()
+        assert manager.slow_disconnects == 1 and sock.close_code == 1013
+
+    asyncio.run(run())
+
+
+def test_websocket_answers_malformed_frames(monkeypatch):
+    from types import SimpleNamespace
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import websocket
+
+    async def authenticate(user_id, jwt):
+        return SimpleNamespace(id=user_id) if jwt == "good" else None
+
+    monkeypatch.setattr(websocket, "_authenticate", authenticate)
+    monkeypatch.setattr(websocket, "ws_manager", InMemoryWSManager(queue_size=64, policy="disconnect"))
+    app = FastAPI()
+    app.include_router(websocket.router)
+    with TestClient(app).websocket_connect("/ws/alice?token=good") as ws:
+        ws.send_text("{not json")
+        assert ws.receive_json() == {"type": "error", "id": None, "error": "bad_frame"}
+        ws.send_bytes(b"\xc1")  # never valid MessagePack (nor decodable without it)
+        assert ws.receive_json() == {"type": "error", "id": None, "error": "bad_frame"}
+        ws.send_json({"type": "resume", "last_seq": "abc"})
+        assert ws.receive_json() == {"type": "error", "id": None, "error": "bad_request"}
+        # still open
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
@@ -0,0 +1,91 @@
+# app/tests/test_tools.py
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.ai.tools import http_client
+from app.ai.tools.tool_cache import CachePolicy, ToolCache
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_client_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/x"
+    try:
+        for _ in range(3):
+            assert http_client.get(url, params={"q": "a"}, timeout=2.0).json() == {"ok": True}
+
+        async def async_calls():
+            for _ in range(2):
+                await http_client.aget(url, timeout=2.0)
+            await http_client.aclose()
+
+        asyncio.run(async_calls())
+        host = http_client.stats()["hosts"]["127.0.0.1"]
+        # one socket for the sync pool, one for the async pool; the rest reused
+        assert host["requests"] == 5
+        assert host["new_connections"] == 2
+        assert host["reused"] == 3
+    finally:
+        http_client.close()
+        server.shutdown()
+
+
+def test_tool_cache_tiers_and_stale_while_revalidate(tmp_path):
+    now = [1000.0]
+    calls = []
+    release = threading.Event()
+
+    def lookup(city: str) -> str:
+        calls.append(city)
+        if len(calls) == 2:
+            release.wait(2)  # slow upstream on the revalidation
+        return f"sunny in {city} #{len(calls)}"
+
+    policy = CachePolicy(ttl=60, stale=600, errors=("failed",))
+    path = str(tmp_path / "tools.db")
+    cache = ToolCache(path, revalidate_wait=0.05, clock=lambda: now[0])
+
+    assert cache.call("weather", policy, lookup, ("Mumbai",), {}) == "sunny in Mumbai #1"
+    # same call after normalization: served from memory
+    assert cache.call("weather", policy, lookup, (), {"city": " mumbai "}) == "sunny in Mumbai #1"
+    assert len(calls) == 1
+
+    # a new process reads the persistent tier
+    cache.close()
+    cache = ToolCache(path, revalidate_wait=0.05, clock=lambda: now[0])
+    assert cache.call("weather", policy, lookup, ("Mumbai",), {}) == "sunny in Mumbai #1"
+    assert cache.stats()["disk_hits"] == 1
+
+    # stale + slow upstream: stale value now, refreshed value once it lands
+    now[0] += 120
+    assert cache.call("weather", policy, lookup, ("Mumbai",), {}) == "sunny in Mumbai #1"
+    assert cache.stats()["stale_served"] == 1
+    release.set()
+    deadline = time.time() + 2
+    while cache.stats()["revalidated"] < 1 and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.call("weather", policy, lookup, ("Mumbai",), {}) == "sunny in Mumbai #2"
+
+    # failures are not cached; past the stale window the tool runs inline
+    assert cache.call("weather", policy, lambda city: "failed", ("Pune",), {}) == "failed"
+    assert cache.call("weather", policy, lookup, ("Pune",), {}) == "sunny in Pune #3"
+    now[0] += 1000
+    assert cache.call("weather", policy, lookup, ("Pune",), {}) == "sunny in Pune #4"
+    cache.close()
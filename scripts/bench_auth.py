@@ -0,0 +1,108 @@
+# scripts/bench_auth.py
+"""
+Login-storm benchmark.
+
+Fires a burst of concurrent logins while probing an unrelated authenticated
+endpoint, and reports logins/sec, 503 rejections and probe latency (p50/p99).
+Runs the app in-process against a throwaway SQLite DB.
+
+    PYTHONPATH=. python scripts/bench_auth.py --logins 200 --concurrency 64
+    PYTHONPATH=. python scripts/bench_auth.py --workers 0     # threadpool baseline
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def _bench(args):
+    import httpx
+    from fastapi import FastAPI
+    from app.api import routes_auth, routes_devices
+    from app.core.hashing_pool import hashing_pool
+    from app.database.base import init_db
+
+    init_db()
+    app = FastAPI()
+    app.include_router(routes_auth.router, prefix="/api")
+    app.include_router(routes_devices.router, prefix="/api")
+
+    creds = {"email": "bench@example.com", "password": "correct horse battery staple"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        hashing_pool.warm_up()
+        r = await client.post("/api/auth/register", json=creds)
+        headers = {"Authorization": f"Bearer {r.json()['token']}"}
+
+        probe_latencies = []
+        done = asyncio.Event()
+
+        async def probe():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                await client.get("/api/devices/list", headers=headers)
+                probe_latencies.append((time.perf_counter() - t0) * 1000)
+                await asyncio.sleep(args.probe_interval_ms / 1000)
+
+        sem = asyncio.Semaphore(args.concurrency)
+        statuses = {}
+
+        async def login():
+            async with sem:
+                r = await client.post("/api/auth/token", json=creds)
+                statuses[r.status_code] = statuses.get(r.status_code, 0) + 1
+
+        probe_task = asyncio.create_task(probe())
+        t0 = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await probe_task
+
+    ok = statuses.get(200, 0)
+    print(f"hash workers:      {args.workers} ({'threadpool' if args.workers == 0 else 'processes'})")
+    print(f"logins:            {args.logins} (concurrency {args.concurrency}) in {elapsed:.2f}s")
+    print(f"status counts:     {dict(sorted(statuses.items()))}")
+    print(f"logins/sec:        {ok / elapsed:.1f}")
+    print(f"probe requests:    {len(probe_latencies)}")
+    print(f"probe p50 / p99:   {_percentile(probe_latencies, 50):.1f} ms / {_percentile(probe_latencies, 99):.1f} ms")
+    print(f"pool:              {hashing_pool.stats()}")
+    hashing_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logins under load")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=None, help="AUTH_HASH_WORKERS override (0 = threadpool)")
+    parser.add_argument("--queue", type=int, default=None, help="AUTH_HASH_QUEUE override")
+    parser.add_argument("--probe-interval-ms", type=float, default=10.0)
+    args = parser.parse_args()
+
+    # settings are read at import time, so configure the environment first
+    tmp = tempfile.mkdtemp(prefix="zylos-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+    if args.workers is not None:
+        os.environ["AUTH_HASH_WORKERS"] = str(args.workers)
+    if args.queue is not None:
+        os.environ["AUTH_HASH_QUEUE"] = str(args.queue)
+    from app.core.config import settings
+    args.workers = settings.AUTH_HASH_WORKERS
+
+    asyncio.run(_bench(args))
+
+
+if __name__ == "__main__":
+    main()
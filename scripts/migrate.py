@@ -1,20 +1,31 @@
 # scripts/migrate.py
 """
-Lightweight migration helper.
-For production use Alembic. This script will:
+Migration helper. This script will:
 - create missing tables (non-destructive)
+- apply pending versioned migrations (app/database/migrations.py)
 - print a short summary
+
+Usage:
+    python scripts/migrate.py            # migrate
+    python scripts/migrate.py --status   # list applied / pending versions
 """
-from app.database.base import init_db
+import sys
 import logging
 
+from app.database.base import engine, init_db
+from app.database.migrations import applied_versions, pending_migrations
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("migrate")
 
 def main():
-    logger.info("Running lightweight migration (create missing tables)...")
+    if "--status" in sys.argv[1:]:
+        logger.info("Applied: %s", applied_versions(engine))
+        logger.info("Pending: %s", [f"{v:03d}_{n}" for v, n, _ in pending_migrations(engine)])
+        return
+    logger.info("Running migrations (create missing tables + versioned migrations)...")
     init_db()
-    logger.info("Migration complete. (Use Alembic for structured migrations.)")
+    logger.info("Migration complete. Schema at version %s.", (applied_versions(engine) or [0])[-1])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()